@@ -0,0 +1,130 @@
+'''
+mlu.library.analytics
+
+Module for computing aggregate statistics (total duration, bitrate distribution, sample rate and
+bit depth histograms, etc.) over the properties of many audio files at once. The numeric
+properties are exported to a NumPy structured array, with one row per file, and the aggregates
+are computed on its columns with vectorized NumPy operations.
+
+Property values that are missing or not numeric (e.g. the bit depth of an mp3 file, which is
+empty) are stored as NaN and are left out of the aggregates.
+'''
+
+import math
+
+import numpy
+
+# Numeric fields of AudioFileProperties that are exported, in column order
+NUMERIC_PROPERTY_FIELDS = [
+    'duration',
+    'bitRate',
+    'sampleRate',
+    'numChannels',
+    'bitDepth',
+    'fileSize'
+]
+
+PROPERTIES_ARRAY_DTYPE = numpy.dtype([(fieldName, numpy.float64) for fieldName in NUMERIC_PROPERTY_FIELDS])
+
+def getPropertiesArray(audioFilePropertiesList):
+    '''
+    Returns a NumPy structured array (dtype PROPERTIES_ARRAY_DTYPE) with a row of the numeric
+    property values of each of the given AudioFileProperties objects.
+    '''
+    rows = [_getPropertiesRow(audioFileProperties) for audioFileProperties in audioFilePropertiesList]
+    return numpy.array(rows, dtype=PROPERTIES_ARRAY_DTYPE)
+
+def getPropertiesArrayFromIndex(audioFileIndex):
+    '''
+    Returns the properties array (see getPropertiesArray()) of all the files in the given
+    mlu.library.index.AudioFileIndex.
+    '''
+    return getPropertiesArray(properties for audioFilepath, tags, properties in audioFileIndex.iterEntries())
+
+def getPropertiesColumns(propertiesArray):
+    '''
+    Returns a dict of field name to a 1-D array of the values of that field, for the given
+    properties array.
+    '''
+    return {fieldName: propertiesArray[fieldName] for fieldName in NUMERIC_PROPERTY_FIELDS}
+
+def getTotalDuration(propertiesArray):
+    '''
+    Returns the total duration (seconds) of the files in the given properties array.
+    '''
+    return float(numpy.nansum(propertiesArray['duration']))
+
+def getTotalFileSize(propertiesArray):
+    '''
+    Returns the total size (bytes) of the files in the given properties array.
+    '''
+    return float(numpy.nansum(propertiesArray['fileSize']))
+
+def getFieldSummary(propertiesArray, fieldName):
+    '''
+    Returns a dict with the count (of files with a value), min, max, mean, median and sum of the
+    values of the given field. The statistics are None if no file has a value for the field.
+    '''
+    fieldValues = _getKnownValues(propertiesArray, fieldName)
+    if (fieldValues.size == 0):
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None, 'sum': None}
+
+    return {
+        'count': int(fieldValues.size),
+        'min': float(fieldValues.min()),
+        'max': float(fieldValues.max()),
+        'mean': float(fieldValues.mean()),
+        'median': float(numpy.median(fieldValues)),
+        'sum': float(fieldValues.sum())
+    }
+
+def getValueCounts(propertiesArray, fieldName):
+    '''
+    Returns a dict of each distinct value of the given field to the number of files that have that
+    value, e.g. a sample rate or bit depth histogram.
+    '''
+    fieldValues = _getKnownValues(propertiesArray, fieldName)
+    distinctValues, counts = numpy.unique(fieldValues, return_counts=True)
+
+    return {_getPlainNumber(value): int(count) for value, count in zip(distinctValues, counts)}
+
+def getHistogram(propertiesArray, fieldName, bins=10):
+    '''
+    Returns a (counts, binEdges) tuple of arrays, the histogram of the values of the given field
+    (see numpy.histogram for the values that bins can take), e.g. a bitrate distribution.
+    '''
+    fieldValues = _getKnownValues(propertiesArray, fieldName)
+    return numpy.histogram(fieldValues, bins=bins)
+
+def getPercentiles(propertiesArray, fieldName, percentiles=(50, 90, 99)):
+    '''
+    Returns a dict of each of the given percentiles to that percentile of the values of the given
+    field (None for all of them if no file has a value for the field).
+    '''
+    fieldValues = _getKnownValues(propertiesArray, fieldName)
+    if (fieldValues.size == 0):
+        return {percentile: None for percentile in percentiles}
+
+    percentileValues = numpy.percentile(fieldValues, percentiles)
+    return {percentile: float(value) for percentile, value in zip(percentiles, percentileValues)}
+
+def _getPropertiesRow(audioFileProperties):
+    return tuple(_getNumericValue(getattr(audioFileProperties, fieldName)) for fieldName in NUMERIC_PROPERTY_FIELDS)
+
+def _getNumericValue(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _getKnownValues(propertiesArray, fieldName):
+    fieldValues = propertiesArray[fieldName]
+    return fieldValues[~numpy.isnan(fieldValues)]
+
+def _getPlainNumber(value):
+    # Whole numbers (sample rates, bit depths, channel counts) are returned as ints
+    value = float(value)
+    if (value.is_integer()):
+        return int(value)
+
+    return value
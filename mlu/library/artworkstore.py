@@ -0,0 +1,323 @@
+'''
+mlu.library.artworkstore
+
+Module containing a cache of the artwork embedded in audio files. Each distinct image is stored
+once, under the hash of its content, no matter how many files it is embedded in (e.g. the cover
+of an album is stored once for all the tracks of the album). Resized thumbnails of the images are
+generated on demand and cached alongside them.
+
+The cache has a size limit: once it is over the limit, the least recently used images and
+thumbnails are removed.
+'''
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+from PIL import Image
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+from mlu.settings import MLUSettings
+from mlu.tags import io
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_STORE_DIRNAME = 'artwork'
+DEFAULT_MAX_SIZE_BYTES = 512 * 1024 * 1024
+INDEX_FILENAME = 'artwork-store.sqlite'
+
+# File extension of the stored images, by mime type (other images are stored as .bin)
+IMAGE_FILE_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/bmp': 'bmp',
+    'image/webp': 'webp'
+}
+
+def getArtworkHash(artworkData):
+    '''
+    Returns the content hash (hex SHA-256) of the given picture data (bytes-like, e.g. the data
+    view of an EmbeddedArtwork).
+    '''
+    return hashlib.sha256(artworkData).hexdigest()
+
+class ArtworkStore:
+    '''
+    Class for the content-addressed artwork cache.
+
+    Params:
+        storeDir: directory of the cache, defaults to a directory in the MLU cache dir
+        maxSizeBytes: total size of the images and thumbnails that the cache is kept under
+    '''
+    def __init__(self, storeDir=None, maxSizeBytes=DEFAULT_MAX_SIZE_BYTES):
+        if (storeDir is None):
+            storeDir = mypycommons.file.joinPaths(MLUSettings.cacheDir, DEFAULT_STORE_DIRNAME)
+
+        self.storeDir = storeDir
+        self.maxSizeBytes = maxSizeBytes
+
+        MLUSettings.createDirectory(self.storeDir)
+        self._connection = sqlite3.connect(mypycommons.file.joinPaths(self.storeDir, INDEX_FILENAME))
+        self._createTables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def getAudioFileArtworkHashes(self, audioFilepath):
+        '''
+        Returns the content hashes of the pictures embedded in the given audio file, in the order
+        that they are stored in the file, storing any image that is not in the cache yet. The
+        pictures of a file are only read again once the file changes on disk. The returned images
+        are marked as used, and are not evicted by this call even if the cache is over its limit.
+        '''
+        audioFilepath = os.path.abspath(audioFilepath)
+        fileStat = os.stat(audioFilepath)
+        signature = (fileStat.st_size, fileStat.st_mtime_ns)
+
+        storedHashes = self._getStoredAudioFileArtworkHashes(audioFilepath, signature)
+        if (storedHashes is not None and all(self._imageIsStored(artworkHash) for artworkHash in storedHashes)):
+            self._touchImages(storedHashes)
+            return storedHashes
+
+        artworkHashes = []
+        with io.AudioFileMetadataHandler(audioFilepath).getEmbeddedArtwork() as artworks:
+            for artwork in artworks:
+                artworkHash = getArtworkHash(artwork.data)
+                if (not self._imageIsStored(artworkHash)):
+                    self._storeImage(artworkHash, artwork)
+
+                artworkHashes.append(artworkHash)
+
+        with self._connection:
+            self._connection.execute("DELETE FROM audio_file_artwork WHERE path = ?", (audioFilepath,))
+            self._connection.executemany(
+                "INSERT INTO audio_file_artwork (path, size, mtime_ns, picture_index, hash) VALUES (?, ?, ?, ?, ?)",
+                [(audioFilepath,) + signature + (pictureIndex, artworkHash) for pictureIndex, artworkHash in enumerate(artworkHashes)]
+            )
+            # Also remember files without any pictures, so that they are not read again
+            if (not artworkHashes):
+                self._connection.execute(
+                    "INSERT INTO audio_file_artwork (path, size, mtime_ns, picture_index, hash) VALUES (?, ?, ?, -1, NULL)",
+                    (audioFilepath,) + signature
+                )
+
+        self._touchImages(artworkHashes)
+        self.evict(keepHashes=artworkHashes)
+        return artworkHashes
+
+    def getImagePath(self, artworkHash):
+        '''
+        Returns the filepath of the stored image with the given content hash, or None if the image
+        is not in the cache.
+        '''
+        row = self._connection.execute("SELECT path FROM images WHERE hash = ?", (artworkHash,)).fetchone()
+        if (row is None):
+            return None
+
+        self._touch('images', "hash = ?", (artworkHash,))
+        return self._getAbsolutePath(row[0])
+
+    def getImageMimeType(self, artworkHash):
+        row = self._connection.execute("SELECT mime FROM images WHERE hash = ?", (artworkHash,)).fetchone()
+        return (row[0] if (row is not None) else None)
+
+    def getThumbnailPath(self, artworkHash, maxSize):
+        '''
+        Returns the filepath of a thumbnail of the image with the given content hash, resized to
+        fit in a maxSize x maxSize square (keeping its aspect ratio), generating it if it is not in
+        the cache yet. Returns None if the image is not in the cache.
+        '''
+        row = self._connection.execute(
+            "SELECT path FROM thumbnails WHERE hash = ? AND max_size = ?", (artworkHash, maxSize)
+        ).fetchone()
+        if (row is not None):
+            self._touch('thumbnails', "hash = ? AND max_size = ?", (artworkHash, maxSize))
+            self._touch('images', "hash = ?", (artworkHash,))
+            return self._getAbsolutePath(row[0])
+
+        imagePath = self.getImagePath(artworkHash)
+        if (imagePath is None):
+            return None
+
+        thumbnailPath = self._createThumbnail(artworkHash, imagePath, maxSize)
+        self.evict(keepHashes=[artworkHash])
+        return thumbnailPath
+
+    def getTotalSize(self):
+        '''
+        Returns the total size (bytes) of the images and thumbnails in the cache.
+        '''
+        totalSize = 0
+        for tableName in ['images', 'thumbnails']:
+            totalSize += self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM {}".format(tableName)).fetchone()[0]
+
+        return totalSize
+
+    def evict(self, keepHashes=()):
+        '''
+        Removes the least recently used images and thumbnails until the cache is under its size
+        limit. Removing an image also removes its thumbnails. The images (and thumbnails) with the
+        given hashes are kept, even if the cache stays over its limit. Returns the number of bytes
+        freed.
+        '''
+        excessSize = self.getTotalSize() - self.maxSizeBytes
+        if (excessSize <= 0):
+            return 0
+
+        entries = self._connection.execute(
+            "SELECT 'images', hash, NULL, last_used FROM images "
+            "UNION ALL SELECT 'thumbnails', hash, max_size, last_used FROM thumbnails "
+            "ORDER BY last_used"
+        ).fetchall()
+
+        freedSize = 0
+        for tableName, artworkHash, maxSize, lastUsed in entries:
+            if (freedSize >= excessSize):
+                break
+
+            if (artworkHash in keepHashes):
+                continue
+
+            if (tableName == 'images'):
+                freedSize += self._removeImage(artworkHash)
+            else:
+                freedSize += self._removeThumbnail(artworkHash, maxSize)
+
+        logger.debug("Evicted {} bytes from the artwork store '{}'".format(freedSize, self.storeDir))
+        return freedSize
+
+    def _createTables(self):
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, mime TEXT, path TEXT, size INTEGER, last_used REAL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS thumbnails (hash TEXT, max_size INTEGER, path TEXT, size INTEGER, last_used REAL, PRIMARY KEY (hash, max_size))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS audio_file_artwork (path TEXT, size INTEGER, mtime_ns INTEGER, picture_index INTEGER, hash TEXT)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS audio_file_artwork_path ON audio_file_artwork (path)")
+
+    def _getStoredAudioFileArtworkHashes(self, audioFilepath, signature):
+        rows = self._connection.execute(
+            "SELECT size, mtime_ns, picture_index, hash FROM audio_file_artwork WHERE path = ? ORDER BY picture_index",
+            (audioFilepath,)
+        ).fetchall()
+
+        if (not rows or any(tuple(row[:2]) != signature for row in rows)):
+            return None
+
+        return [row[3] for row in rows if (row[2] >= 0)]
+
+    def _imageIsStored(self, artworkHash):
+        return (self._connection.execute("SELECT 1 FROM images WHERE hash = ?", (artworkHash,)).fetchone() is not None)
+
+    def _storeImage(self, artworkHash, artwork):
+        fileExtension = IMAGE_FILE_EXTENSIONS.get(artwork.mimeType.lower(), 'bin')
+        relativePath = os.path.join('images', artworkHash[:2], "{}.{}".format(artworkHash, fileExtension))
+
+        self._writeFile(relativePath, artwork.writeTo)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images (hash, mime, path, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (artworkHash, artwork.mimeType, relativePath, artwork.length, time.time())
+            )
+
+    def _createThumbnail(self, artworkHash, imagePath, maxSize):
+        with Image.open(imagePath) as image:
+            image.thumbnail((maxSize, maxSize))
+
+            # Keep transparency in PNG thumbnails, store everything else as JPEG
+            if (image.mode in ('RGBA', 'LA', 'P')):
+                thumbnailFormat = 'PNG'
+            else:
+                thumbnailFormat = 'JPEG'
+                if (image.mode != 'RGB'):
+                    image = image.convert('RGB')
+
+            relativePath = os.path.join('thumbnails', artworkHash[:2], "{}-{}.{}".format(artworkHash, maxSize, thumbnailFormat.lower()))
+            self._writeFile(relativePath, lambda thumbnailFile: image.save(thumbnailFile, format=thumbnailFormat))
+
+        thumbnailPath = self._getAbsolutePath(relativePath)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO thumbnails (hash, max_size, path, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (artworkHash, maxSize, relativePath, os.path.getsize(thumbnailPath), time.time())
+            )
+
+        return thumbnailPath
+
+    def _writeFile(self, relativePath, writeFunc):
+        # Write to a temp file first, so that a partly written file is never left at the path
+        filepath = self._getAbsolutePath(relativePath)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        tempFilepath = "{}.{}.tmp".format(filepath, os.getpid())
+        try:
+            with open(tempFilepath, 'wb') as tempFile:
+                writeFunc(tempFile)
+            os.replace(tempFilepath, filepath)
+        except:
+            if (os.path.exists(tempFilepath)):
+                os.remove(tempFilepath)
+            raise
+
+    def _removeImage(self, artworkHash):
+        freedSize = 0
+        thumbnailRows = self._connection.execute("SELECT max_size FROM thumbnails WHERE hash = ?", (artworkHash,)).fetchall()
+        for row in thumbnailRows:
+            freedSize += self._removeThumbnail(artworkHash, row[0])
+
+        row = self._connection.execute("SELECT path, size FROM images WHERE hash = ?", (artworkHash,)).fetchone()
+        if (row is not None):
+            self._removeFile(row[0])
+            freedSize += row[1]
+            with self._connection:
+                self._connection.execute("DELETE FROM images WHERE hash = ?", (artworkHash,))
+
+        return freedSize
+
+    def _removeThumbnail(self, artworkHash, maxSize):
+        row = self._connection.execute(
+            "SELECT path, size FROM thumbnails WHERE hash = ? AND max_size = ?", (artworkHash, maxSize)
+        ).fetchone()
+        if (row is None):
+            return 0
+
+        self._removeFile(row[0])
+        with self._connection:
+            self._connection.execute("DELETE FROM thumbnails WHERE hash = ? AND max_size = ?", (artworkHash, maxSize))
+
+        return row[1]
+
+    def _removeFile(self, relativePath):
+        try:
+            os.remove(self._getAbsolutePath(relativePath))
+        except FileNotFoundError:
+            pass
+
+    def _touchImages(self, artworkHashes):
+        for artworkHash in artworkHashes:
+            self._touch('images', "hash = ?", (artworkHash,))
+
+    def _touch(self, tableName, whereClause, whereParams):
+        with self._connection:
+            self._connection.execute(
+                "UPDATE {} SET last_used = ? WHERE {}".format(tableName, whereClause), (time.time(),) + tuple(whereParams)
+            )
+
+    def _getAbsolutePath(self, relativePath):
+        return os.path.join(self.storeDir, relativePath)
@@ -0,0 +1,196 @@
+'''
+mlu.library.dedupe
+
+Module for finding duplicate tracks in a music library: files with the same audio, whatever
+their tags.
+
+Comparing every file with every other file (or hashing every whole file) doesn't scale to a large
+library, so this is done in two steps:
+
+    1. blocking: files are grouped into candidate groups by their normalized artist and title, and
+       split by duration (files whose durations are within a tolerance of each other), from the
+       indexed tags and properties. No file is read.
+    2. within each candidate group of two or more files, the audio payload of each file (the file
+       content without its tag blocks, see mlu.tags.payload) is hashed: files with the same payload
+       hash are exact duplicates, even if their tags differ.
+
+The members of a candidate group that didn't match any other member exactly (e.g. the same track
+ripped to FLAC and to MP3) are reported as possible duplicates.
+'''
+
+import os
+import re
+import logging
+
+from mlu.library import search
+from mlu.library import fingerprint
+
+logger = logging.getLogger("mluGlobalLogger")
+
+# Files whose durations (seconds) are within this of each other are candidates for being the same
+DEFAULT_DURATION_TOLERANCE_SECONDS = 2.0
+
+# Parts of titles that differ between releases of the same recording, e.g. 'Song (Remastered)'
+_TITLE_SUFFIX_PATTERN = re.compile(r'\s*[\(\[][^\)\]]*(remaster|version|edit|mono|stereo)[^\)\]]*[\)\]]\s*$', re.IGNORECASE)
+
+class DuplicateGroup:
+    '''
+    Data structure holding a group of audio files that are duplicates: with the same audio payload
+    hash (exact duplicates), or with the same normalized artist/title and duration (possible
+    duplicates, payloadHash is then None).
+    '''
+    def __init__(self, audioFilepaths, payloadHash=None):
+        self.audioFilepaths = audioFilepaths
+        self.payloadHash = payloadHash
+
+    def isExact(self):
+        return (self.payloadHash is not None)
+
+class DedupeReport:
+    '''
+    Data structure holding the result of a dedupe run: the exact and possible DuplicateGroup lists,
+    the number of files considered and hashed, and the errors of the files that failed to be hashed,
+    by filepath.
+    '''
+    def __init__(self):
+        self.exactGroups = []
+        self.possibleGroups = []
+        self.filesConsidered = 0
+        self.filesHashed = 0
+        self.errors = {}
+
+    def getDuplicateFileCount(self):
+        '''
+        Returns the number of files that could be removed: all but one of each exact group.
+        '''
+        return sum(len(group.audioFilepaths) - 1 for group in self.exactGroups)
+
+    def __str__(self):
+        return "files considered: {}, hashed: {}, exact duplicate groups: {} ({} redundant files), possible duplicate groups: {}, errors: {}".format(
+            self.filesConsidered, self.filesHashed, len(self.exactGroups), self.getDuplicateFileCount(), len(self.possibleGroups), len(self.errors)
+        )
+
+def normalizeTrackText(text):
+    '''
+    Returns the given artist or title normalized for blocking: case folded, without diacritics and
+    punctuation, and with whitespace collapsed.
+    '''
+    return ' '.join(search.tokenize(text or ''))
+
+def getBlockingKey(audioFileTags):
+    '''
+    Returns the (artist, title) key that the given AudioFileTags are grouped by, normalized, or None
+    if the tags have no title.
+    '''
+    title = normalizeTrackText(_TITLE_SUFFIX_PATTERN.sub('', audioFileTags.title or ''))
+    if (not title):
+        return None
+
+    artist = normalizeTrackText(audioFileTags.artist or audioFileTags.albumArtist)
+    return (artist, title)
+
+def findCandidateGroups(entries, durationToleranceSeconds=DEFAULT_DURATION_TOLERANCE_SECONDS):
+    '''
+    Returns the list of candidate groups (lists of two or more audio filepaths) of the given entries,
+    by blocking key and duration. Files without a title are not grouped; files without a duration
+    (e.g. indexed from a tags-only scan) are grouped by blocking key only.
+
+    Params:
+        entries: iterable of (audio filepath, AudioFileTags, AudioFileProperties or None) tuples,
+            as yielded by mlu.library.index.AudioFileIndex.iterEntries()
+        durationToleranceSeconds: maximum duration difference of neighbouring files in a group
+    '''
+    blocks = {}
+    for audioFilepath, tags, properties in entries:
+        blockingKey = getBlockingKey(tags)
+        if (blockingKey is None):
+            continue
+
+        duration = properties.duration if (properties is not None) else None
+        blocks.setdefault(blockingKey, []).append((duration, audioFilepath))
+
+    candidateGroups = []
+    for blockFiles in blocks.values():
+        if (len(blockFiles) < 2):
+            continue
+
+        unknownDurationFiles = [audioFilepath for duration, audioFilepath in blockFiles if (duration is None)]
+        if (len(unknownDurationFiles) >= 2):
+            candidateGroups.append(unknownDurationFiles)
+
+        # Split the files sorted by duration wherever the gap to the previous file is too large
+        knownDurationFiles = sorted((duration, audioFilepath) for duration, audioFilepath in blockFiles if (duration is not None))
+        group = []
+        previousDuration = None
+        for duration, audioFilepath in knownDurationFiles:
+            if (group and duration - previousDuration > durationToleranceSeconds):
+                if (len(group) >= 2):
+                    candidateGroups.append(group)
+                group = []
+
+            group.append(audioFilepath)
+            previousDuration = duration
+
+        if (len(group) >= 2):
+            candidateGroups.append(group)
+
+    return candidateGroups
+
+def findDuplicates(entries, durationToleranceSeconds=DEFAULT_DURATION_TOLERANCE_SECONDS, workers=fingerprint.DEFAULT_HASH_WORKERS, fingerprintCache=None):
+    '''
+    Finds the duplicate audio files among the given entries (see findCandidateGroups()) and returns
+    a DedupeReport. Only the files of candidate groups are read, to hash their audio payload, and
+    with an mlu.library.fingerprint.AudioPayloadFingerprintCache, only those that changed since
+    their payload was last hashed (an in-memory cache is used if none is given).
+    '''
+    report = DedupeReport()
+
+    def countEntries():
+        for entry in entries:
+            report.filesConsidered += 1
+            yield entry
+
+    candidateGroups = findCandidateGroups(countEntries(), durationToleranceSeconds)
+    candidateFilepaths = [audioFilepath for group in candidateGroups for audioFilepath in group]
+
+    if (fingerprintCache is None):
+        with fingerprint.AudioPayloadFingerprintCache(':memory:') as memoryCache:
+            cachedHashes, cachedErrors = memoryCache.getPayloadHashes(candidateFilepaths, workers=workers)
+    else:
+        cachedHashes, cachedErrors = fingerprintCache.getPayloadHashes(candidateFilepaths, workers=workers)
+
+    payloadHashes = {}
+    for audioFilepath in candidateFilepaths:
+        absoluteFilepath = os.path.abspath(audioFilepath)
+        if (absoluteFilepath in cachedErrors):
+            report.errors[audioFilepath] = cachedErrors[absoluteFilepath]
+        else:
+            payloadHashes[audioFilepath] = cachedHashes[absoluteFilepath]
+            report.filesHashed += 1
+
+    for group in candidateGroups:
+        filesByHash = {}
+        for audioFilepath in group:
+            if (audioFilepath in payloadHashes):
+                filesByHash.setdefault(payloadHashes[audioFilepath], []).append(audioFilepath)
+
+        unmatchedFilepaths = []
+        for payloadHash, audioFilepaths in filesByHash.items():
+            if (len(audioFilepaths) >= 2):
+                report.exactGroups.append(DuplicateGroup(sorted(audioFilepaths), payloadHash))
+            else:
+                unmatchedFilepaths.extend(audioFilepaths)
+
+        # Unmatched files are possible duplicates of each other, or of the exact duplicates
+        if (unmatchedFilepaths and (len(unmatchedFilepaths) >= 2 or len(filesByHash) > 1)):
+            report.possibleGroups.append(DuplicateGroup(sorted(group)))
+
+    logger.info("Dedupe finished: {}".format(report))
+    return report
+
+def findDuplicatesInIndex(audioFileIndex, durationToleranceSeconds=DEFAULT_DURATION_TOLERANCE_SECONDS, workers=fingerprint.DEFAULT_HASH_WORKERS, fingerprintCache=None):
+    '''
+    Finds the duplicate audio files of the given mlu.library.index.AudioFileIndex. See
+    findDuplicates().
+    '''
+    return findDuplicates(audioFileIndex.iterEntries(), durationToleranceSeconds=durationToleranceSeconds, workers=workers, fingerprintCache=fingerprintCache)
@@ -0,0 +1,201 @@
+'''
+mlu.library.fingerprint
+
+Module containing a persistent (SQLite) cache of the audio payload hashes of audio files (see
+mlu.tags.payload), to tell a change of the tags of a file from a change of its audio.
+
+Writing tags (e.g. play counts) changes the modification time of a file, so tools that compare
+files by their stat or by a hash of the whole file (backup, sync) see every retagged file as
+changed. The payload hash of each file is stored with the file's stat signature: a file whose
+signature didn't change is not read, and a file whose signature changed is classified by hashing
+its payload only once and comparing it with the stored hash.
+'''
+
+import os
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+from mlu.settings import MLUSettings
+from mlu.tags import payload
+from mlu.library import index
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_CACHE_FILENAME = 'payload-fingerprints.sqlite'
+
+# Number of threads hashing audio payloads
+DEFAULT_HASH_WORKERS = 4
+
+# Kinds of change of an audio file, as returned by AudioPayloadFingerprintCache.classifyChanges()
+CHANGE_UNCHANGED = 'unchanged'
+CHANGE_TAGS_ONLY = 'tagsOnly'
+CHANGE_AUDIO = 'audio'
+CHANGE_NEW = 'new'
+
+class AudioPayloadFingerprintCache:
+    '''
+    Class for the persistent cache of the audio payload hashes of audio files.
+
+    Params:
+        cacheFilepath: filepath of the cache database file, defaults to a file in the MLU cache dir,
+            or ':memory:' for a cache that only lasts as long as the object
+    '''
+    def __init__(self, cacheFilepath=None):
+        if (cacheFilepath is None):
+            cacheFilepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.cacheDir), DEFAULT_CACHE_FILENAME)
+
+        self.cacheFilepath = cacheFilepath
+        self._connection = sqlite3.connect(self.cacheFilepath)
+        self._createTables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def getPayloadHash(self, audioFilepath):
+        '''
+        Returns the audio payload hash of the given audio file, hashing the payload only if the
+        file changed since it was last hashed. Raises an exception if the file can't be hashed.
+        '''
+        payloadHashes, errors = self.getPayloadHashes([audioFilepath], workers=1)
+        if (errors):
+            raise Exception("Failed to hash the audio payload of '{}': {}".format(audioFilepath, errors[os.path.abspath(audioFilepath)]))
+
+        return payloadHashes[os.path.abspath(audioFilepath)]
+
+    def getPayloadHashes(self, audioFilepaths, workers=DEFAULT_HASH_WORKERS):
+        '''
+        Returns a dict of audio filepath (absolute) to audio payload hash of the given audio files,
+        and a dict of audio filepath to error of the files that failed to be hashed. Only the
+        files that changed since they were last hashed are read (in parallel).
+        '''
+        payloadHashes = {}
+        errors = {}
+        for audioFilepath, (changeKind, payloadHash, error) in self._updateFingerprints(audioFilepaths, workers).items():
+            if (error is not None):
+                errors[audioFilepath] = error
+            else:
+                payloadHashes[audioFilepath] = payloadHash
+
+        return (payloadHashes, errors)
+
+    def classifyChange(self, audioFilepath):
+        '''
+        Returns the kind of change (one of the CHANGE_ constants) of the given audio file since it
+        was last fingerprinted, and stores its current fingerprint. Raises an exception if the file
+        can't be hashed.
+        '''
+        audioFilepath = os.path.abspath(audioFilepath)
+        changeKind, payloadHash, error = self._updateFingerprints([audioFilepath], workers=1)[audioFilepath]
+        if (error is not None):
+            raise Exception("Failed to hash the audio payload of '{}': {}".format(audioFilepath, error))
+
+        return changeKind
+
+    def classifyChanges(self, audioFilepaths, workers=DEFAULT_HASH_WORKERS):
+        '''
+        Returns a dict of audio filepath (absolute) to the kind of change (one of the CHANGE_
+        constants) of each of the given audio files since they were last fingerprinted, and stores
+        their current fingerprints. Files that fail to be hashed are left out (and logged).
+
+            CHANGE_UNCHANGED: the stat signature of the file didn't change, the file is not read
+            CHANGE_TAGS_ONLY: the file changed on disk, but its audio payload is the same
+            CHANGE_AUDIO: the audio payload of the file changed
+            CHANGE_NEW: the file was not fingerprinted before
+        '''
+        changeKinds = {}
+        for audioFilepath, (changeKind, payloadHash, error) in self._updateFingerprints(audioFilepaths, workers).items():
+            if (error is not None):
+                logger.warning("Failed to hash the audio payload of '{}': {}".format(audioFilepath, error))
+            else:
+                changeKinds[audioFilepath] = changeKind
+
+        return changeKinds
+
+    def recordTagsOnlyWrite(self, audioFilepath):
+        '''
+        Updates the stored stat signature of the given audio file after its tags were written by
+        MLU, keeping its stored payload hash, so that the file is not hashed again. Does nothing if
+        the file was not fingerprinted before.
+        '''
+        audioFilepath = os.path.abspath(audioFilepath)
+        signature = index.getAudioFileIndexSignature(os.stat(audioFilepath))
+        with self._connection:
+            self._connection.execute(
+                "UPDATE payload_fingerprints SET size = ?, mtime_ns = ?, inode = ? WHERE path = ?",
+                signature + (audioFilepath,)
+            )
+
+    def removeAudioFile(self, audioFilepath):
+        '''
+        Removes the stored fingerprint of the given audio file, if there is one.
+        '''
+        with self._connection:
+            self._connection.execute("DELETE FROM payload_fingerprints WHERE path = ?", (os.path.abspath(audioFilepath),))
+
+    def _createTables(self):
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS payload_fingerprints (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, payload_hash TEXT)"
+            )
+
+    def _updateFingerprints(self, audioFilepaths, workers):
+        '''
+        Returns a dict of audio filepath (absolute) to (change kind, payload hash, error) tuples of
+        the given audio files, hashing the payload of the files whose stat signature changed (in
+        parallel) and storing their new fingerprints.
+        '''
+        results = {}
+        filesToHash = {}
+
+        for audioFilepath in audioFilepaths:
+            audioFilepath = os.path.abspath(audioFilepath)
+            try:
+                signature = index.getAudioFileIndexSignature(os.stat(audioFilepath))
+            except OSError as e:
+                results[audioFilepath] = (None, None, "{}: {}".format(type(e).__name__, e))
+                continue
+
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, inode, payload_hash FROM payload_fingerprints WHERE path = ?", (audioFilepath,)
+            ).fetchone()
+
+            if (row is not None and tuple(row[:3]) == signature):
+                results[audioFilepath] = (CHANGE_UNCHANGED, row[3], None)
+            else:
+                storedPayloadHash = row[3] if (row is not None) else None
+                filesToHash[audioFilepath] = (signature, storedPayloadHash)
+
+        # The connection is only used from this thread: the pool only hashes
+        hashFilepaths = list(filesToHash)
+        fingerprintRows = []
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for audioFilepath, (payloadHash, error) in zip(hashFilepaths, executor.map(payload.tryGetAudioPayloadHash, hashFilepaths)):
+                if (error is not None):
+                    results[audioFilepath] = (None, None, error)
+                    continue
+
+                signature, storedPayloadHash = filesToHash[audioFilepath]
+                if (storedPayloadHash is None):
+                    changeKind = CHANGE_NEW
+                elif (storedPayloadHash == payloadHash):
+                    changeKind = CHANGE_TAGS_ONLY
+                else:
+                    changeKind = CHANGE_AUDIO
+
+                results[audioFilepath] = (changeKind, payloadHash, None)
+                fingerprintRows.append((audioFilepath,) + signature + (payloadHash,))
+
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO payload_fingerprints VALUES (?, ?, ?, ?, ?)", fingerprintRows)
+
+        return results
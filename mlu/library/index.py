@@ -0,0 +1,294 @@
+'''
+mlu.library.index
+
+Module containing a persistent, on-disk (SQLite) index of the tags and properties of the audio
+files in a music library. Each file's entry is stored with the file's stat signature (size,
+modification time and inode), so that a rescan of the library only has to parse the files that
+changed since the last scan.
+'''
+
+import os
+import json
+import sqlite3
+import logging
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+from mlu.settings import MLUSettings
+from mlu.tags import values
+from mlu.library import scan
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_INDEX_FILENAME = 'library-index.sqlite'
+
+# Bump this when the table layout changes: an index file with another version is rebuilt
+INDEX_SCHEMA_VERSION = 1
+
+# Number of rows written to the index per transaction during an update
+WRITE_BATCH_SIZE = 1000
+
+def getAudioFileIndexSignature(fileStat):
+    '''
+    Returns the values of the given os.stat_result that an index entry is keyed by: if any of these
+    differ from those stored for a file, the file is parsed again.
+    '''
+    return (fileStat.st_size, fileStat.st_mtime_ns, fileStat.st_ino)
+
+class AudioFileIndexUpdateSummary:
+    '''
+    Data structure holding the counts of what an index update did with the files under the
+    scanned directory.
+    '''
+    def __init__(self):
+        self.unchanged = 0
+        self.added = 0
+        self.updated = 0
+        self.removed = 0
+        self.failed = 0
+
+    def __str__(self):
+        return "unchanged: {}, added: {}, updated: {}, removed: {}, failed: {}".format(
+            self.unchanged, self.added, self.updated, self.removed, self.failed
+        )
+
+class AudioFileIndex:
+    '''
+    Class for a persistent index of the tags and properties of audio files. The index is stored
+    in an SQLite database file and can hold the files of more than one library root directory.
+
+    Files that fail to be read are remembered (with their error) and are only read again once
+    they change on disk.
+
+    Params:
+        indexFilepath: filepath of the index database file, defaults to a file in the MLU cache dir
+    '''
+    def __init__(self, indexFilepath=None):
+        if (indexFilepath is None):
+            indexFilepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.cacheDir), DEFAULT_INDEX_FILENAME)
+
+        self.indexFilepath = indexFilepath
+        self._connection = sqlite3.connect(self.indexFilepath)
+        self._createTables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def update(self, rootDir, workers=None):
+        '''
+        Brings the index up to date with the audio files under the given root directory: new and
+        changed files are read (in parallel, see mlu.library.scan) and stored, and entries of files
+        that no longer exist are dropped. Unchanged files are only stat'ed.
+
+        Returns an AudioFileIndexUpdateSummary.
+        '''
+        rootDir = os.path.abspath(rootDir)
+        summary = AudioFileIndexUpdateSummary()
+        storedSignatures = self._getStoredSignatures(rootDir)
+
+        filesToRead = {}
+        foundFilepaths = set()
+
+        for audioFilepath in scan.getAudioFilepaths(rootDir):
+            try:
+                signature = getAudioFileIndexSignature(os.stat(audioFilepath))
+            except OSError:
+                # The file was removed while walking the directory
+                continue
+
+            foundFilepaths.add(audioFilepath)
+            if (storedSignatures.get(audioFilepath) == signature):
+                summary.unchanged += 1
+            else:
+                filesToRead[audioFilepath] = signature
+
+        removedFilepaths = [filepath for filepath in storedSignatures if (filepath not in foundFilepaths)]
+        self._removeEntries(removedFilepaths)
+        summary.removed = len(removedFilepaths)
+
+        fileRows = []
+        failedRows = []
+        for result in scan.scanAudioFiles(filesToRead.keys(), workers=workers):
+            signature = filesToRead[result.audioFilepath]
+
+            if (result.succeeded()):
+                fileRows.append(self._getFileRow(result, signature))
+                if (result.audioFilepath in storedSignatures):
+                    summary.updated += 1
+                else:
+                    summary.added += 1
+            else:
+                logger.warning("Failed to read audio file '{}' for the library index: {}".format(result.audioFilepath, result.error))
+                failedRows.append((result.audioFilepath,) + signature + (result.error,))
+                summary.failed += 1
+
+            if (len(fileRows) + len(failedRows) >= WRITE_BATCH_SIZE):
+                self._writeEntries(fileRows, failedRows)
+                fileRows = []
+                failedRows = []
+
+        self._writeEntries(fileRows, failedRows)
+
+        logger.info("Updated library index for '{}': {}".format(rootDir, summary))
+        return summary
+
+    def getTags(self, audioFilepath):
+        '''
+        Returns the indexed AudioFileTags of the given audio file, or None if the file is not in
+        the index.
+        '''
+        row = self._getFileRowByPath(audioFilepath)
+        if (row is None):
+            return None
+
+        return self._getTagsFromRow(row)
+
+    def getProperties(self, audioFilepath):
+        '''
+        Returns the indexed AudioFileProperties of the given audio file, or None if the file is not
+        in the index.
+        '''
+        row = self._getFileRowByPath(audioFilepath)
+        if (row is None):
+            return None
+
+        return self._getPropertiesFromRow(row)
+
+    def getAudioFilepaths(self):
+        '''
+        Returns the filepaths of all the audio files in the index.
+        '''
+        cursor = self._connection.execute("SELECT path FROM files ORDER BY path")
+        return [row[0] for row in cursor]
+
+    def getFailedAudioFiles(self):
+        '''
+        Returns a dict of filepath to error message for the files that failed to be read.
+        '''
+        cursor = self._connection.execute("SELECT path, error FROM failed_files ORDER BY path")
+        return {row[0]: row[1] for row in cursor}
+
+    def iterEntries(self):
+        '''
+        Yields a (filepath, AudioFileTags, AudioFileProperties) tuple for each file in the index.
+        '''
+        cursor = self._connection.execute("SELECT {} FROM files".format(', '.join(self._fileColumns)))
+        for row in cursor:
+            yield (row[0], self._getTagsFromRow(row), self._getPropertiesFromRow(row))
+
+    @property
+    def _fileColumns(self):
+        return (
+            ['path', 'size', 'mtime_ns', 'inode'] +
+            ['tag_' + field for field in values.AUDIO_FILE_TAGS_FIELDS] + ['tag_OTHER_TAGS'] +
+            ['prop_' + field for field in values.AUDIO_FILE_PROPERTIES_FIELDS]
+        )
+
+    def _createTables(self):
+        schemaVersion = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if (schemaVersion != INDEX_SCHEMA_VERSION):
+            logger.info("Library index '{}' has schema version {}: rebuilding it as version {}".format(self.indexFilepath, schemaVersion, INDEX_SCHEMA_VERSION))
+            with self._connection:
+                self._connection.execute("DROP TABLE IF EXISTS files")
+                self._connection.execute("DROP TABLE IF EXISTS failed_files")
+
+        # Value columns are declared without a type: tag and property values are stored as they
+        # are, like the values of the AudioFileTags/AudioFileProperties objects
+        valueColumns = ', '.join(self._fileColumns[4:])
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, {})".format(valueColumns)
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS failed_files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, error TEXT)"
+            )
+            self._connection.execute("PRAGMA user_version = {}".format(INDEX_SCHEMA_VERSION))
+
+    def _getStoredSignatures(self, rootDir):
+        '''
+        Returns a dict of filepath to index signature for the stored files (including the failed
+        ones) under the given root directory.
+        '''
+        # The paths under the root dir are those from 'rootDir/' (inclusive) up to the same prefix
+        # with the separator replaced by the next character (exclusive). Comparing with the default
+        # (binary) collation is case sensitive, unlike LIKE, and uses the primary key index.
+        rootDirPrefix = os.path.join(rootDir, '')
+        rootDirPrefixEnd = rootDirPrefix[:-1] + chr(ord(rootDirPrefix[-1]) + 1)
+
+        storedSignatures = {}
+        for tableName in ['files', 'failed_files']:
+            cursor = self._connection.execute(
+                "SELECT path, size, mtime_ns, inode FROM {} WHERE path >= ? AND path < ?".format(tableName),
+                (rootDirPrefix, rootDirPrefixEnd)
+            )
+            for row in cursor:
+                storedSignatures[row[0]] = tuple(row[1:])
+
+        return storedSignatures
+
+    def _removeEntries(self, audioFilepaths):
+        with self._connection:
+            for tableName in ['files', 'failed_files']:
+                self._connection.executemany(
+                    "DELETE FROM {} WHERE path = ?".format(tableName),
+                    [(audioFilepath,) for audioFilepath in audioFilepaths]
+                )
+
+    def _writeEntries(self, fileRows, failedRows):
+        fileColumns = self._fileColumns
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files ({}) VALUES ({})".format(', '.join(fileColumns), ', '.join(['?'] * len(fileColumns))),
+                fileRows
+            )
+            self._connection.executemany("DELETE FROM failed_files WHERE path = ?", [(row[0],) for row in fileRows])
+
+            self._connection.executemany("INSERT OR REPLACE INTO failed_files VALUES (?, ?, ?, ?, ?)", failedRows)
+            self._connection.executemany("DELETE FROM files WHERE path = ?", [(row[0],) for row in failedRows])
+
+    def _getFileRow(self, scanResult, signature):
+        tags = scanResult.tags
+        properties = scanResult.properties
+
+        row = [scanResult.audioFilepath] + list(signature)
+        row += [getattr(tags, field) for field in values.AUDIO_FILE_TAGS_FIELDS]
+        row.append(json.dumps(tags.OTHER_TAGS, default=str))
+
+        for field in values.AUDIO_FILE_PROPERTIES_FIELDS:
+            propertyValue = getattr(properties, field)
+            if (field == 'replayGain'):
+                propertyValue = json.dumps(propertyValue, default=str)
+            row.append(propertyValue)
+
+        return row
+
+    def _getFileRowByPath(self, audioFilepath):
+        cursor = self._connection.execute(
+            "SELECT {} FROM files WHERE path = ?".format(', '.join(self._fileColumns)),
+            (os.path.abspath(audioFilepath),)
+        )
+        return cursor.fetchone()
+
+    def _getTagsFromRow(self, row):
+        tagsStart = 4
+        tagsEnd = tagsStart + len(values.AUDIO_FILE_TAGS_FIELDS)
+
+        tagValues = dict(zip(values.AUDIO_FILE_TAGS_FIELDS, row[tagsStart:tagsEnd]))
+        tagValues['OTHER_TAGS'] = json.loads(row[tagsEnd])
+
+        return values.AudioFileTags(**tagValues)
+
+    def _getPropertiesFromRow(self, row):
+        propertiesStart = 4 + len(values.AUDIO_FILE_TAGS_FIELDS) + 1
+
+        propertyValues = dict(zip(values.AUDIO_FILE_PROPERTIES_FIELDS, row[propertiesStart:]))
+        propertyValues['replayGain'] = json.loads(propertyValues['replayGain'])
+
+        return values.AudioFileProperties(**propertyValues)
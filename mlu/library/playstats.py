@@ -0,0 +1,347 @@
+'''
+mlu.library.playstats
+
+Module for recording track plays and applying them to the playback statistics tags of the audio
+files (playCount, dateLastPlayed, dateAllPlays) in batches. Each play is appended to a durable
+local journal (a JSON lines file) right away, and the plays of each file are merged and written
+with a single tag write when the journal is flushed: a track played 40 times between two flushes
+costs one write instead of 40.
+
+Before a file is written, a marker with the sequence number of its last play and the stats about
+to be written is appended to the journal. If the process dies after writing the file but before the
+journal is updated, the next flush finds the file already holding those stats and does not count
+its plays twice. Nothing but the stats themselves is written to the audio files.
+'''
+
+import os
+import json
+import uuid
+import time
+import logging
+import threading
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+import com.nwrobel.mypycommons.time
+
+from mlu.settings import MLUSettings
+from mlu.tags import io
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_JOURNAL_FILENAME = 'playstats-journal.jsonl'
+JOURNAL_VERSION = 1
+
+# Seconds that a recorded play may wait before flushIfDue() flushes the journal
+DEFAULT_FLUSH_INTERVAL_SECONDS = 300
+
+# Separator of the play dates in the dateAllPlays tag
+DATE_ALL_PLAYS_SEPARATOR = ';'
+
+class PlayStatsFlushSummary:
+    '''
+    Data structure holding the counts of what a flush of the play journal did.
+    '''
+    def __init__(self):
+        self.filesWritten = 0
+        self.playsApplied = 0
+        self.playsSkipped = 0
+        self.filesFailed = 0
+        self.playsDropped = 0
+
+    def __str__(self):
+        return "files written: {}, plays applied: {}, plays already applied: {}, files failed: {}, plays dropped: {}".format(
+            self.filesWritten, self.playsApplied, self.playsSkipped, self.filesFailed, self.playsDropped
+        )
+
+class PlayEvent:
+    '''
+    Data structure holding a single play recorded in the journal.
+    '''
+    __slots__ = ('seq', 'audioFilepath', 'timestamp')
+
+    def __init__(self, seq, audioFilepath, timestamp):
+        self.seq = seq
+        self.audioFilepath = audioFilepath
+        self.timestamp = timestamp
+
+class PlayStatsJournal:
+    '''
+    Class that records track plays in a journal file and flushes them to the audio files, one
+    combined tag write per file. Safe to use from multiple threads. Plays left in the journal by a
+    previous process are loaded on creation and applied by the next flush.
+
+    Params:
+        journalFilepath: filepath of the journal file, defaults to a file in the MLU cache dir
+        flushIntervalSeconds: age of the oldest unflushed play at which flushIfDue() flushes
+        writePolicy: mlu.tags.writepolicy.TagWritePolicy used for the tag writes (optional)
+        syncWrites: fsync the journal after each recorded play, so that no play is lost if the
+            machine goes down
+    '''
+    def __init__(self, journalFilepath=None, flushIntervalSeconds=DEFAULT_FLUSH_INTERVAL_SECONDS, writePolicy=None, syncWrites=True):
+        if (journalFilepath is None):
+            journalFilepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.cacheDir), DEFAULT_JOURNAL_FILENAME)
+
+        self.journalFilepath = journalFilepath
+        self.flushIntervalSeconds = flushIntervalSeconds
+        self.writePolicy = writePolicy
+        self.syncWrites = syncWrites
+
+        # The lock guards the pending plays and the journal file, and is not held while files are
+        # written (recordPlay() never waits for a flush); the flush lock keeps flushes one at a time
+        self._lock = threading.RLock()
+        self._flushLock = threading.Lock()
+        self._pendingEvents = {}
+        self._applyMarkers = {}
+        self._oldestPendingTime = None
+        self._journalFile = None
+        self._flushThread = None
+        self._stopFlushThread = threading.Event()
+
+        self._loadJournal()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self, flush=True):
+        '''
+        Stops the background flush (if started), flushes the pending plays (unless flush is false:
+        they stay in the journal for next time) and closes the journal.
+        '''
+        self.stopBackgroundFlush()
+        if (flush):
+            self.flush()
+
+        with self._lock:
+            if (self._journalFile is not None):
+                self._journalFile.close()
+                self._journalFile = None
+
+    def recordPlay(self, audioFilepath, timestamp=None):
+        '''
+        Records a play of the given audio file (at the given epoch timestamp, defaults to now) in
+        the journal. The play is applied to the file's tags by the next flush.
+        '''
+        if (timestamp is None):
+            timestamp = mypycommons.time.getCurrentTimestamp()
+
+        audioFilepath = os.path.abspath(audioFilepath)
+        with self._lock:
+            event = PlayEvent(self._nextSeq, audioFilepath, timestamp)
+            self._nextSeq += 1
+            self._appendJournalLine({'seq': event.seq, 'path': audioFilepath, 'timestamp': timestamp})
+            self._addPendingEvent(event)
+
+    def getPendingPlayCounts(self):
+        '''
+        Returns a dict of audio filepath to the number of plays not yet written to the file.
+        '''
+        with self._lock:
+            return {audioFilepath: len(events) for audioFilepath, events in self._pendingEvents.items()}
+
+    def flushIfDue(self):
+        '''
+        Flushes the journal if its oldest pending play is older than the flush interval. Returns the
+        PlayStatsFlushSummary, or None if no flush was due.
+        '''
+        with self._lock:
+            if (self._oldestPendingTime is None or time.monotonic() - self._oldestPendingTime < self.flushIntervalSeconds):
+                return None
+
+        return self.flush()
+
+    def flush(self):
+        '''
+        Writes the pending plays to the audio files, with a single tag write per file, then drops
+        the applied plays from the journal. The plays of a file that fails to be written are kept
+        for the next flush (or dropped, if the file no longer exists). Plays recorded while the
+        files are written are kept for the next flush. Returns a PlayStatsFlushSummary.
+        '''
+        summary = PlayStatsFlushSummary()
+        with self._flushLock:
+            with self._lock:
+                flushEvents = self._pendingEvents
+                self._pendingEvents = {}
+                self._oldestPendingTime = None
+
+            failedEvents = {}
+            for audioFilepath, events in flushEvents.items():
+                try:
+                    appliedCount, skippedCount = self._applyEvents(audioFilepath, events)
+                    summary.playsApplied += appliedCount
+                    summary.playsSkipped += skippedCount
+                    if (appliedCount):
+                        summary.filesWritten += 1
+
+                    with self._lock:
+                        self._applyMarkers.pop(audioFilepath, None)
+
+                except Exception as e:
+                    if (not os.path.exists(audioFilepath)):
+                        logger.warning("Dropping {} plays of audio file '{}': the file no longer exists".format(len(events), audioFilepath))
+                        summary.playsDropped += len(events)
+                        with self._lock:
+                            self._applyMarkers.pop(audioFilepath, None)
+                    else:
+                        logger.warning("Failed to write plays to audio file '{}', keeping them for the next flush: {}".format(audioFilepath, e))
+                        failedEvents[audioFilepath] = events
+                        summary.filesFailed += 1
+
+            with self._lock:
+                for audioFilepath, events in failedEvents.items():
+                    self._pendingEvents[audioFilepath] = events + self._pendingEvents.get(audioFilepath, [])
+                if (failedEvents):
+                    self._oldestPendingTime = time.monotonic()
+
+                self._rewriteJournal()
+
+        logger.info("Flushed play stats journal '{}': {}".format(self.journalFilepath, summary))
+        return summary
+
+    def startBackgroundFlush(self, checkIntervalSeconds=10):
+        '''
+        Starts a daemon thread that calls flushIfDue() every checkIntervalSeconds.
+        '''
+        if (self._flushThread is not None):
+            return
+
+        self._stopFlushThread.clear()
+
+        def run():
+            while (not self._stopFlushThread.wait(checkIntervalSeconds)):
+                try:
+                    self.flushIfDue()
+                except Exception:
+                    logger.exception("Background flush of play stats journal '{}' failed".format(self.journalFilepath))
+
+        self._flushThread = threading.Thread(target=run, name='mlu-playstats-flush', daemon=True)
+        self._flushThread.start()
+
+    def stopBackgroundFlush(self):
+        if (self._flushThread is not None):
+            self._stopFlushThread.set()
+            self._flushThread.join()
+            self._flushThread = None
+
+    def _applyEvents(self, audioFilepath, events):
+        '''
+        Writes the given plays of the file with a single write batch. Returns the number of plays
+        applied and the number skipped because the file already had them (it holds the stats of
+        the apply marker of an earlier write that was not followed by a journal update).
+        '''
+        handler = io.AudioFileMetadataHandler(audioFilepath, writePolicy=self.writePolicy)
+        currentTags = handler.getTags()
+
+        with self._lock:
+            marker = self._applyMarkers.get(audioFilepath)
+
+        appliedSeq = 0
+        if (marker is not None and marker['playCount'] == currentTags.playCount and marker['dateAllPlays'] == currentTags.dateAllPlays):
+            appliedSeq = marker['seq']
+
+        newEvents = [event for event in events if (event.seq > appliedSeq)]
+        if (not newEvents):
+            return (0, len(events))
+
+        playDates = [mypycommons.time.formatTimestampForDisplay(event.timestamp) for event in newEvents]
+        allPlayDates = [playDate for playDate in (currentTags.dateAllPlays or '').split(DATE_ALL_PLAYS_SEPARATOR) if (playDate)]
+        allPlayDates = sorted(allPlayDates + playDates)
+
+        try:
+            playCount = int(currentTags.playCount or 0)
+        except ValueError:
+            logger.warning("Audio file '{}' has an invalid playCount tag '{}': counting its plays from the dateAllPlays tag".format(audioFilepath, currentTags.playCount))
+            playCount = len(allPlayDates) - len(playDates)
+
+        marker = {
+            'applying': audioFilepath,
+            'seq': newEvents[-1].seq,
+            'playCount': str(playCount + len(newEvents)),
+            'dateAllPlays': DATE_ALL_PLAYS_SEPARATOR.join(allPlayDates)
+        }
+        with self._lock:
+            self._applyMarkers[audioFilepath] = marker
+            self._appendJournalLine(marker, sync=True)
+
+        writeBatch = handler.createWriteBatch()
+        writeBatch.setTag('playCount', marker['playCount'])
+        writeBatch.setTag('dateAllPlays', marker['dateAllPlays'])
+        writeBatch.setTag('dateLastPlayed', max(allPlayDates))
+        writeBatch.commit()
+
+        return (len(newEvents), len(events) - len(newEvents))
+
+    def _addPendingEvent(self, event):
+        self._pendingEvents.setdefault(event.audioFilepath, []).append(event)
+        if (self._oldestPendingTime is None):
+            self._oldestPendingTime = time.monotonic()
+
+    def _loadJournal(self):
+        '''
+        Loads the journal file (or starts a new one): the header gives the journal id and next
+        sequence number, and each other line is a pending play or an apply marker.
+        '''
+        self._journalId = None
+        self._nextSeq = 1
+
+        if (os.path.exists(self.journalFilepath)):
+            with open(self.journalFilepath, 'r', encoding='utf-8') as journalFile:
+                for lineNumber, line in enumerate(journalFile):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash while it was appended: the play is lost
+                        logger.warning("Skipping invalid line {} of play stats journal '{}'".format(lineNumber + 1, self.journalFilepath))
+                        continue
+
+                    if ('journalId' in entry):
+                        self._journalId = entry['journalId']
+                        self._nextSeq = max(self._nextSeq, entry['nextSeq'])
+                    elif ('applying' in entry):
+                        self._applyMarkers[entry['applying']] = entry
+                    else:
+                        self._addPendingEvent(PlayEvent(entry['seq'], entry['path'], entry['timestamp']))
+                        self._nextSeq = max(self._nextSeq, entry['seq'] + 1)
+
+        if (self._journalId is None):
+            self._journalId = uuid.uuid4().hex
+
+        # Markers are only needed for files that still have pending plays
+        self._applyMarkers = {audioFilepath: marker for audioFilepath, marker in self._applyMarkers.items() if (audioFilepath in self._pendingEvents)}
+
+        # Start from a clean file (this also drops invalid lines)
+        self._rewriteJournal()
+
+    def _rewriteJournal(self):
+        '''
+        Replaces the journal file with one holding the header, the apply markers of the files whose
+        write failed and the pending plays. The new file is written next to the old one and moved
+        over it, so the journal is never left half written.
+        '''
+        if (self._journalFile is not None):
+            self._journalFile.close()
+            self._journalFile = None
+
+        pendingEvents = sorted((event for events in self._pendingEvents.values() for event in events), key=lambda event: event.seq)
+        tempFilepath = "{}.tmp".format(self.journalFilepath)
+        with open(tempFilepath, 'w', encoding='utf-8') as tempFile:
+            tempFile.write(json.dumps({'journalId': self._journalId, 'version': JOURNAL_VERSION, 'nextSeq': self._nextSeq}) + '\n')
+            for marker in self._applyMarkers.values():
+                tempFile.write(json.dumps(marker) + '\n')
+            for event in pendingEvents:
+                tempFile.write(json.dumps({'seq': event.seq, 'path': event.audioFilepath, 'timestamp': event.timestamp}) + '\n')
+
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+
+        os.replace(tempFilepath, self.journalFilepath)
+        self._journalFile = open(self.journalFilepath, 'a', encoding='utf-8')
+
+    def _appendJournalLine(self, entry, sync=False):
+        self._journalFile.write(json.dumps(entry) + '\n')
+        self._journalFile.flush()
+        if (sync or self.syncWrites):
+            os.fsync(self._journalFile.fileno())
@@ -0,0 +1,492 @@
+'''
+mlu.library.query
+
+Module for querying the tags of the audio files of a library with filter expressions, for example:
+
+    albumArtist = "Some Artist" and rating >= 8 and playCount = 0
+    genre = ""
+    dateLastPlayed < "2021-01-01" or not (OTHER_TAGS.mood ~ happy)
+
+An expression is made of comparisons of a tag field (an AudioFileTags field name, in any case, or
+OTHER_TAGS.<tag name> for a custom tag) with a value, combined with 'and', 'or', 'not' and
+parentheses. The operators are:
+
+    =, !=: the field has (or doesn't have) the value; "" matches an empty or unset field
+    <, <=, >, >=: the field is in the range; a number is compared with the numeric values of the
+        field, and a string with the values as strings (so dates compare as dates), and an empty
+        field never matches
+    ~: the field contains the value, in any case
+
+A value is a quoted string ("..." or '...', with \\ escapes) or a bare word or number. A number
+given to '=' or '!=' matches numeric values equal to it, so 'rating = 8' matches '8' and '8.0'.
+
+Queries are answered from secondary indexes of every field, which are kept up to date as files are
+added, changed or removed: a hash index of the files by value, for equality, and the sorted distinct
+values (as strings and as numbers), for ranges.
+'''
+
+import re
+import math
+import bisect
+import logging
+
+from mlu.tags import values
+
+logger = logging.getLogger("mluGlobalLogger")
+
+OTHER_TAGS_FIELD_PREFIX = 'OTHER_TAGS.'
+
+# Standard tag field names by their lowercase name, so that fields can be given in any case
+_FIELD_NAMES_BY_LOWER_NAME = {fieldName.lower(): fieldName for fieldName in values.AUDIO_FILE_TAGS_FIELDS}
+
+_TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+        |(?P<operator><=|>=|!=|=|<|>|~)
+        |(?P<paren>[()])
+        |(?P<word>[^\s()<>=!~"']+)
+    )
+''', re.VERBOSE)
+
+_KEYWORDS = {'and', 'or', 'not'}
+_COMPARISON_OPERATORS = {'=', '!=', '<', '<=', '>', '>=', '~'}
+
+class QueryFieldIndex:
+    '''
+    Class holding the secondary indexes of a single tag field: the files by value (hash index),
+    the sorted distinct values, and the sorted distinct numeric values. Empty values are not
+    indexed; only the set of files that have a value is kept.
+    '''
+    def __init__(self):
+        self.docIdsByValue = {}
+        self.nonEmptyDocIds = set()
+        self.sortedValues = []
+        self.sortedNumbers = []
+        self.valuesByNumber = {}
+
+    def add(self, docId, value):
+        docIds = self.docIdsByValue.get(value)
+        if (docIds is None):
+            docIds = self.docIdsByValue[value] = set()
+            bisect.insort(self.sortedValues, value)
+
+            number = _parseNumber(value)
+            if (number is not None):
+                numberValues = self.valuesByNumber.get(number)
+                if (numberValues is None):
+                    numberValues = self.valuesByNumber[number] = set()
+                    bisect.insort(self.sortedNumbers, number)
+                numberValues.add(value)
+
+        docIds.add(docId)
+        self.nonEmptyDocIds.add(docId)
+
+    def remove(self, docId, value):
+        docIds = self.docIdsByValue[value]
+        docIds.discard(docId)
+        self.nonEmptyDocIds.discard(docId)
+
+        if (not docIds):
+            del self.docIdsByValue[value]
+            del self.sortedValues[bisect.bisect_left(self.sortedValues, value)]
+
+            number = _parseNumber(value)
+            if (number is not None):
+                numberValues = self.valuesByNumber[number]
+                numberValues.discard(value)
+                if (not numberValues):
+                    del self.valuesByNumber[number]
+                    del self.sortedNumbers[bisect.bisect_left(self.sortedNumbers, number)]
+
+    def isEmpty(self):
+        return (not self.nonEmptyDocIds)
+
+    def getEqualDocIds(self, value):
+        return self.docIdsByValue.get(value, set())
+
+    def getEqualNumberDocIds(self, number):
+        return self._getDocIdsOfValues(self.valuesByNumber.get(number, ()))
+
+    def getRangeDocIds(self, operator, value):
+        '''
+        Returns the set of files whose value is in the range given by the operator ('<', '<=', '>',
+        '>=') and value: a number (float) to compare numeric values, or a string.
+        '''
+        if (isinstance(value, float)):
+            sortedKeys = self.sortedNumbers
+        else:
+            sortedKeys = self.sortedValues
+
+        if (operator == '<'):
+            keys = sortedKeys[:bisect.bisect_left(sortedKeys, value)]
+        elif (operator == '<='):
+            keys = sortedKeys[:bisect.bisect_right(sortedKeys, value)]
+        elif (operator == '>'):
+            keys = sortedKeys[bisect.bisect_right(sortedKeys, value):]
+        else:
+            keys = sortedKeys[bisect.bisect_left(sortedKeys, value):]
+
+        if (isinstance(value, float)):
+            return self._getDocIdsOfValues(stringValue for number in keys for stringValue in self.valuesByNumber[number])
+
+        return self._getDocIdsOfValues(keys)
+
+    def getContainsDocIds(self, value):
+        value = value.casefold()
+        return self._getDocIdsOfValues(fieldValue for fieldValue in self.sortedValues if (value in fieldValue.casefold()))
+
+    def _getDocIdsOfValues(self, fieldValues):
+        docIds = set()
+        for fieldValue in fieldValues:
+            docIds.update(self.docIdsByValue[fieldValue])
+
+        return docIds
+
+class LibraryQueryIndex:
+    '''
+    Class holding the tags of the audio files of a library in secondary indexes, to answer queries
+    (see the module docstring). The indexes are updated incrementally with setTags() and
+    removeAudioFile(), or with the change events of an mlu.library.watch.LibraryWatcher.
+    '''
+    def __init__(self):
+        self._docIdsByPath = {}
+        self._pathsByDocId = {}
+        self._docValues = {}
+        self._fieldIndexes = {}
+        self._nextDocId = 0
+
+    def __len__(self):
+        return len(self._docIdsByPath)
+
+    @classmethod
+    def fromAudioFileIndex(cls, audioFileIndex):
+        '''
+        Returns a new LibraryQueryIndex of the files of the given mlu.library.index.AudioFileIndex.
+        '''
+        queryIndex = cls()
+        for audioFilepath, tags, properties in audioFileIndex.iterEntries():
+            queryIndex.setTags(audioFilepath, tags)
+
+        return queryIndex
+
+    def setTags(self, audioFilepath, audioFileTags):
+        '''
+        Adds the given audio file with the given AudioFileTags, or updates its tags if it is already
+        in the index (only the changed fields are reindexed).
+        '''
+        newValues = _getIndexedValues(audioFileTags)
+
+        docId = self._docIdsByPath.get(audioFilepath)
+        if (docId is None):
+            docId = self._nextDocId
+            self._nextDocId += 1
+            self._docIdsByPath[audioFilepath] = docId
+            self._pathsByDocId[docId] = audioFilepath
+            oldValues = {}
+        else:
+            oldValues = self._docValues[docId]
+
+        for fieldKey, oldValue in oldValues.items():
+            if (newValues.get(fieldKey) != oldValue):
+                self._removeFieldValue(docId, fieldKey, oldValue)
+
+        for fieldKey, newValue in newValues.items():
+            if (oldValues.get(fieldKey) != newValue):
+                self._fieldIndexes.setdefault(fieldKey, QueryFieldIndex()).add(docId, newValue)
+
+        self._docValues[docId] = newValues
+
+    def removeAudioFile(self, audioFilepath):
+        '''
+        Removes the given audio file from the index, if it is in it.
+        '''
+        docId = self._docIdsByPath.pop(audioFilepath, None)
+        if (docId is None):
+            return
+
+        for fieldKey, value in self._docValues.pop(docId).items():
+            self._removeFieldValue(docId, fieldKey, value)
+
+        del self._pathsByDocId[docId]
+
+    def applyChangeEvent(self, changeEvent):
+        '''
+        Updates the index with the given mlu.library.watch.AudioFileChangeEvent. A file that failed
+        to be read after a change is removed, since its indexed tags are no longer current.
+        '''
+        if (changeEvent.newTags is None):
+            self.removeAudioFile(changeEvent.audioFilepath)
+        else:
+            self.setTags(changeEvent.audioFilepath, changeEvent.newTags)
+
+    def query(self, expression):
+        '''
+        Returns the sorted list of the filepaths of the audio files matching the given filter
+        expression (a string, or a Query returned by parseQuery()). Raises ValueError if the
+        expression is not valid.
+        '''
+        if (not isinstance(expression, Query)):
+            expression = parseQuery(expression)
+
+        return sorted(self._pathsByDocId[docId] for docId in expression.rootNode.evaluate(self))
+
+    def getAudioFilepaths(self):
+        return sorted(self._docIdsByPath)
+
+    def _getAllDocIds(self):
+        return set(self._pathsByDocId)
+
+    def _getFieldIndex(self, fieldKey):
+        '''
+        Returns the QueryFieldIndex of the given field, or an empty one if no file has a value for it.
+        '''
+        fieldIndex = self._fieldIndexes.get(fieldKey)
+        if (fieldIndex is None):
+            return QueryFieldIndex()
+
+        return fieldIndex
+
+    def _removeFieldValue(self, docId, fieldKey, value):
+        fieldIndex = self._fieldIndexes[fieldKey]
+        fieldIndex.remove(docId, value)
+
+        # The indexes of custom tags that no file has anymore are dropped
+        if (fieldIndex.isEmpty() and fieldKey.startswith(OTHER_TAGS_FIELD_PREFIX)):
+            del self._fieldIndexes[fieldKey]
+
+class Query:
+    '''
+    A parsed filter expression, see parseQuery().
+    '''
+    def __init__(self, expression, rootNode):
+        self.expression = expression
+        self.rootNode = rootNode
+
+    def __repr__(self):
+        return "Query({!r})".format(self.expression)
+
+def parseQuery(expression):
+    '''
+    Parses the given filter expression (see the module docstring) and returns a Query. Raises
+    ValueError if the expression is not valid.
+    '''
+    parser = _QueryParser(expression)
+    return Query(expression, parser.parse())
+
+class _ComparisonNode:
+    def __init__(self, fieldKey, operator, value, isNumber):
+        self.fieldKey = fieldKey
+        self.operator = operator
+        self.value = value
+        self.number = _parseNumber(value) if (isNumber) else None
+
+    def evaluate(self, queryIndex):
+        fieldIndex = queryIndex._getFieldIndex(self.fieldKey)
+        operator = self.operator
+
+        if (operator in ('=', '!=')):
+            if (self.number is not None):
+                docIds = fieldIndex.getEqualNumberDocIds(self.number)
+            elif (self.value == ''):
+                docIds = queryIndex._getAllDocIds() - fieldIndex.nonEmptyDocIds
+            else:
+                docIds = set(fieldIndex.getEqualDocIds(self.value))
+
+            if (operator == '!='):
+                docIds = queryIndex._getAllDocIds() - docIds
+
+            return docIds
+
+        if (operator == '~'):
+            return fieldIndex.getContainsDocIds(self.value)
+
+        if (self.number is not None):
+            return fieldIndex.getRangeDocIds(operator, self.number)
+
+        return fieldIndex.getRangeDocIds(operator, self.value)
+
+class _AndNode:
+    def __init__(self, childNodes):
+        self.childNodes = childNodes
+
+    def evaluate(self, queryIndex):
+        # The smallest result first, so that the intersection stays small
+        results = sorted((childNode.evaluate(queryIndex) for childNode in self.childNodes), key=len)
+        docIds = set(results[0])
+        for result in results[1:]:
+            docIds.intersection_update(result)
+
+        return docIds
+
+class _OrNode:
+    def __init__(self, childNodes):
+        self.childNodes = childNodes
+
+    def evaluate(self, queryIndex):
+        docIds = set()
+        for childNode in self.childNodes:
+            docIds.update(childNode.evaluate(queryIndex))
+
+        return docIds
+
+class _NotNode:
+    def __init__(self, childNode):
+        self.childNode = childNode
+
+    def evaluate(self, queryIndex):
+        return queryIndex._getAllDocIds() - self.childNode.evaluate(queryIndex)
+
+class _QueryParser:
+    '''
+    Recursive descent parser of filter expressions:
+
+        expression := andExpression ('or' andExpression)*
+        andExpression := notExpression ('and' notExpression)*
+        notExpression := 'not' notExpression | '(' expression ')' | comparison
+        comparison := field operator value
+    '''
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def parse(self):
+        if (not self.tokens):
+            raise ValueError("Invalid query '{}': the expression is empty".format(self.expression))
+
+        node = self._parseOr()
+        if (self.position < len(self.tokens)):
+            self._raiseError("unexpected '{}'".format(self.tokens[self.position][1]))
+
+        return node
+
+    def _parseOr(self):
+        childNodes = [self._parseAnd()]
+        while (self._acceptKeyword('or')):
+            childNodes.append(self._parseAnd())
+
+        return childNodes[0] if (len(childNodes) == 1) else _OrNode(childNodes)
+
+    def _parseAnd(self):
+        childNodes = [self._parseNot()]
+        while (self._acceptKeyword('and')):
+            childNodes.append(self._parseNot())
+
+        return childNodes[0] if (len(childNodes) == 1) else _AndNode(childNodes)
+
+    def _parseNot(self):
+        if (self._acceptKeyword('not')):
+            return _NotNode(self._parseNot())
+
+        tokenType, tokenValue = self._nextToken("a field or '('")
+        if (tokenType == 'paren' and tokenValue == '('):
+            node = self._parseOr()
+            tokenType, tokenValue = self._nextToken("')'")
+            if (tokenValue != ')' or tokenType != 'paren'):
+                self._raiseError("expected ')' but got '{}'".format(tokenValue))
+            return node
+
+        if (tokenType != 'word' or tokenValue.lower() in _KEYWORDS):
+            self._raiseError("expected a field but got '{}'".format(tokenValue))
+
+        fieldKey = _getFieldKey(tokenValue, self.expression)
+
+        tokenType, operator = self._nextToken("an operator")
+        if (tokenType != 'operator'):
+            self._raiseError("expected an operator after '{}' but got '{}'".format(tokenValue, operator))
+
+        tokenType, value = self._nextToken("a value")
+        if (tokenType == 'string'):
+            return _ComparisonNode(fieldKey, operator, value, isNumber=False)
+        elif (tokenType == 'word'):
+            return _ComparisonNode(fieldKey, operator, value, isNumber=(_parseNumber(value) is not None))
+
+        self._raiseError("expected a value after '{}' but got '{}'".format(operator, value))
+
+    def _acceptKeyword(self, keyword):
+        if (self.position < len(self.tokens)):
+            tokenType, tokenValue = self.tokens[self.position]
+            if (tokenType == 'word' and tokenValue.lower() == keyword):
+                self.position += 1
+                return True
+
+        return False
+
+    def _nextToken(self, expected):
+        if (self.position >= len(self.tokens)):
+            self._raiseError("expected {} but the expression ended".format(expected))
+
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _raiseError(self, message):
+        raise ValueError("Invalid query '{}': {}".format(self.expression, message))
+
+def _tokenize(expression):
+    '''
+    Returns the list of (token type, value) tuples of the given expression, with quoted strings
+    unquoted.
+    '''
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while (position < len(expression)):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if (match is None or match.end() == position):
+            raise ValueError("Invalid query '{}': unexpected character at position {}".format(expression, position))
+
+        tokenType = match.lastgroup
+        tokenValue = match.group(tokenType)
+        if (tokenType == 'string'):
+            tokenValue = re.sub(r'\\(.)', r'\1', tokenValue[1:-1])
+
+        tokens.append((tokenType, tokenValue))
+        position = match.end()
+
+    return tokens
+
+def _getFieldKey(fieldName, expression):
+    '''
+    Returns the key of the given field in the indexes: the AudioFileTags field name, or
+    'OTHER_TAGS.<lowercase tag name>' for a custom tag.
+    '''
+    if (fieldName.upper().startswith(OTHER_TAGS_FIELD_PREFIX) and len(fieldName) > len(OTHER_TAGS_FIELD_PREFIX)):
+        return OTHER_TAGS_FIELD_PREFIX + fieldName[len(OTHER_TAGS_FIELD_PREFIX):].lower()
+
+    standardFieldName = _FIELD_NAMES_BY_LOWER_NAME.get(fieldName.lower())
+    if (standardFieldName is None):
+        raise ValueError("Invalid query '{}': unknown tag field '{}'".format(expression, fieldName))
+
+    return standardFieldName
+
+def _getIndexedValues(audioFileTags):
+    '''
+    Returns a dict of field key to value of the non-empty tag values of the given AudioFileTags.
+    '''
+    indexedValues = {}
+    for fieldName in values.AUDIO_FILE_TAGS_FIELDS:
+        value = getattr(audioFileTags, fieldName)
+        if (value):
+            indexedValues[fieldName] = value
+
+    for tagName, value in (audioFileTags.OTHER_TAGS or {}).items():
+        if (value):
+            indexedValues[OTHER_TAGS_FIELD_PREFIX + tagName.lower()] = value
+
+    return indexedValues
+
+def _parseNumber(value):
+    '''
+    Returns the given tag value as a float, or None if it is not a (finite) number.
+    '''
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    if (not math.isfinite(number)):
+        return None
+
+    return number
@@ -0,0 +1,294 @@
+'''
+mlu.library.retag
+
+Module for applying a tag edit rule across a whole music library. A rule is a function that is
+given a copy of the AudioFileTags of a file and changes it in place (or returns new AudioFileTags);
+for example:
+
+    def normalizeAlbumArtist(tags):
+        tags.albumArtist = tags.albumArtist.strip()
+
+Retagging is done in two steps. planRetag() reads the tags of every file (tag blocks only) and
+applies the rule across a pool of worker processes, and returns a RetagPlan holding the diff of
+each file that the rule changes: its summary can be shown as a dry run. commitRetagPlan() then
+writes only the changed files, again across worker processes, each worker writing a chunk of files
+with a single save per file.
+
+Since the rule is run in worker processes, it must be picklable: a module-level function, or an
+instance of a module-level class like MoveCustomTagToFieldRule.
+'''
+
+import logging
+import functools
+
+from mlu.tags import io
+from mlu.tags import values
+from mlu.tags import journal
+from mlu.library import scan
+
+logger = logging.getLogger("mluGlobalLogger")
+
+# Number of audio files that a worker process plans or commits per task
+DEFAULT_CHUNK_SIZE = 32
+
+# Number of example file diffs shown in a plan summary
+DEFAULT_SUMMARY_EXAMPLES = 10
+
+class MoveCustomTagToFieldRule:
+    '''
+    Retag rule that moves the value of a custom (nonstandard) tag into a standard tag field and
+    removes the custom tag, e.g. MoveCustomTagToFieldRule('key', 'key') for a TXXX:KEY frame. A
+    field that already has a value is not overwritten unless overwrite is given.
+    '''
+    def __init__(self, tagName, fieldName, overwrite=False):
+        if (fieldName not in values.AUDIO_FILE_TAGS_FIELDS):
+            raise ValueError("Cannot move tag '{}' to field '{}': not a standard tag field of AudioFileTags".format(tagName, fieldName))
+
+        self.tagName = tagName.lower()
+        self.fieldName = fieldName
+        self.overwrite = overwrite
+
+    def __call__(self, tags):
+        value = tags.OTHER_TAGS.pop(self.tagName, None)
+        if (value is None):
+            return
+
+        if (self.overwrite or not getattr(tags, self.fieldName)):
+            setattr(tags, self.fieldName, value)
+        elif (getattr(tags, self.fieldName) != value):
+            # Keep the custom tag rather than lose a value that differs from the field's
+            tags.OTHER_TAGS[self.tagName] = value
+
+class RetagFileChange:
+    '''
+    Data structure holding the planned change of a single audio file: the diff of its tags (see
+    AudioFileTags.diff()), or an error if the file couldn't be read or the rule failed on it.
+    '''
+    def __init__(self, audioFilepath, tagsDiff=None, error=None):
+        self.audioFilepath = audioFilepath
+        self.tagsDiff = tagsDiff
+        self.error = error
+
+    def succeeded(self):
+        return (self.error is None)
+
+class RetagPlan:
+    '''
+    Data structure holding the result of planning a retag: the changes of the files that the rule
+    changes (files that it leaves as they are are only counted), and the files that failed.
+    '''
+    def __init__(self):
+        self.filesScanned = 0
+        self.changes = []
+        self.failures = []
+
+    def addFileChange(self, fileChange):
+        self.filesScanned += 1
+        if (not fileChange.succeeded()):
+            self.failures.append(fileChange)
+        elif (fileChange.tagsDiff):
+            self.changes.append(fileChange)
+
+    def getFieldChangeCounts(self):
+        '''
+        Returns a dict of changed field name (or 'OTHER_TAGS:<tag name>' for a custom tag) to the
+        number of files in which it changes.
+        '''
+        fieldCounts = {}
+        for fileChange in self.changes:
+            for fieldName, fieldDiff in fileChange.tagsDiff.items():
+                if (fieldName == 'OTHER_TAGS'):
+                    for tagName in fieldDiff:
+                        countKey = "OTHER_TAGS:{}".format(tagName)
+                        fieldCounts[countKey] = fieldCounts.get(countKey, 0) + 1
+                else:
+                    fieldCounts[fieldName] = fieldCounts.get(fieldName, 0) + 1
+
+        return fieldCounts
+
+    def formatSummary(self, maxExamples=DEFAULT_SUMMARY_EXAMPLES):
+        '''
+        Returns the dry run summary of the plan as text: the counts of files and changed fields, and
+        the diffs of the first few changed files.
+        '''
+        lines = [
+            "Files scanned: {}, to change: {}, failed: {}".format(self.filesScanned, len(self.changes), len(self.failures))
+        ]
+
+        fieldCounts = self.getFieldChangeCounts()
+        for fieldName in sorted(fieldCounts):
+            lines.append("  {}: {} files".format(fieldName, fieldCounts[fieldName]))
+
+        for fileChange in self.changes[:maxExamples]:
+            lines.append(fileChange.audioFilepath)
+            for fieldName, (oldValue, newValue) in _iterateDiffValues(fileChange.tagsDiff):
+                lines.append("  {}: {!r} -> {!r}".format(fieldName, oldValue, newValue))
+
+        if (len(self.changes) > maxExamples):
+            lines.append("... and {} more files".format(len(self.changes) - maxExamples))
+
+        for fileChange in self.failures:
+            lines.append("Failed: {}: {}".format(fileChange.audioFilepath, fileChange.error))
+
+        return '\n'.join(lines)
+
+class RetagCommitSummary:
+    '''
+    Data structure holding the result of committing a retag plan: the number of files written and
+    skipped (already had the new values) and the errors of the files that failed, by filepath.
+    '''
+    def __init__(self):
+        self.filesWritten = 0
+        self.filesSkipped = 0
+        self.errors = {}
+
+    def __str__(self):
+        return "files written: {}, skipped: {}, failed: {}".format(self.filesWritten, self.filesSkipped, len(self.errors))
+
+def planLibraryRetag(rootDir, ruleFunc, workers=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    '''
+    Plans the retag of all the supported audio files under the given root directory. See
+    planRetag().
+    '''
+    return planRetag(scan.getAudioFilepaths(rootDir), ruleFunc, workers=workers, chunkSize=chunkSize)
+
+def planRetag(audioFilepaths, ruleFunc, workers=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    '''
+    Applies the given rule to the tags of the given audio files, across a pool of worker processes,
+    and returns a RetagPlan of the changes. Nothing is written to the files.
+
+    Params:
+        audioFilepaths: iterable of audio filepaths
+        ruleFunc: the retag rule (see the module docstring)
+        workers: number of worker processes to use (defaults to the number of CPUs), or 1 to run in
+            the current process
+        chunkSize: number of files handled by a worker process per task
+    '''
+    plan = RetagPlan()
+    planChunkFunc = functools.partial(_planChunk, ruleFunc=ruleFunc)
+
+    for fileChanges in scan.runInChunks(planChunkFunc, audioFilepaths, workers=workers, chunkSize=chunkSize, chunkErrorFunc=_getFailedPlanChunkResults):
+        for fileChange in fileChanges:
+            plan.addFileChange(fileChange)
+
+    logger.info("Planned retag: {} files scanned, {} to change, {} failed".format(plan.filesScanned, len(plan.changes), len(plan.failures)))
+    return plan
+
+def commitRetagPlan(plan, workers=None, chunkSize=DEFAULT_CHUNK_SIZE, tagWriteJournal=None):
+    '''
+    Writes the changes of the given RetagPlan to the audio files, across a pool of worker processes,
+    and returns a RetagCommitSummary. A file whose changed tags no longer have the values that the
+    plan was made from (the file was changed since) is not written and is reported as failed.
+
+    If a worker process dies, the files of the chunk it was writing are reported as failed (some of
+    them may have been written: committing the plan again skips those), and the other chunks are
+    carried on in a new pool.
+
+    Params:
+        plan: the RetagPlan to commit
+        workers: number of worker processes to use (defaults to the number of CPUs), or 1 to write
+            in the current process
+        chunkSize: number of files written by a worker process per task
+        tagWriteJournal: mlu.tags.journal.TagWriteJournal to journal the writes with (optional)
+    '''
+    journalSettings = None
+    if (tagWriteJournal is not None):
+        # The journal is created again in each worker process from its settings
+        journalSettings = (tagWriteJournal.journalDir, tagWriteJournal.atomic)
+
+    summary = RetagCommitSummary()
+    commitChunkFunc = functools.partial(_commitChunk, journalSettings=journalSettings)
+
+    for results in scan.runInChunks(commitChunkFunc, plan.changes, workers=workers, chunkSize=chunkSize, chunkErrorFunc=_getFailedCommitChunkResults):
+        for audioFilepath, written, error in results:
+            if (error is not None):
+                summary.errors[audioFilepath] = error
+            elif (written):
+                summary.filesWritten += 1
+            else:
+                summary.filesSkipped += 1
+
+    logger.info("Committed retag plan: {}".format(summary))
+    return summary
+
+def planFileRetag(audioFilepath, ruleFunc):
+    '''
+    Applies the given rule to the tags of a single audio file and returns a RetagFileChange. This
+    function does not raise: an error is reported in the result instead.
+    '''
+    try:
+        tags = io.AudioFileMetadataHandler(audioFilepath).getTags(tagsOnly=True)
+        newTags = tags.copy()
+        ruleResult = ruleFunc(newTags)
+        if (ruleResult is not None):
+            newTags = ruleResult
+
+        return RetagFileChange(audioFilepath, tagsDiff=tags.diff(newTags))
+
+    except Exception as e:
+        return RetagFileChange(audioFilepath, error="{}: {}".format(type(e).__name__, e))
+
+def commitFileChange(fileChange, tagWriteJournal=None):
+    '''
+    Writes the planned change of a single audio file with a single save. Returns True if the file
+    was written, or False if it already had the new values. Raises an exception if the file's tags
+    were changed since the plan was made.
+    '''
+    handler = io.AudioFileMetadataHandler(fileChange.audioFilepath, journal=tagWriteJournal)
+    currentTags = handler.getTags()
+    writeBatch = handler.createWriteBatch()
+
+    for fieldName, fieldDiff in fileChange.tagsDiff.items():
+        if (fieldName == 'OTHER_TAGS'):
+            continue
+
+        oldValue, newValue = fieldDiff
+        currentValue = getattr(currentTags, fieldName)
+        if (currentValue != oldValue and currentValue != newValue):
+            raise Exception("Tag '{}' of audio file '{}' was changed since the retag was planned".format(fieldName, fileChange.audioFilepath))
+        writeBatch.setTag(fieldName, newValue)
+
+    for tagName, (oldValue, newValue) in fileChange.tagsDiff.get('OTHER_TAGS', {}).items():
+        currentValue = currentTags.OTHER_TAGS.get(tagName)
+        if (currentValue != oldValue and currentValue != newValue):
+            raise Exception("Tag '{}' of audio file '{}' was changed since the retag was planned".format(tagName, fileChange.audioFilepath))
+
+        if (newValue is None):
+            writeBatch.removeCustomTag(tagName)
+        else:
+            writeBatch.setCustomTag(tagName, newValue)
+
+    return writeBatch.commit()
+
+def _planChunk(audioFilepaths, ruleFunc):
+    return [planFileRetag(audioFilepath, ruleFunc) for audioFilepath in audioFilepaths]
+
+def _getFailedPlanChunkResults(audioFilepaths, error):
+    return [RetagFileChange(audioFilepath, error=error) for audioFilepath in audioFilepaths]
+
+def _commitChunk(fileChanges, journalSettings=None):
+    tagWriteJournal = None
+    if (journalSettings is not None):
+        journalDir, atomic = journalSettings
+        tagWriteJournal = journal.TagWriteJournal(journalDir, atomic=atomic)
+
+    results = []
+    for fileChange in fileChanges:
+        try:
+            written = commitFileChange(fileChange, tagWriteJournal=tagWriteJournal)
+            results.append((fileChange.audioFilepath, written, None))
+        except Exception as e:
+            results.append((fileChange.audioFilepath, False, "{}: {}".format(type(e).__name__, e)))
+
+    return results
+
+def _getFailedCommitChunkResults(fileChanges, error):
+    return [(fileChange.audioFilepath, False, error) for fileChange in fileChanges]
+
+def _iterateDiffValues(tagsDiff):
+    for fieldName, fieldDiff in tagsDiff.items():
+        if (fieldName == 'OTHER_TAGS'):
+            for tagName, tagDiff in fieldDiff.items():
+                yield ("OTHER_TAGS:{}".format(tagName), tagDiff)
+        else:
+            yield (fieldName, fieldDiff)
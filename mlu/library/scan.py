@@ -0,0 +1,207 @@
+'''
+mlu.library.scan
+
+Module for reading the tags and properties of all the audio files in a music library directory.
+The files are read in parallel across a pool of worker processes, and the results are returned as
+a stream in the order that they finish.
+'''
+
+import os
+import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from mlu.tags import io
+from mlu.tags import formats
+
+logger = logging.getLogger("mluGlobalLogger")
+
+# Number of audio files that a worker process reads per task: larger chunks mean less overhead
+# for passing work and results between the processes
+DEFAULT_CHUNK_SIZE = 32
+
+class AudioFileScanResult:
+    '''
+    Data structure holding the result of reading a single audio file during a library scan. If the
+    file was read successfully, tags and properties are set (properties stay None for a tags-only
+    scan); otherwise error holds a description of why reading the file failed.
+    '''
+    def __init__(self, audioFilepath, tags=None, properties=None, error=None):
+        self.audioFilepath = audioFilepath
+        self.tags = tags
+        self.properties = properties
+        self.error = error
+
+    def succeeded(self):
+        return (self.error is None)
+
+def getAudioFilepaths(rootDir):
+    '''
+    Walks the given directory tree and yields the filepath of each supported audio file found.
+    '''
+    if (not os.path.isdir(rootDir)):
+        raise ValueError("Cannot scan directory '{}': path is not an existing directory".format(rootDir))
+
+    for dirPath, dirNames, fileNames in os.walk(rootDir):
+        for fileName in fileNames:
+            if (formats.hasSupportedFileExtension(fileName)):
+                yield os.path.join(dirPath, fileName)
+
+def readAudioFile(audioFilepath, tagsOnly=False):
+    '''
+    Reads the tags and properties of a single audio file and returns an AudioFileScanResult. This
+    function does not raise: any error reading the file is reported in the result instead.
+
+    If tagsOnly is given, only the tags are read (see AudioFileMetadataHandler.getTags()).
+    '''
+    try:
+        handler = io.AudioFileMetadataHandler(audioFilepath)
+        if (tagsOnly):
+            return AudioFileScanResult(audioFilepath, tags=handler.getTags(tagsOnly=True))
+
+        return AudioFileScanResult(audioFilepath, tags=handler.getTags(), properties=handler.getProperties())
+
+    except Exception as e:
+        return AudioFileScanResult(audioFilepath, error="{}: {}".format(type(e).__name__, e))
+
+def scan(rootDir, workers=None, chunkSize=DEFAULT_CHUNK_SIZE, tagsOnly=False):
+    '''
+    Reads the tags and properties of all the supported audio files under the given root directory.
+    Yields an AudioFileScanResult for each file as soon as it has been read. See scanAudioFiles().
+    '''
+    return scanAudioFiles(getAudioFilepaths(rootDir), workers=workers, chunkSize=chunkSize, tagsOnly=tagsOnly)
+
+def scanAudioFiles(audioFilepaths, workers=None, chunkSize=DEFAULT_CHUNK_SIZE, tagsOnly=False):
+    '''
+    Reads the tags and properties of the given audio files across a pool of worker processes.
+    Yields an AudioFileScanResult for each file, in the order that the files finish being read.
+
+    A file that can't be read is reported as a failed result and the scan carries on. If a worker
+    process dies, the files of the chunks that were lost with it are reported as failed and a new
+    pool is started for the remaining files.
+
+    Params:
+        audioFilepaths: iterable of audio filepaths to read (may be a generator)
+        workers: number of worker processes to use (defaults to the number of CPUs), or 1 to read
+            the files in the current process
+        chunkSize: number of files read by a worker process per task
+        tagsOnly: only read the tags of the files, not their properties (faster)
+    '''
+    if (workers is None):
+        workers = os.cpu_count() or 1
+
+    if (workers < 1 or chunkSize < 1):
+        raise ValueError("Values for 'workers' and 'chunkSize' must be at least 1")
+
+    if (workers == 1):
+        for audioFilepath in audioFilepaths:
+            yield readAudioFile(audioFilepath, tagsOnly=tagsOnly)
+        return
+
+    readChunkFunc = functools.partial(_readAudioFilesChunk, tagsOnly=tagsOnly)
+    for results in runInChunks(readChunkFunc, audioFilepaths, workers=workers, chunkSize=chunkSize, chunkErrorFunc=_getFailedChunkResults):
+        for result in results:
+            yield result
+
+def runInChunks(chunkFunc, items, workers=None, chunkSize=DEFAULT_CHUNK_SIZE, chunkErrorFunc=None):
+    '''
+    Runs the given function over chunks of the given items across a pool of worker processes, and
+    yields the result of each chunk in the order that the chunks finish. Only a few chunks per
+    worker are in flight at a time, so the items may come from a generator over a whole library.
+
+    If a worker process dies, the chunks that were lost with it are failed and a new pool is started
+    for the remaining chunks (including those that were waiting in the broken pool). The result of
+    a failed chunk is chunkErrorFunc(chunk, error string), or the exception is raised if no
+    chunkErrorFunc is given: a chunk that fails is never silently dropped.
+
+    Params:
+        chunkFunc: picklable function that is given a list of items and returns the chunk's result
+        items: iterable of items (may be a generator)
+        workers: number of worker processes to use (defaults to the number of CPUs), or 1 to run
+            the chunks in the current process
+        chunkSize: number of items per chunk
+        chunkErrorFunc: function returning the result of a failed chunk (optional)
+    '''
+    if (workers is None):
+        workers = os.cpu_count() or 1
+
+    if (workers < 1 or chunkSize < 1):
+        raise ValueError("Values for 'workers' and 'chunkSize' must be at least 1")
+
+    chunks = getChunks(items, chunkSize)
+    if (workers == 1):
+        for chunk in chunks:
+            yield chunkFunc(chunk)
+        return
+
+    maxPendingChunks = workers * 4
+    pendingChunks = {}
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        chunksRemaining = True
+        while (chunksRemaining or pendingChunks):
+            while (chunksRemaining and len(pendingChunks) < maxPendingChunks):
+                chunk = next(chunks, None)
+                if (chunk is None):
+                    chunksRemaining = False
+                else:
+                    pendingChunks[executor.submit(chunkFunc, chunk)] = chunk
+
+            if (not pendingChunks):
+                break
+
+            doneFutures, notDoneFutures = wait(pendingChunks, return_when=FIRST_COMPLETED)
+            poolIsBroken = False
+
+            for future in doneFutures:
+                chunk = pendingChunks.pop(future)
+                try:
+                    chunkResult = future.result()
+
+                except Exception as e:
+                    if (isinstance(e, BrokenProcessPool)):
+                        poolIsBroken = True
+                    if (chunkErrorFunc is None):
+                        raise
+
+                    chunkResult = chunkErrorFunc(chunk, "{}: {}".format(type(e).__name__, e))
+
+                yield chunkResult
+
+            if (poolIsBroken):
+                # The chunks still pending in the broken pool can't finish there: give them to a
+                # new pool instead of failing them
+                logger.warning("Worker process died unexpectedly: starting a new process pool")
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+                for future in list(pendingChunks):
+                    chunk = pendingChunks.pop(future)
+                    pendingChunks[executor.submit(chunkFunc, chunk)] = chunk
+
+    finally:
+        for future in pendingChunks:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def getChunks(items, chunkSize):
+    '''
+    Yields lists of chunkSize consecutive items of the given iterable (the last one may be shorter).
+    '''
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if (len(chunk) == chunkSize):
+            yield chunk
+            chunk = []
+
+    if (chunk):
+        yield chunk
+
+def _readAudioFilesChunk(audioFilepaths, tagsOnly=False):
+    return [readAudioFile(audioFilepath, tagsOnly=tagsOnly) for audioFilepath in audioFilepaths]
+
+def _getFailedChunkResults(audioFilepaths, error):
+    return [AudioFileScanResult(audioFilepath, error=error) for audioFilepath in audioFilepaths]
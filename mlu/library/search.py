@@ -0,0 +1,328 @@
+'''
+mlu.library.search
+
+Module containing a full-text search index of the tags of the audio files of a library (titles,
+artists, albums, lyrics, ...), for search-as-you-type.
+
+The text of the tags is split into tokens, which are normalized (case folded, diacritics removed,
+so 'Beyoncé' is found with 'beyonce'), and each token is kept in an inverted index of the files
+that have it. A search matches the files that have all the tokens of the query (the last one as a
+prefix, since it may still be being typed), ranked by BM25 score, with the tokens of some fields
+(title, artist) weighing more than others (lyrics).
+
+The index is updated incrementally as files are retagged (setTags(), removeAudioFile() or the
+change events of an mlu.library.watch.LibraryWatcher), and can be saved to disk and loaded at
+startup instead of being rebuilt.
+'''
+
+import os
+import re
+import json
+import math
+import bisect
+import hashlib
+import logging
+import tempfile
+import unicodedata
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+from mlu.settings import MLUSettings
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_SEARCH_INDEX_FILENAME = 'library-search.json'
+
+# Bump this when the tokenization or the saved layout changes: a saved index with another version
+# is not loaded
+SEARCH_INDEX_VERSION = 1
+
+# Weight of the tokens of each searched AudioFileTags field
+DEFAULT_FIELD_WEIGHTS = {
+    'title': 3.0,
+    'artist': 2.0,
+    'albumArtist': 1.5,
+    'album': 1.5,
+    'composer': 1.0,
+    'lyrics': 0.5
+}
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Score factor of a token that is only matched as a prefix of the last query token
+PREFIX_MATCH_FACTOR = 0.8
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+def normalizeText(text):
+    '''
+    Returns the given text case folded and without diacritics.
+    '''
+    decomposedText = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposedText if (not unicodedata.combining(char))).casefold()
+
+def tokenize(text):
+    '''
+    Returns the list of the normalized tokens (words) of the given text.
+    '''
+    return _TOKEN_PATTERN.findall(normalizeText(text))
+
+class SearchResult:
+    '''
+    Data structure holding a single search match: the audio filepath and its score.
+    '''
+    def __init__(self, audioFilepath, score):
+        self.audioFilepath = audioFilepath
+        self.score = score
+
+    def __repr__(self):
+        return "SearchResult({!r}, {:.3f})".format(self.audioFilepath, self.score)
+
+class LibrarySearchIndex:
+    '''
+    Class holding the full-text search index of the tags of audio files (see the module docstring).
+
+    Params:
+        fieldWeights: dict of the searched AudioFileTags field names to the weight of their tokens
+    '''
+    def __init__(self, fieldWeights=None):
+        self.fieldWeights = dict(fieldWeights if (fieldWeights is not None) else DEFAULT_FIELD_WEIGHTS)
+
+        # Per file: the (field weighted) frequency of each of its tokens, its length (sum of the
+        # frequencies) and the hash of the indexed tag values
+        self._docTokenFrequencies = {}
+        self._docLengths = {}
+        self._docHashes = {}
+
+        # Inverted index: token -> {audio filepath: frequency}, and the sorted tokens for prefixes
+        self._postings = {}
+        self._sortedTokens = []
+        self._totalDocLength = 0.0
+
+    def __len__(self):
+        return len(self._docLengths)
+
+    def setTags(self, audioFilepath, audioFileTags):
+        '''
+        Indexes the given audio file with the given AudioFileTags, replacing its previous entry. A
+        file whose searched tag values didn't change is not reindexed.
+        '''
+        fieldValues = [getattr(audioFileTags, fieldName) or '' for fieldName in self.fieldWeights]
+        docHash = _getFieldValuesHash(fieldValues)
+        if (self._docHashes.get(audioFilepath) == docHash):
+            return
+
+        tokenFrequencies = {}
+        for fieldValue, fieldWeight in zip(fieldValues, self.fieldWeights.values()):
+            for token in tokenize(fieldValue):
+                tokenFrequencies[token] = tokenFrequencies.get(token, 0.0) + fieldWeight
+
+        self.removeAudioFile(audioFilepath)
+        self._addDoc(audioFilepath, tokenFrequencies, docHash)
+
+    def removeAudioFile(self, audioFilepath):
+        '''
+        Removes the given audio file from the index, if it is in it.
+        '''
+        tokenFrequencies = self._docTokenFrequencies.pop(audioFilepath, None)
+        if (tokenFrequencies is None):
+            return
+
+        for token in tokenFrequencies:
+            tokenPostings = self._postings[token]
+            del tokenPostings[audioFilepath]
+            if (not tokenPostings):
+                del self._postings[token]
+                del self._sortedTokens[bisect.bisect_left(self._sortedTokens, token)]
+
+        self._totalDocLength -= self._docLengths.pop(audioFilepath)
+        del self._docHashes[audioFilepath]
+
+    def applyChangeEvent(self, changeEvent):
+        '''
+        Updates the index with the given mlu.library.watch.AudioFileChangeEvent.
+        '''
+        if (changeEvent.newTags is None):
+            self.removeAudioFile(changeEvent.audioFilepath)
+        else:
+            self.setTags(changeEvent.audioFilepath, changeEvent.newTags)
+
+    def syncWithAudioFileIndex(self, audioFileIndex):
+        '''
+        Updates the search index to match the given mlu.library.index.AudioFileIndex: files with
+        changed tags are reindexed, and files no longer in the audio file index are removed.
+        '''
+        indexedFilepaths = set()
+        for audioFilepath, tags, properties in audioFileIndex.iterEntries():
+            self.setTags(audioFilepath, tags)
+            indexedFilepaths.add(audioFilepath)
+
+        for audioFilepath in list(self._docLengths):
+            if (audioFilepath not in indexedFilepaths):
+                self.removeAudioFile(audioFilepath)
+
+    def search(self, queryText, limit=20, prefix=True):
+        '''
+        Returns the SearchResult list of the best matches of the given query text (files having all
+        of its tokens), best first, at most limit results (or all if limit is None).
+
+        Params:
+            queryText: the text typed in the search box
+            limit: maximum number of results
+            prefix: match the last token of the query as a prefix, unless the query ends with a
+                space (the token is then complete)
+        '''
+        queryTokens = tokenize(queryText)
+        if (not queryTokens):
+            return []
+
+        lastTokenIsPrefix = (prefix and not queryText[-1:].isspace())
+
+        scores = None
+        for tokenIndex, queryToken in enumerate(queryTokens):
+            if (lastTokenIsPrefix and tokenIndex == len(queryTokens) - 1):
+                tokenScores = self._getPrefixScores(queryToken)
+            else:
+                tokenScores = self._getTokenScores(queryToken)
+
+            if (scores is None):
+                scores = tokenScores
+            else:
+                scores = {audioFilepath: score + tokenScores[audioFilepath] for audioFilepath, score in scores.items() if (audioFilepath in tokenScores)}
+
+            if (not scores):
+                return []
+
+        rankedFilepaths = sorted(scores, key=lambda audioFilepath: (-scores[audioFilepath], audioFilepath))
+        if (limit is not None):
+            rankedFilepaths = rankedFilepaths[:limit]
+
+        return [SearchResult(audioFilepath, scores[audioFilepath]) for audioFilepath in rankedFilepaths]
+
+    def save(self, filepath=None):
+        '''
+        Saves the index to the given file (defaults to a file in the MLU cache dir). The file is
+        written and synced next to the old one and then moved over it, so a crash never leaves a
+        half-written index.
+        '''
+        if (filepath is None):
+            filepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.cacheDir), DEFAULT_SEARCH_INDEX_FILENAME)
+
+        indexData = {
+            'version': SEARCH_INDEX_VERSION,
+            'fieldWeights': self.fieldWeights,
+            'docs': {
+                audioFilepath: [self._docHashes[audioFilepath], tokenFrequencies]
+                for audioFilepath, tokenFrequencies in self._docTokenFrequencies.items()
+            }
+        }
+
+        # A unique temp file, so that concurrent saves don't write into the same file; it is synced
+        # before being moved over the old index, so that a power loss can't leave it empty
+        tempFd, tempFilepath = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(filepath)))
+        try:
+            with os.fdopen(tempFd, 'w', encoding='utf-8') as indexFile:
+                json.dump(indexData, indexFile, ensure_ascii=False, separators=(',', ':'))
+                indexFile.flush()
+                os.fsync(indexFile.fileno())
+
+            os.replace(tempFilepath, filepath)
+
+        except BaseException:
+            if (os.path.exists(tempFilepath)):
+                os.remove(tempFilepath)
+            raise
+
+        logger.info("Saved library search index of {} files to '{}'".format(len(self), filepath))
+
+    @classmethod
+    def load(cls, filepath=None, fieldWeights=None):
+        '''
+        Returns the index saved to the given file (defaults to the file in the MLU cache dir). An
+        empty index is returned if the file doesn't exist, or if it was saved by another version or
+        with other field weights (the index is then rebuilt by the next update).
+        '''
+        searchIndex = cls(fieldWeights)
+        if (filepath is None):
+            filepath = mypycommons.file.joinPaths(MLUSettings.cacheDir, DEFAULT_SEARCH_INDEX_FILENAME)
+
+        if (not os.path.exists(filepath)):
+            return searchIndex
+
+        try:
+            with open(filepath, 'r', encoding='utf-8') as indexFile:
+                indexData = json.load(indexFile)
+        except ValueError as e:
+            logger.warning("Ignoring unreadable library search index '{}': {}".format(filepath, e))
+            return searchIndex
+
+        if (indexData.get('version') != SEARCH_INDEX_VERSION or indexData.get('fieldWeights') != searchIndex.fieldWeights):
+            logger.info("Ignoring library search index '{}' saved with another version or field weights".format(filepath))
+            return searchIndex
+
+        for audioFilepath, (docHash, tokenFrequencies) in indexData['docs'].items():
+            searchIndex._addDoc(audioFilepath, tokenFrequencies, docHash, sortTokens=False)
+
+        searchIndex._sortedTokens = sorted(searchIndex._postings)
+        return searchIndex
+
+    def _addDoc(self, audioFilepath, tokenFrequencies, docHash, sortTokens=True):
+        for token, frequency in tokenFrequencies.items():
+            tokenPostings = self._postings.get(token)
+            if (tokenPostings is None):
+                tokenPostings = self._postings[token] = {}
+                if (sortTokens):
+                    bisect.insort(self._sortedTokens, token)
+
+            tokenPostings[audioFilepath] = frequency
+
+        docLength = sum(tokenFrequencies.values())
+        self._docTokenFrequencies[audioFilepath] = tokenFrequencies
+        self._docLengths[audioFilepath] = docLength
+        self._docHashes[audioFilepath] = docHash
+        self._totalDocLength += docLength
+
+    def _getTokenScores(self, token, factor=1.0):
+        '''
+        Returns a dict of audio filepath to BM25 score of the files that have the given token.
+        '''
+        tokenPostings = self._postings.get(token)
+        if (not tokenPostings):
+            return {}
+
+        docCount = len(self._docLengths)
+        averageDocLength = (self._totalDocLength / docCount) or 1.0
+        idf = math.log(1.0 + (docCount - len(tokenPostings) + 0.5) / (len(tokenPostings) + 0.5))
+
+        tokenScores = {}
+        for audioFilepath, frequency in tokenPostings.items():
+            lengthNorm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._docLengths[audioFilepath] / averageDocLength)
+            tokenScores[audioFilepath] = factor * idf * frequency * (BM25_K1 + 1.0) / (frequency + lengthNorm)
+
+        return tokenScores
+
+    def _getPrefixScores(self, tokenPrefix):
+        '''
+        Returns a dict of audio filepath to score of the files that have a token starting with the
+        given prefix: the best score of the matching tokens, with tokens that are longer than the
+        prefix scoring a bit less than the exact token.
+        '''
+        prefixScores = {}
+        startIndex = bisect.bisect_left(self._sortedTokens, tokenPrefix)
+
+        for token in self._sortedTokens[startIndex:]:
+            if (not token.startswith(tokenPrefix)):
+                break
+
+            factor = 1.0 if (token == tokenPrefix) else PREFIX_MATCH_FACTOR
+            for audioFilepath, score in self._getTokenScores(token, factor).items():
+                if (score > prefixScores.get(audioFilepath, 0.0)):
+                    prefixScores[audioFilepath] = score
+
+        return prefixScores
+
+def _getFieldValuesHash(fieldValues):
+    return hashlib.sha1('\x00'.join(fieldValues).encode('utf-8')).hexdigest()
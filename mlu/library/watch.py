@@ -0,0 +1,463 @@
+'''
+mlu.library.watch
+
+Module for watching a music library directory for audio files that are added, removed or retagged,
+without rescanning the whole library. On Linux, the directory tree is watched with inotify;
+elsewhere (or if inotify can't be used), the tree is polled for changed file stat signatures.
+
+Changes are debounced: a burst of writes (e.g. a tagger saving hundreds of files) is collected
+until the library has been quiet for a moment, then only the files that changed are read again
+and a change event is emitted for each file whose tags changed.
+'''
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+from mlu.tags import formats
+from mlu.library import scan
+from mlu.library import index
+
+logger = logging.getLogger("mluGlobalLogger")
+
+CHANGE_TYPE_ADDED = 'added'
+CHANGE_TYPE_MODIFIED = 'modified'
+CHANGE_TYPE_REMOVED = 'removed'
+
+# Seconds without any new change after which a burst of changes is processed
+DEFAULT_DEBOUNCE_SECONDS = 0.5
+# Seconds after which a burst of changes is processed even if changes keep coming in
+DEFAULT_MAX_DELAY_SECONDS = 10.0
+# Seconds between the directory tree walks of the polling watcher
+DEFAULT_POLL_INTERVAL_SECONDS = 2.0
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY is watched too, so that a file that is still being written keeps delaying its burst
+INOTIFY_WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+    IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+
+class AudioFileChangeEvent:
+    '''
+    Data structure holding a change to a single audio file of the watched library.
+
+    Params:
+        audioFilepath: filepath of the audio file
+        changeType: one of CHANGE_TYPE_ADDED, CHANGE_TYPE_MODIFIED, CHANGE_TYPE_REMOVED
+        oldTags: AudioFileTags of the file before the change (None for an added file)
+        newTags: AudioFileTags of the file after the change (None for a removed file, or if the
+            file failed to be read)
+        tagsDiff: changed tag values, see AudioFileTags.diff() (for an added/removed file, all the
+            fields that have a value)
+        error: description of why reading the changed file failed, or None
+    '''
+    def __init__(self, audioFilepath, changeType, oldTags, newTags, tagsDiff, error=None):
+        self.audioFilepath = audioFilepath
+        self.changeType = changeType
+        self.oldTags = oldTags
+        self.newTags = newTags
+        self.tagsDiff = tagsDiff
+        self.error = error
+
+    def succeeded(self):
+        return (self.error is None)
+
+class LibraryWatcher:
+    '''
+    Class that watches the supported audio files under a root directory and keeps a live view of
+    their tags, reporting the changes as AudioFileChangeEvents (see getChanges() and watch()).
+
+    On creation, the tags of all the files are read once (unless initialTags is given), to have
+    something to diff the changes against.
+
+    Params:
+        rootDir: root directory of the library to watch
+        initialTags: dict of audio filepath to AudioFileTags of the files currently in the library
+            (e.g. from an AudioFileIndex), to skip the initial read
+        usePolling: poll the directory tree instead of using inotify
+        debounceSeconds: quiet time after which a burst of changes is processed
+        maxDelaySeconds: time after which a burst of changes is processed regardless
+        pollIntervalSeconds: time between the tree walks of the polling watcher
+        workers: number of worker processes used to read the changed files (see mlu.library.scan)
+    '''
+    def __init__(
+        self,
+        rootDir,
+        initialTags=None,
+        usePolling=False,
+        debounceSeconds=DEFAULT_DEBOUNCE_SECONDS,
+        maxDelaySeconds=DEFAULT_MAX_DELAY_SECONDS,
+        pollIntervalSeconds=DEFAULT_POLL_INTERVAL_SECONDS,
+        workers=1
+    ):
+        self.rootDir = os.path.abspath(rootDir)
+        self.debounceSeconds = debounceSeconds
+        self.maxDelaySeconds = maxDelaySeconds
+        self.workers = workers
+
+        if (not os.path.isdir(self.rootDir)):
+            raise ValueError("Cannot watch directory '{}': path is not an existing directory".format(rootDir))
+
+        self._backend = None
+        if (not usePolling):
+            try:
+                self._backend = _InotifyBackend(self.rootDir)
+            except OSError as e:
+                logger.warning("Cannot watch '{}' with inotify, polling the directory instead: {}".format(self.rootDir, e))
+
+        if (self._backend is None):
+            self._backend = _PollingBackend(self.rootDir, pollIntervalSeconds)
+
+        self._tags = {}
+        self._signatures = {}
+        self._pendingPaths = set()
+        self._pendingDirs = set()
+
+        # Created after the backend, so that no change made while the initial tags are read is missed
+        if (initialTags is None):
+            self._readInitialTags()
+        else:
+            self._useInitialTags(initialTags)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self._backend.close()
+
+    def getTags(self, audioFilepath):
+        '''
+        Returns the current AudioFileTags of the given audio file, or None if it is not in the
+        watched library.
+        '''
+        return self._tags.get(os.path.abspath(audioFilepath))
+
+    def getAudioFilepaths(self):
+        return list(self._tags)
+
+    def getChanges(self, timeout=None):
+        '''
+        Waits for the next burst of changes and returns a list of AudioFileChangeEvent for the files
+        whose tags changed. Returns an empty list if nothing changed within the given timeout
+        (seconds, or None to wait until something changes).
+        '''
+        deadline = None if (timeout is None) else time.monotonic() + timeout
+        burstStart = None
+        lastChange = None
+
+        if (self._pendingPaths or self._pendingDirs):
+            burstStart = lastChange = time.monotonic()
+
+        while (True):
+            now = time.monotonic()
+            if (burstStart is not None):
+                # Wait for the burst to go quiet (or to last too long)
+                waitUntil = min(lastChange + self.debounceSeconds, burstStart + self.maxDelaySeconds)
+            elif (deadline is not None):
+                waitUntil = deadline
+            else:
+                waitUntil = None
+
+            if (waitUntil is not None and now >= waitUntil):
+                if (burstStart is None):
+                    return []
+
+                events = self._processPendingChanges()
+                if (events or (deadline is not None and now >= deadline)):
+                    return events
+
+                # The burst didn't change any tags (e.g. a file was saved unchanged): keep waiting
+                burstStart = lastChange = None
+                continue
+
+            changedPaths, changedDirs = self._backend.readChanges(None if (waitUntil is None) else waitUntil - now)
+            if (changedPaths or changedDirs):
+                self._pendingPaths.update(changedPaths)
+                self._pendingDirs.update(changedDirs)
+                lastChange = time.monotonic()
+                if (burstStart is None):
+                    burstStart = lastChange
+
+    def watch(self):
+        '''
+        Yields an AudioFileChangeEvent for each change to the tags of the library, forever (until
+        the watcher is closed or the generator is closed).
+        '''
+        while (True):
+            for event in self.getChanges():
+                yield event
+
+    def _readInitialTags(self):
+        audioFilepaths = []
+        for audioFilepath in scan.getAudioFilepaths(self.rootDir):
+            signature = _getSignature(audioFilepath)
+            if (signature is not None):
+                self._signatures[audioFilepath] = signature
+                audioFilepaths.append(audioFilepath)
+
+        for result in scan.scanAudioFiles(audioFilepaths, workers=self.workers, tagsOnly=True):
+            if (result.succeeded()):
+                self._tags[result.audioFilepath] = result.tags
+            else:
+                logger.warning("Failed to read audio file '{}' for the library watcher: {}".format(result.audioFilepath, result.error))
+
+    def _useInitialTags(self, initialTags):
+        # The given files are taken as up to date: only the files that are missing from them (or
+        # that no longer exist) are checked on the first burst
+        for audioFilepath, audioFileTags in initialTags.items():
+            self._tags[os.path.abspath(audioFilepath)] = audioFileTags
+
+        for audioFilepath in scan.getAudioFilepaths(self.rootDir):
+            signature = _getSignature(audioFilepath)
+            if (audioFilepath in self._tags and signature is not None):
+                self._signatures[audioFilepath] = signature
+            else:
+                self._pendingPaths.add(audioFilepath)
+
+        self._pendingPaths.update(filepath for filepath in self._tags if (filepath not in self._signatures))
+
+    def _processPendingChanges(self):
+        '''
+        Reads the files that changed since the last burst and returns the change events.
+        '''
+        candidatePaths = set(self._pendingPaths)
+        for dirPath in self._pendingDirs:
+            # A changed directory (created, moved or removed as a whole): check all the known files
+            # under it, and all the files it now holds
+            dirPrefix = os.path.join(dirPath, '')
+            candidatePaths.update(filepath for filepath in self._signatures if (filepath.startswith(dirPrefix)))
+            candidatePaths.update(filepath for filepath in self._tags if (filepath.startswith(dirPrefix)))
+            if (os.path.isdir(dirPath)):
+                candidatePaths.update(scan.getAudioFilepaths(dirPath))
+
+        self._pendingPaths.clear()
+        self._pendingDirs.clear()
+
+        events = []
+        filesToRead = []
+        for audioFilepath in candidatePaths:
+            if (not _isSupportedAudioFilepath(audioFilepath)):
+                continue
+
+            signature = _getSignature(audioFilepath)
+            if (signature is None):
+                self._signatures.pop(audioFilepath, None)
+                oldTags = self._tags.pop(audioFilepath, None)
+                if (oldTags is not None):
+                    events.append(AudioFileChangeEvent(
+                        audioFilepath, CHANGE_TYPE_REMOVED, oldTags, None, _getAllValuesDiff(oldTags, isOld=True)
+                    ))
+
+            elif (self._signatures.get(audioFilepath) != signature):
+                self._signatures[audioFilepath] = signature
+                filesToRead.append(audioFilepath)
+
+        for result in scan.scanAudioFiles(filesToRead, workers=self.workers, tagsOnly=True):
+            event = self._getReadEvent(result)
+            if (event is not None):
+                events.append(event)
+
+        events.sort(key=lambda event: event.audioFilepath)
+        return events
+
+    def _getReadEvent(self, result):
+        audioFilepath = result.audioFilepath
+        oldTags = self._tags.get(audioFilepath)
+        changeType = CHANGE_TYPE_ADDED if (oldTags is None) else CHANGE_TYPE_MODIFIED
+
+        if (not result.succeeded()):
+            logger.warning("Failed to read changed audio file '{}': {}".format(audioFilepath, result.error))
+            return AudioFileChangeEvent(audioFilepath, changeType, oldTags, None, {}, error=result.error)
+
+        self._tags[audioFilepath] = result.tags
+        if (oldTags is None):
+            return AudioFileChangeEvent(audioFilepath, changeType, None, result.tags, _getAllValuesDiff(result.tags, isOld=False))
+
+        tagsDiff = oldTags.diff(result.tags)
+        if (not tagsDiff):
+            return None
+
+        return AudioFileChangeEvent(audioFilepath, changeType, oldTags, result.tags, tagsDiff)
+
+class _PollingBackend:
+    '''
+    Watcher backend that walks the directory tree at a fixed interval and reports the files whose
+    stat signature changed (or that appeared or disappeared) since the last walk.
+    '''
+    def __init__(self, rootDir, pollIntervalSeconds):
+        self.rootDir = rootDir
+        self.pollIntervalSeconds = pollIntervalSeconds
+        self._signatures = self._getSignatures()
+        self._nextPoll = time.monotonic() + pollIntervalSeconds
+
+    def close(self):
+        pass
+
+    def readChanges(self, timeout):
+        waitSeconds = self._nextPoll - time.monotonic()
+        if (timeout is not None and timeout < waitSeconds):
+            time.sleep(max(timeout, 0))
+            return (set(), set())
+
+        time.sleep(max(waitSeconds, 0))
+        self._nextPoll = time.monotonic() + self.pollIntervalSeconds
+
+        signatures = self._getSignatures()
+        changedPaths = set(self._signatures) ^ set(signatures)
+        changedPaths.update(filepath for filepath, signature in signatures.items() if (self._signatures.get(filepath, signature) != signature))
+        self._signatures = signatures
+
+        return (changedPaths, set())
+
+    def _getSignatures(self):
+        signatures = {}
+        for audioFilepath in scan.getAudioFilepaths(self.rootDir):
+            signature = _getSignature(audioFilepath)
+            if (signature is not None):
+                signatures[audioFilepath] = signature
+
+        return signatures
+
+class _InotifyBackend:
+    '''
+    Watcher backend that uses Linux inotify (through libc with ctypes) to get the changed paths.
+    Every directory of the tree needs a watch of its own: watches are added for new directories as
+    they appear. If the kernel event queue overflows, the whole tree is reported as changed.
+    '''
+    def __init__(self, rootDir):
+        if (not sys.platform.startswith('linux')):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, "inotify functions not found in libc: {}".format(e))
+
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rootDir = rootDir
+        self._dirsByWatch = {}
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if (self._fd < 0):
+            initErrno = ctypes.get_errno()
+            raise OSError(initErrno, "inotify_init1 failed: {}".format(os.strerror(initErrno)))
+
+        try:
+            self._addWatchesRecursive(rootDir)
+        except:
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        if (self._fd is not None):
+            os.close(self._fd)
+            self._fd = None
+
+    def readChanges(self, timeout):
+        readableFds, _, _ = select.select([self._fd], [], [], timeout)
+        if (not readableFds):
+            return (set(), set())
+
+        try:
+            eventData = os.read(self._fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return (set(), set())
+
+        changedPaths = set()
+        changedDirs = set()
+        position = 0
+        while (position < len(eventData)):
+            watchDescriptor, mask, cookie, nameLength = INOTIFY_EVENT_HEADER.unpack_from(eventData, position)
+            position += INOTIFY_EVENT_HEADER.size
+            name = os.fsdecode(eventData[position:position + nameLength].rstrip(b'\0'))
+            position += nameLength
+
+            if (mask & IN_Q_OVERFLOW):
+                logger.warning("inotify event queue overflowed while watching '{}': checking the whole tree".format(self.rootDir))
+                changedDirs.add(self.rootDir)
+                continue
+
+            dirPath = self._dirsByWatch.get(watchDescriptor)
+            if (mask & IN_IGNORED):
+                self._dirsByWatch.pop(watchDescriptor, None)
+                continue
+            if (dirPath is None):
+                continue
+
+            if (mask & (IN_DELETE_SELF | IN_MOVE_SELF)):
+                changedDirs.add(dirPath)
+                continue
+
+            path = os.path.join(dirPath, name)
+            if (mask & IN_ISDIR):
+                changedDirs.add(path)
+                if (mask & (IN_CREATE | IN_MOVED_TO)):
+                    self._addWatchesRecursive(path)
+            else:
+                changedPaths.add(path)
+
+        return (changedPaths, changedDirs)
+
+    def _addWatchesRecursive(self, rootDir):
+        for dirPath, dirNames, fileNames in os.walk(rootDir):
+            watchDescriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(dirPath), INOTIFY_WATCH_MASK)
+            if (watchDescriptor < 0):
+                watchErrno = ctypes.get_errno()
+                if (watchErrno == errno.ENOENT or watchErrno == errno.ENOTDIR):
+                    # The directory was removed before it could be watched
+                    continue
+                raise OSError(watchErrno, "Cannot watch directory '{}': {}".format(dirPath, os.strerror(watchErrno)))
+
+            self._dirsByWatch[watchDescriptor] = dirPath
+
+def _isSupportedAudioFilepath(filepath):
+    return formats.hasSupportedFileExtension(filepath)
+
+def _getSignature(audioFilepath):
+    try:
+        return index.getAudioFileIndexSignature(os.stat(audioFilepath))
+    except OSError:
+        return None
+
+def _getAllValuesDiff(audioFileTags, isOld):
+    # Diff of an added (or removed) file: every field that has a value changed from (or to) nothing
+    tagsDiff = {}
+    for fieldName in audioFileTags.FIELD_NAMES:
+        if (fieldName == 'OTHER_TAGS'):
+            continue
+        value = getattr(audioFileTags, fieldName)
+        if (value):
+            tagsDiff[fieldName] = (value, None) if (isOld) else (None, value)
+
+    otherTags = audioFileTags.OTHER_TAGS or {}
+    if (otherTags):
+        tagsDiff['OTHER_TAGS'] = {tagName: ((value, None) if (isOld) else (None, value)) for tagName, value in otherTags.items()}
+
+    return tagsDiff
@@ -6,34 +6,150 @@ Created:  2020-12-25
 Modified: 2021-12-17
 
 Module containing the definition for setting values for MLU (project-wide constants).
+
+Importing this module has no side effects: each setting is resolved the first time it is used,
+and no directories are created (code that writes into a directory creates it when needed, see
+MLUSettings.createDirectory()). The directories can be set with environment variables:
+
+    MLU_CACHE_DIR: dir of the cache files (index, artwork store, ...)
+    MLU_LOG_DIR: dir of the log files
+    MLU_TEMP_DIR: dir of the temporary files, defaults to the 'temp' dir in the cache dir
+
+Otherwise the '~cache' and '~logs' dirs of the project are used if they exist (a development
+checkout), or else the XDG base dirs ($XDG_CACHE_HOME/mlu, $XDG_STATE_HOME/mlu/logs).
 '''
 
-from com.nwrobel import mypycommons
-import com.nwrobel.mypycommons.file
+import os
+
+PROJECT_CACHE_DIRNAME = '~cache'
+PROJECT_LOG_DIRNAME = '~logs'
+APP_DIRNAME = 'mlu'
 
 def getProjectRootDir():
-    thisScriptDir = mypycommons.file.getThisScriptCurrentDirectory()
-    projectRootDir = mypycommons.file.joinPaths(thisScriptDir, '..')
+    thisScriptDir = os.path.dirname(os.path.abspath(__file__))
+    projectRootDir = os.path.join(thisScriptDir, '..')
     return projectRootDir
 
-class MLUSettings:
-    projectRootDir = getProjectRootDir()
-    logDir = mypycommons.file.joinPaths(projectRootDir, '~logs')
-    cacheDir = mypycommons.file.joinPaths(projectRootDir, '~cache')
+def _getUserDir(xdgEnvVarName, defaultRelativePath):
+    xdgDir = os.environ.get(xdgEnvVarName)
+    if (not xdgDir):
+        xdgDir = os.path.join(os.path.expanduser('~'), defaultRelativePath)
+
+    return xdgDir
+
+def _resolveCacheDir(settings):
+    envDir = os.environ.get('MLU_CACHE_DIR')
+    if (envDir):
+        return envDir
+
+    projectCacheDir = os.path.join(settings.projectRootDir, PROJECT_CACHE_DIRNAME)
+    if (os.path.isdir(projectCacheDir)):
+        return projectCacheDir
+
+    return os.path.join(_getUserDir('XDG_CACHE_HOME', '.cache'), APP_DIRNAME)
+
+def _resolveLogDir(settings):
+    envDir = os.environ.get('MLU_LOG_DIR')
+    if (envDir):
+        return envDir
+
+    projectLogDir = os.path.join(settings.projectRootDir, PROJECT_LOG_DIRNAME)
+    if (os.path.isdir(projectLogDir)):
+        return projectLogDir
+
+    return os.path.join(_getUserDir('XDG_STATE_HOME', os.path.join('.local', 'state')), APP_DIRNAME, 'logs')
+
+def _resolveTempDir(settings):
+    envDir = os.environ.get('MLU_TEMP_DIR')
+    if (envDir):
+        return envDir
+
+    return os.path.join(settings.cacheDir, 'temp')
+
+# Function resolving the value of each setting (given the settings class, for settings that
+# depend on others)
+_SETTING_RESOLVERS = {
+    'projectRootDir': lambda settings: getProjectRootDir(),
+    'cacheDir': _resolveCacheDir,
+    'logDir': _resolveLogDir,
+    'tempDir': _resolveTempDir,
+    'testDataDir': lambda settings: os.path.join(settings.projectRootDir, 'test/data')
+}
+
+# Settings that the default value of each setting is derived from
+_SETTING_DEPENDENCIES = {
+    'cacheDir': ['projectRootDir'],
+    'logDir': ['projectRootDir'],
+    'tempDir': ['cacheDir'],
+    'testDataDir': ['projectRootDir']
+}
+
+# Names of the settings set with MLUSettings.configure()
+_configuredSettingNames = set()
+
+class _LazySettingsType(type):
+    '''
+    Metaclass of MLUSettings, which resolves each setting on first access (class attribute
+    lookups that are not found on the class itself end up here) and keeps the value.
+    '''
+    def __getattr__(cls, name):
+        resolveFunc = _SETTING_RESOLVERS.get(name)
+        if (resolveFunc is None):
+            raise AttributeError("type object '{}' has no attribute '{}'".format(cls.__name__, name))
+
+        value = resolveFunc(cls)
+        setattr(cls, name, value)
+        return value
 
-    # Dirs of where various types of cache files are stored
-    tempDir = mypycommons.file.joinPaths(cacheDir, 'temp')
+class MLUSettings(metaclass=_LazySettingsType):
+    '''
+    Project-wide settings, read as class attributes (e.g. MLUSettings.cacheDir): projectRootDir,
+    cacheDir, logDir, tempDir, testDataDir.
+    '''
+    @classmethod
+    def configure(cls, **settingValues):
+        '''
+        Sets the given settings (e.g. cacheDir='/var/cache/mlu'), overriding the environment and
+        defaults. Settings that were derived from a changed one (tempDir from cacheDir) are resolved
+        again, unless they were configured too; the other settings keep their values.
+        '''
+        for name, value in settingValues.items():
+            if (name not in _SETTING_RESOLVERS):
+                raise ValueError("Unknown MLU setting '{}'".format(name))
 
-    # Test data
-    testDataDir = mypycommons.file.joinPaths(projectRootDir, 'test/data')
+        changedNames = set(settingValues)
+        dependentsChanged = True
+        while (dependentsChanged):
+            dependentsChanged = False
+            for name, dependencyNames in _SETTING_DEPENDENCIES.items():
+                if (name not in changedNames and name not in _configuredSettingNames and changedNames.intersection(dependencyNames)):
+                    changedNames.add(name)
+                    dependentsChanged = True
 
-    # Create empty directories
-    if (not mypycommons.file.pathExists(logDir)):
-        mypycommons.file.createDirectory(logDir)
+        for name in changedNames:
+            if (name in cls.__dict__):
+                delattr(cls, name)
 
-    if (not mypycommons.file.pathExists(cacheDir)):
-        mypycommons.file.createDirectory(cacheDir)
+        for name, value in settingValues.items():
+            setattr(cls, name, value)
+            _configuredSettingNames.add(name)
 
-    if (not mypycommons.file.pathExists(tempDir)):
-        mypycommons.file.createDirectory(tempDir)
+    @classmethod
+    def reset(cls):
+        '''
+        Drops the resolved and configured settings, so that they are resolved again (e.g. after the
+        environment changed) on next access.
+        '''
+        _configuredSettingNames.clear()
+        for name in _SETTING_RESOLVERS:
+            if (name in cls.__dict__):
+                delattr(cls, name)
 
+    @classmethod
+    def createDirectory(cls, dirPath):
+        '''
+        Creates the given settings directory (and its parents) if it doesn't exist yet, and returns
+        its path.
+        '''
+        os.makedirs(dirPath, exist_ok=True)
+        return dirPath
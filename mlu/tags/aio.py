@@ -0,0 +1,196 @@
+'''
+mlu.tags.aio
+
+Module containing an asyncio interface to mlu.tags.io, for using MLU from an event loop (e.g. in
+a web service) without blocking the loop on disk I/O and mutagen parsing. Each call is run in a
+bounded pool of worker threads, shared by all the handlers unless another executor is given.
+
+Writes to the same file are serialized, across all the handlers of the event loop. The asyncio
+locks are created lazily, per event loop, so a handler can be used from more than one loop (e.g.
+from successive asyncio.run() calls). If a call is
+cancelled before it starts running in the pool, it never runs; if it is already running, it is
+finished in the background (a write is never left half done) and the locks it holds are kept
+until it finishes.
+'''
+
+import os
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from mlu.tags import io
+
+# Number of worker threads of the shared pool: calls are mostly waiting on disk I/O, so a few
+# more threads than CPUs is fine, but a slow disk must not get an unbounded number of threads
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+_defaultExecutor = None
+_defaultExecutorLock = threading.Lock()
+
+# Write lock of each audio file, per event loop: event loop -> {normalized filepath: lock}. A
+# lock is dropped once no call holds or waits on it, and the locks of a loop go with the loop
+_writeLocks = weakref.WeakKeyDictionary()
+_writeLocksLock = threading.Lock()
+
+def getDefaultExecutor():
+    '''
+    Returns the thread pool shared by the handlers that are not given an executor of their own,
+    creating it on first use.
+    '''
+    global _defaultExecutor
+
+    with _defaultExecutorLock:
+        if (_defaultExecutor is None):
+            _defaultExecutor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix='mlu-aio')
+
+        return _defaultExecutor
+
+def shutdownDefaultExecutor(wait=True):
+    '''
+    Shuts down the shared thread pool (a new one is created if it is used again).
+    '''
+    global _defaultExecutor
+
+    with _defaultExecutorLock:
+        executor = _defaultExecutor
+        _defaultExecutor = None
+
+    if (executor is not None):
+        executor.shutdown(wait=wait)
+
+class AsyncAudioFileMetadataHandler:
+    '''
+    Class that reads and writes data for a single audio file from an event loop. The methods are
+    coroutines with the same meaning as those of mlu.tags.io.AudioFileMetadataHandler.
+
+    The calls of a handler run one at a time (the underlying handler reuses a single parse of the
+    file and is not thread safe): use more than one handler to read the same file concurrently.
+
+    Params:
+        audioFilepath: absolute filepath of the audio file
+        writePolicy: mlu.tags.writepolicy.TagWritePolicy used when tags are written (optional)
+        instrumentation: mlu.tags.instrumentation.Instrumentation of the handler (optional)
+        journal: mlu.tags.journal.TagWriteJournal that the tag writes are journaled with (optional)
+        executor: concurrent.futures executor to run the calls in, defaults to the shared pool
+    '''
+    def __init__(self, audioFilepath, writePolicy=None, executor=None, instrumentation=None, journal=None):
+        self.audioFilepath = audioFilepath
+        self._writePolicy = writePolicy
+        self._instrumentation = instrumentation
+        self._journal = journal
+        self._executor = executor
+        self._handler = None
+        self._handlerLocks = weakref.WeakKeyDictionary()
+
+    async def getTags(self, tagsOnly=False):
+        return await self._run(lambda handler: handler.getTags(tagsOnly=tagsOnly))
+
+    async def getProperties(self):
+        return await self._run(lambda handler: handler.getProperties())
+
+    async def getEmbeddedArtwork(self):
+        return await self._run(lambda handler: handler.getEmbeddedArtwork())
+
+    async def setTags(self, audioFileTags):
+        await self._runWrite(lambda handler: handler.setTags(audioFileTags))
+
+    async def setCustomTag(self, tagName, value):
+        await self._runWrite(lambda handler: handler.setCustomTag(tagName, value))
+
+    async def commitWriteBatch(self, tagValues=None, customTagValues=None, removedCustomTagNames=()):
+        '''
+        Writes the given tag changes with a single save of the file (see
+        mlu.tags.io.AudioFileTagWriteBatch). Returns whether or not the file was written.
+
+        Params:
+            tagValues: dict of AudioFileTags field name to new value
+            customTagValues: dict of custom tag name to new value
+            removedCustomTagNames: names of the custom tags to remove
+        '''
+        def commit(handler):
+            writeBatch = handler.createWriteBatch()
+            for fieldName, value in (tagValues or {}).items():
+                writeBatch.setTag(fieldName, value)
+            for tagName, value in (customTagValues or {}).items():
+                writeBatch.setCustomTag(tagName, value)
+            for tagName in removedCustomTagNames:
+                writeBatch.removeCustomTag(tagName)
+
+            return writeBatch.commit()
+
+        return await self._runWrite(commit)
+
+    async def _runWrite(self, func):
+        async with _getWriteLock(self.audioFilepath):
+            return await self._run(func)
+
+    async def _run(self, func):
+        '''
+        Runs the given function (which is passed the mlu.tags.io.AudioFileMetadataHandler of the
+        file) in the executor and returns its result.
+        '''
+        loop = _getRunningLoop()
+        handlerLock = self._handlerLocks.get(loop)
+        if (handlerLock is None):
+            handlerLock = self._handlerLocks[loop] = asyncio.Lock()
+
+        async with handlerLock:
+            executor = self._executor if (self._executor is not None) else getDefaultExecutor()
+            concurrentFuture = executor.submit(self._callWithHandler, func)
+
+            try:
+                return await asyncio.wrap_future(concurrentFuture)
+
+            except asyncio.CancelledError:
+                # If the call already started, it can't be stopped: wait for it to finish before
+                # giving up the locks, so that the next call doesn't run alongside it
+                if (not concurrentFuture.cancel()):
+                    await _waitUncancellable(concurrentFuture)
+                raise
+
+    def _callWithHandler(self, func):
+        # Runs in a worker thread: the handler is created here, since its constructor checks the
+        # file on disk
+        if (self._handler is None):
+            self._handler = io.AudioFileMetadataHandler(self.audioFilepath, writePolicy=self._writePolicy, instrumentation=self._instrumentation, journal=self._journal)
+
+        return func(self._handler)
+
+def _getRunningLoop():
+    # asyncio.get_running_loop() is new in Python 3.7: before that, get_event_loop() returns the
+    # running loop when called from a coroutine
+    if (hasattr(asyncio, 'get_running_loop')):
+        return asyncio.get_running_loop()
+
+    return asyncio.get_event_loop()
+
+def _getWriteLock(audioFilepath):
+    '''
+    Returns the write lock of the given audio file for the running event loop. Must be called from
+    a coroutine, so that the lock is created in (and bound to) the loop that uses it.
+    '''
+    loop = _getRunningLoop()
+    lockKey = os.path.normcase(os.path.abspath(audioFilepath))
+
+    with _writeLocksLock:
+        loopWriteLocks = _writeLocks.get(loop)
+        if (loopWriteLocks is None):
+            loopWriteLocks = _writeLocks[loop] = weakref.WeakValueDictionary()
+
+        writeLock = loopWriteLocks.get(lockKey)
+        if (writeLock is None):
+            writeLock = loopWriteLocks[lockKey] = asyncio.Lock()
+
+    return writeLock
+
+async def _waitUncancellable(concurrentFuture):
+    future = asyncio.wrap_future(concurrentFuture)
+    while (not future.done()):
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # The error of the call is not wanted anymore, since the call was cancelled
+            pass
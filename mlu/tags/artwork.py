@@ -0,0 +1,139 @@
+'''
+mlu.tags.artwork
+
+Module containing the data structures for the artwork (pictures) embedded in an audio file.
+
+The picture data is not copied out of the file: the file is memory-mapped and each picture is a
+memoryview over its bytes in the map, along with its offset and length in the file. Pictures that
+are not stored as plain bytes in the file (Opus pictures are base64 encoded in a comment, some ID3
+frames are compressed or unsynchronised) are decoded into memory instead: these have no offset.
+'''
+
+import mmap
+import struct
+
+# Size (bytes) of the pieces that a picture is written in by EmbeddedArtwork.writeTo()
+DEFAULT_WRITE_CHUNK_SIZE = 1024 * 1024
+
+class EmbeddedArtwork:
+    '''
+    Data structure holding a single picture embedded in an audio file.
+
+    Params:
+        data: memoryview of the picture data (e.g. the JPEG/PNG image file)
+        mimeType: mime type of the picture data, or an empty string if not known
+        pictureType: picture type, as defined by ID3 APIC frames / FLAC PICTURE blocks (3 is the
+            front cover), or None if the format has no picture types (M4A)
+        description: description of the picture
+        offset: offset (bytes) of the picture data in the audio file, or None if the picture data
+            was decoded into memory
+    '''
+    def __init__(self, data, mimeType, pictureType, description, offset):
+        self.data = data
+        self.mimeType = mimeType
+        self.pictureType = pictureType
+        self.description = description
+        self.offset = offset
+        self.length = len(data)
+
+    def getBytes(self):
+        '''
+        Returns a copy of the picture data as bytes.
+        '''
+        return self.data.tobytes()
+
+    def writeTo(self, fileObj, chunkSize=DEFAULT_WRITE_CHUNK_SIZE):
+        '''
+        Writes the picture data to the given binary file object, in pieces of the given size, and
+        returns the number of bytes written.
+        '''
+        for chunkStart in range(0, self.length, chunkSize):
+            fileObj.write(self.data[chunkStart:chunkStart + chunkSize])
+
+        return self.length
+
+class EmbeddedArtworkList:
+    '''
+    Collection of the EmbeddedArtwork pictures of an audio file, which holds the memory map of the
+    file that the picture data views point into. The list must be closed (or used as a context
+    manager) once the pictures are no longer needed, to release the map; any slices taken of the
+    picture data views must be released before that.
+    '''
+    def __init__(self, artworks, fileMmap=None):
+        self._artworks = artworks
+        self._fileMmap = fileMmap
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._artworks)
+
+    def __iter__(self):
+        return iter(self._artworks)
+
+    def __getitem__(self, index):
+        return self._artworks[index]
+
+    def close(self):
+        for artwork in self._artworks:
+            artwork.data.release()
+
+        if (self._fileMmap is not None):
+            self._fileMmap.close()
+            self._fileMmap = None
+
+def mapFile(filepath):
+    '''
+    Returns a read-only memory map of the given file, or None if the file is empty (an empty file
+    can't be mapped).
+    '''
+    with open(filepath, 'rb') as fileObj:
+        try:
+            return mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+def readFlacPicture(buffer, blockOffset, blockLength, offsetInFile=True):
+    '''
+    Reads the FLAC PICTURE block at the given offset and length of the given buffer (the same
+    structure is used by the metadata_block_picture Vorbis comment) and returns an
+    EmbeddedArtwork whose data is a view into the buffer. The picture offset is left unset if
+    offsetInFile is not given.
+    '''
+    bufferView = memoryview(buffer)
+    blockEnd = blockOffset + blockLength
+    position = blockOffset
+
+    pictureType, mimeLength = struct.unpack_from('>II', buffer, position)
+    position += 8
+    mimeType = bytes(bufferView[position:position + mimeLength]).decode('ascii', 'replace')
+    position += mimeLength
+
+    descriptionLength, = struct.unpack_from('>I', buffer, position)
+    position += 4
+    description = bytes(bufferView[position:position + descriptionLength]).decode('utf-8', 'replace')
+    position += descriptionLength
+
+    # Skip the width, height, color depth and number of colors
+    position += 16
+    dataLength, = struct.unpack_from('>I', buffer, position)
+    position += 4
+
+    if (position + dataLength > blockEnd):
+        bufferView.release()
+        raise ValueError("Invalid FLAC picture block: picture data runs past the end of the block")
+
+    data = bufferView[position:position + dataLength]
+    bufferView.release()
+
+    return EmbeddedArtwork(
+        data=data,
+        mimeType=mimeType,
+        pictureType=pictureType,
+        description=description,
+        offset=position if (offsetInFile) else None
+    )
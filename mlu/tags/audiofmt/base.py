@@ -0,0 +1,250 @@
+'''
+mlu.tags.audiofmt.base
+
+Module containing the base class shared by the audio format handler classes. It takes care of
+parsing the audio file once and reusing that parse (snapshot) for reads and writes until the file
+changes on disk.
+'''
+
+import functools
+
+import mutagen
+
+from mlu.tags import values
+from mlu.tags import artwork
+from mlu.tags import writepolicy
+from mlu.tags import instrumentation
+from mlu.tags.instrumentation import getDefaultInstrumentation
+from mlu.tags.snapshot import AudioFileSnapshot
+
+class AudioFormatHandlerBase:
+    '''
+    Base class for the audio format handlers. Subclasses implement _decodeTagField() and
+    _readProperties() to decode values from a snapshot, and _applyTagValues(),
+    _applyCustomTagValue() and _removeCustomTag() to change tag values in a mutagen interface
+    before it is saved by writeTags().
+
+    Params:
+        audioFilepath: absolute filepath of the audio file
+        writePolicy: TagWritePolicy used when tags are written, defaults to the default policy
+        instrumentation: mlu.tags.instrumentation.Instrumentation that the timed spans of the
+            handler are reported to, defaults to the default (no-op unless set) instrumentation
+    '''
+    # Name of the audio format, as reported in the file properties and write stats
+    formatName = ''
+
+    def __init__(self, audioFilepath, writePolicy=None, instrumentation=None):
+        self.audioFilepath = audioFilepath
+        self.writePolicy = writePolicy if (writePolicy is not None) else writepolicy.DEFAULT_TAG_WRITE_POLICY
+        self.instrumentation = instrumentation if (instrumentation is not None) else getDefaultInstrumentation()
+        self._snapshot = None
+
+    def getTags(self, tagsOnly=False):
+        '''
+        Returns an AudioFileTags object for the tag values of the audio file
+
+        Params:
+            tagsOnly: if the file has not been parsed yet, read only its tag block instead of
+                parsing the whole file (the audio stream info is not read)
+        '''
+        snapshot = self._getSnapshot(tagsOnly=tagsOnly)
+        if (snapshot.tags is None):
+            mutagenTags = snapshot.mutagenTags
+            if (mutagenTags is None):
+                mutagenTags = {}
+
+            snapshot.tags = self._readTags(mutagenTags)
+
+        return snapshot.tags.copy()
+
+    def getProperties(self):
+        '''
+        Returns an AudioFileProperties object for the file properties of the audio file
+        '''
+        snapshot = self._getSnapshot()
+        if (snapshot.properties is None):
+            with self.instrumentation.span(instrumentation.SPAN_DECODE_PROPERTIES, self.formatName, self.audioFilepath):
+                snapshot.properties = self._readProperties(snapshot)
+
+        return snapshot.properties.copy()
+
+    def getEmbeddedArtwork(self):
+        '''
+        Returns an mlu.tags.artwork.EmbeddedArtworkList of the pictures embedded in the audio file.
+        The picture data is viewed in a memory map of the file rather than copied: the list must be
+        closed once it is no longer needed.
+        '''
+        with self.instrumentation.span(instrumentation.SPAN_READ_ARTWORK, self.formatName, self.audioFilepath, measureIo=True) as span:
+            artworkList = self._getEmbeddedArtworkList()
+            span.setAttribute('pictureCount', len(artworkList))
+            # Pictures without an offset were decoded (e.g. base64, unsynchronised ID3 frames), not mapped
+            span.setAttribute('bytesMapped', sum(embeddedArtwork.length for embeddedArtwork in artworkList if embeddedArtwork.offset is not None))
+            span.setAttribute('bytesDecoded', sum(embeddedArtwork.length for embeddedArtwork in artworkList if embeddedArtwork.offset is None))
+
+        return artworkList
+
+    def _getEmbeddedArtworkList(self):
+        fileMmap = artwork.mapFile(self.audioFilepath)
+        if (fileMmap is None):
+            return artwork.EmbeddedArtworkList([])
+
+        try:
+            artworks = self._readEmbeddedArtwork(fileMmap)
+        except:
+            # Views created before the error may still be referenced (by the traceback): the map
+            # is then closed once they are gone
+            try:
+                fileMmap.close()
+            except BufferError:
+                pass
+            raise
+
+        return artwork.EmbeddedArtworkList(artworks, fileMmap)
+
+    def setTags(self, audioFileTags):
+        '''
+        Writes the playback statistics and rating tags (see values.STATS_TAGS_FIELDS) of the given
+        AudioFileTags object to the audio file.
+        '''
+        tagValues = {fieldName: getattr(audioFileTags, fieldName) for fieldName in values.STATS_TAGS_FIELDS}
+        self.writeTags(tagValues, {})
+
+    def setCustomTag(self, tagName, value):
+        '''
+        Sets the value of the given custom (nonstandard) tag on the audio file.
+        '''
+        self.writeTags({}, {tagName: value})
+
+    def writeTags(self, tagValues, customTagValues, removedCustomTagNames=()):
+        '''
+        Writes tag changes to the audio file with a single save.
+
+        Params:
+            tagValues: dict of AudioFileTags field name to the new value of that standard tag; an
+                empty value removes the tag from the file
+            customTagValues: dict of custom (nonstandard) tag name to the new value of that tag
+            removedCustomTagNames: names of custom tags to remove from the file
+        '''
+        def applyChanges(mutagenInterface):
+            if (mutagenInterface.tags is None):
+                mutagenInterface.add_tags()
+
+            for tagName in removedCustomTagNames:
+                self._removeCustomTag(mutagenInterface, tagName)
+
+            self._applyTagValues(mutagenInterface, tagValues)
+
+            for tagName, value in customTagValues.items():
+                self._applyCustomTagValue(mutagenInterface, tagName, value)
+
+        self._writeToSnapshot(applyChanges)
+
+    def discardSnapshot(self):
+        '''
+        Drops the snapshot of the audio file, so that the file is parsed again on next use (e.g.
+        after the file was replaced on disk by another file).
+        '''
+        self._snapshot = None
+
+    def _applyTagValues(self, mutagenInterface, tagValues):
+        raise NotImplementedError
+
+    def _applyCustomTagValue(self, mutagenInterface, tagName, value):
+        raise NotImplementedError
+
+    def _removeCustomTag(self, mutagenInterface, tagName):
+        raise NotImplementedError
+
+    def _readTags(self, mutagenTags):
+        '''
+        Returns a lazy AudioFileTags object for the given mutagen tags: each tag field is decoded
+        (with _decodeTagField()) the first time that it is accessed.
+        '''
+        decodeFieldFunc = functools.partial(self._decodeTagField, mutagenTags)
+        if (self.instrumentation.enabled):
+            decodeFieldFunc = functools.partial(self._decodeTagFieldInSpan, decodeFieldFunc)
+
+        fieldDecoder = values.LazyFieldDecoder(decodeFieldFunc)
+        return values.AudioFileTags.createLazy(fieldDecoder)
+
+    def _decodeTagField(self, mutagenTags, fieldName):
+        '''
+        Returns the value of the given AudioFileTags field (including OTHER_TAGS) decoded from the
+        given mutagen tags.
+        '''
+        raise NotImplementedError
+
+    def _decodeTagFieldInSpan(self, decodeFieldFunc, fieldName):
+        with self.instrumentation.span(instrumentation.SPAN_DECODE_TAG_FIELD, self.formatName, self.audioFilepath):
+            return decodeFieldFunc(fieldName)
+
+    def _readProperties(self, snapshot):
+        raise NotImplementedError
+
+    def _readEmbeddedArtwork(self, fileMmap):
+        '''
+        Returns a list of EmbeddedArtwork objects for the pictures in the given memory map of the
+        audio file, with data views into the map wherever the picture is stored as plain bytes.
+        '''
+        raise NotImplementedError
+
+    def _loadMutagenInterface(self, audioFilepath):
+        return mutagen.File(audioFilepath)
+
+    def _loadMutagenTags(self, audioFilepath):
+        '''
+        Reads only the tag block of the audio file, without parsing the audio stream, and returns
+        the mutagen tags object (or None if the file has no tags). Handlers without a faster way
+        of reading the tags use a full parse.
+        '''
+        return self._loadMutagenInterface(audioFilepath).tags
+
+    def _saveMutagenInterface(self, mutagenInterface, paddingDecision):
+        mutagenInterface.save(padding=paddingDecision)
+
+    def _getSnapshot(self, tagsOnly=False):
+        '''
+        Returns the snapshot of the audio file, parsing the file again only if there is no snapshot
+        yet or if the file has changed on disk since the last one was taken. Unless tagsOnly is
+        given, a tags-only snapshot is replaced by a full one.
+        '''
+        snapshotIsUsable = False
+        if (self._snapshot is not None and (tagsOnly or not self._snapshot.isTagsOnly)):
+            with self.instrumentation.span(instrumentation.SPAN_STAT, self.formatName, self.audioFilepath):
+                snapshotIsUsable = self._snapshot.isCurrent()
+
+        if (not snapshotIsUsable):
+            if (tagsOnly):
+                with self.instrumentation.span(instrumentation.SPAN_PARSE_TAGS_ONLY, self.formatName, self.audioFilepath, measureIo=True):
+                    self._snapshot = AudioFileSnapshot.loadTagsOnly(self.audioFilepath, self._loadMutagenTags)
+            else:
+                with self.instrumentation.span(instrumentation.SPAN_PARSE, self.formatName, self.audioFilepath, measureIo=True):
+                    self._snapshot = AudioFileSnapshot.load(self.audioFilepath, self._loadMutagenInterface)
+
+        return self._snapshot
+
+    def _writeToSnapshot(self, applyChangesFunc):
+        '''
+        Applies changes to the mutagen interface of the snapshot with the given function, then saves
+        the interface to the audio file. If anything fails, the snapshot is dropped, since its
+        interface no longer matches the file on disk.
+        '''
+        snapshot = self._getSnapshot()
+        paddingDecision = self.writePolicy.createPaddingDecision()
+
+        # The tags handed out so far decode their fields lazily from the mutagen tags that are
+        # about to be changed: decode the rest of their fields first, so they keep the old values
+        if (snapshot.tags is not None):
+            snapshot.tags.detach()
+
+        with self.instrumentation.span(instrumentation.SPAN_SAVE, self.formatName, self.audioFilepath, measureIo=True) as span:
+            try:
+                applyChangesFunc(snapshot.mutagenInterface)
+                self._saveMutagenInterface(snapshot.mutagenInterface, paddingDecision)
+            except:
+                self._snapshot = None
+                raise
+
+            self.writePolicy.recordWrite(self.formatName, paddingDecision)
+            span.setAttribute('fullRewrite', paddingDecision.isFullRewrite())
+            snapshot.refreshAfterWrite()
@@ -4,7 +4,8 @@ mlu.tags.audiofmt.flac
 Module containing class which reads data for a single FLAC audio file.
 '''
 
-import mutagen
+from mutagen.flac import VCFLACDict, FLACNoHeaderError
+from mutagen.id3 import BitPaddedInt
 
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
@@ -12,37 +13,89 @@ import com.nwrobel.mypycommons.time
 import com.nwrobel.mypycommons.convert
 
 from mlu.tags import values
+from mlu.tags import artwork
+from mlu.tags.audiofmt.vorbis import VorbisCommentFormatHandlerBase
 
-class AudioFormatHandlerFLAC:
-    def __init__(self, audioFilepath):
-        self.audioFilepath = audioFilepath
+# Type of the FLAC metadata blocks that hold an embedded picture
+PICTURE_BLOCK_TYPE = 6
 
-    def getEmbeddedArtwork(self):
+class AudioFormatHandlerFLAC(VorbisCommentFormatHandlerBase):
+    formatName = 'FLAC'
+
+    def _loadMutagenTags(self, audioFilepath):
         '''
+        Reads only the Vorbis comment block of the FLAC file: the metadata block headers are walked
+        until the comment block is found, and the other blocks (stream info, seek table, pictures)
+        are skipped over without being parsed.
         '''
-        # mutagenInterface = mutagen.File(self.audioFilepath)
+        with open(audioFilepath, 'rb') as audioFile:
+            header = audioFile.read(4)
+
+            # Some FLAC files have an ID3v2 tag in front of the stream marker
+            if (header[:3] == b'ID3'):
+                id3Header = header + audioFile.read(6)
+                id3Size = BitPaddedInt(id3Header[6:10])
+                audioFile.seek(10 + id3Size)
+                header = audioFile.read(4)
+
+            if (header != b'fLaC'):
+                raise FLACNoHeaderError("'{}' is not a valid FLAC file".format(audioFilepath))
 
-        # if (mutagenInterface.pictures):
-        #     artworksBinaryData = []
-        #     for picture in mutagenInterface.pictures:
-        #         artworksBinaryData.append(picture.data)
-        
-        #     return artworksBinaryData 
+            while (True):
+                blockHeader = audioFile.read(4)
+                if (len(blockHeader) < 4):
+                    return None
 
-        # else:
-        #     return None
-        raise NotImplementedError("Getting album artwork is not implemented yet (this will require use of an external program)")
+                blockType = blockHeader[0] & 0x7F
+                isLastBlock = bool(blockHeader[0] & 0x80)
+                blockLength = int.from_bytes(blockHeader[1:], 'big')
 
+                if (blockType == VCFLACDict.code):
+                    return VCFLACDict(audioFile.read(blockLength))
+                elif (isLastBlock):
+                    return None
 
-    def getProperties(self):
+                audioFile.seek(blockLength, 1)
+
+    def _readEmbeddedArtwork(self, fileMmap):
         '''
+        Returns the pictures of the FLAC PICTURE metadata blocks of the file.
         '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
+        artworks = []
+        position = 0
+
+        # Some FLAC files have an ID3v2 tag in front of the stream marker
+        if (fileMmap[:3] == b'ID3'):
+            position = 10 + BitPaddedInt(fileMmap[6:10])
+
+        if (fileMmap[position:position + 4] != b'fLaC'):
+            raise FLACNoHeaderError("'{}' is not a valid FLAC file".format(self.audioFilepath))
+        position += 4
+
+        while (position + 4 <= len(fileMmap)):
+            blockType = fileMmap[position] & 0x7F
+            isLastBlock = bool(fileMmap[position] & 0x80)
+            blockLength = int.from_bytes(fileMmap[position + 1:position + 4], 'big')
+            position += 4
+
+            if (blockType == PICTURE_BLOCK_TYPE):
+                artworks.append(artwork.readFlacPicture(fileMmap, position, blockLength))
+
+            position += blockLength
+            if (isLastBlock):
+                break
 
-        fileSize = mypycommons.file.getFileSizeBytes(self.audioFilepath)
-        fileDateModified = mypycommons.time.formatTimestampForDisplay(mypycommons.file.getFileDateModifiedTimestamp(self.audioFilepath))
+        return artworks
+
+    def _readProperties(self, snapshot):
+        '''
+        '''
+        mutagenInterface = snapshot.mutagenInterface
+
+        fileSize = snapshot.fileSize
+        fileDateModified = mypycommons.time.formatTimestampForDisplay(snapshot.fileDateModifiedTimestamp)
         duration = mutagenInterface.info.length
-        format = 'FLAC'
+        format = self.formatName
         bitRate = mypycommons.convert.bitsToKilobits(mutagenInterface.info.bitrate)
         bitDepth = mutagenInterface.info.bits_per_sample
         numChannels = mutagenInterface.info.channels
@@ -69,148 +122,3 @@ class AudioFormatHandlerFLAC:
             codec=''
         )
         return audioProperties
-
-    def getTags(self):
-        '''
-        Returns an AudioFileTags object for the tag values for the FLAC audio file
-        '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        title = self._getTagValueFromMutagenInterface(mutagenInterface, 'title')
-        artist = self._getTagValueFromMutagenInterface(mutagenInterface, 'artist')
-        album = self._getTagValueFromMutagenInterface(mutagenInterface, 'album')
-        albumArtist = self._getTagValueFromMutagenInterface(mutagenInterface, 'albumartist')
-        composer = self._getTagValueFromMutagenInterface(mutagenInterface, 'composer')
-        date = self._getTagValueFromMutagenInterface(mutagenInterface, 'date')
-        genre = self._getTagValueFromMutagenInterface(mutagenInterface, 'genre')
-        trackNumber = self._getTagValueFromMutagenInterface(mutagenInterface, 'tracknumber')
-        totalTracks = self._getTagValueFromMutagenInterface(mutagenInterface, 'tracktotal')
-        discNumber = self._getTagValueFromMutagenInterface(mutagenInterface, 'discnumber')
-        totalDiscs = self._getTagValueFromMutagenInterface(mutagenInterface, 'disctotal')
-        bpm = self._getTagValueFromMutagenInterface(mutagenInterface, 'bpm')
-        key = self._getTagValueFromMutagenInterface(mutagenInterface, 'key')
-        lyrics = self._getTagValueFromMutagenInterface(mutagenInterface, 'lyrics')
-        comment = self._getTagValueFromMutagenInterface(mutagenInterface, 'comment')
-        dateAdded = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_added')
-        dateAllPlays = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_all_plays')
-        dateLastPlayed = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_last_played') 
-        playCount = self._getTagValueFromMutagenInterface(mutagenInterface, 'play_count')
-        votes = self._getTagValueFromMutagenInterface(mutagenInterface, 'votes')
-        rating = self._getTagValueFromMutagenInterface(mutagenInterface, 'rating')
-        otherTags = {}
-
-        tagFieldKeysFlac = [
-            'title', 
-            'artist', 
-            'album', 
-            'albumartist', 
-            'composer', 
-            'date', 
-            'genre', 
-            'tracknumber', 
-            'tracktotal', 
-            'discnumber', 
-            'disctotal', 
-            'bpm', 
-            'key', 
-            'lyrics',  
-            'comment', 
-            'date_added', 
-            'date_all_plays', 
-            'date_last_played',
-            'play_count',
-            'votes', 
-            'rating'
-        ]
-
-        mutagenTagKeys = mutagenInterface.tags.keys()
-        relevantTagKeys = self._removeUnneededTagKeysFromTagKeysList(mutagenTagKeys)
-
-        otherTagNames = []
-        for tagKey in relevantTagKeys:
-            if (tagKey.lower() not in tagFieldKeysFlac):
-                otherTagNames.append(tagKey.lower())
-
-        for tagNameKey in otherTagNames:
-            tagValue = self._getTagValueFromMutagenInterface(mutagenInterface, tagNameKey)
-            otherTags[tagNameKey] = tagValue
-
-        audioFileTags = values.AudioFileTags(
-            title=title,
-            artist=artist,
-            album=album,
-            albumArtist=albumArtist,
-            composer=composer,
-            date=date,
-            genre=genre, 
-            trackNumber=trackNumber,
-            totalTracks=totalTracks,
-            discNumber=discNumber,
-            totalDiscs=totalDiscs,
-            bpm=bpm,
-            key=key,
-            lyrics=lyrics,
-            comment=comment,
-            dateAdded=dateAdded,
-            dateAllPlays=dateAllPlays, 
-            dateLastPlayed=dateLastPlayed, 
-            playCount=playCount, 
-            votes=votes, 
-            rating=rating,
-            OTHER_TAGS=otherTags
-        )
-
-        return audioFileTags
-
-    def setTags(self, audioFileTags):
-        '''
-        '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        mutagenInterface['date_all_plays'] = audioFileTags.dateAllPlays
-        mutagenInterface['date_last_played'] = audioFileTags.dateLastPlayed
-        mutagenInterface['play_count'] = audioFileTags.playCount
-        mutagenInterface['votes'] = audioFileTags.votes
-        mutagenInterface['rating'] = audioFileTags.rating
-
-        mutagenInterface.save()
-
-    def _removeUnneededTagKeysFromTagKeysList(self, flacKeys):
-        keysToRemove = [
-            'replaygain_album_gain',
-            'replaygain_album_peak',
-            'replaygain_track_gain',
-            'replaygain_track_peak'
-        ]
-
-        for removeKey in keysToRemove:
-            try:
-                flacKeys.remove(removeKey)
-            except:
-                pass
-
-        return flacKeys
-
-    def _getTagValueFromMutagenInterface(self, mutagenInterface, mutagenKey):
-        try:
-            mutagenValue = mutagenInterface[mutagenKey]
-
-            if (len(mutagenValue) == 1):
-                tagValue = mutagenValue[0]
-            elif (len(mutagenValue) > 1):
-                tagValue = ';'.join(mutagenValue)
-            else:
-                tagValue = ''
-
-        except KeyError:
-            tagValue = ''
-
-        return tagValue 
-
-    def setCustomTag(self, tagName, value):
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        tagName = tagName.lower()
-        mutagenInterface[tagName] = value
-
-        mutagenInterface.save()
\ No newline at end of file
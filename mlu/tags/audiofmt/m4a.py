@@ -4,8 +4,9 @@ mlu.tags.audiofmt.m4a
 Module containing class which reads data for a single m4a audio file.
 '''
 
-import mutagen
-from mutagen.mp4 import MP4
+import re
+
+from mutagen.mp4 import MP4, MP4Tags, Atoms
 
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
@@ -13,52 +14,144 @@ import com.nwrobel.mypycommons.time
 import com.nwrobel.mypycommons.convert
 
 from mlu.tags import values
-
-class AudioFormatHandlerM4A:
-    def __init__(self, audioFilepath):
-        self.audioFilepath = audioFilepath
-
-    def getEmbeddedArtwork(self):
+from mlu.tags import artwork
+from mlu.tags.audiofmt.base import AudioFormatHandlerBase
+
+# M4A atom keys of the MLU standard tag fields that are stored in an atom of their own: the
+# track/disc number and total fields are stored together in the trkn/disk atoms
+TAG_FIELD_KEYS = {
+    'title': '\xa9nam',
+    'artist': '\xa9ART',
+    'album': '\xa9alb',
+    'albumArtist': 'aART',
+    'composer': '\xa9wrt',
+    'date': '\xa9day',
+    'genre': '\xa9gen',
+    'lyrics': '\xa9lyr',
+    'comment': '\xa9cmt',
+    'key': '----:com.apple.iTunes:key',
+    'bpm': '----:com.apple.iTunes:BPM',
+    'dateAdded': '----:com.apple.iTunes:DATE_ADDED',
+    'dateAllPlays': '----:com.apple.iTunes:DATE_ALL_PLAYS',
+    'dateLastPlayed': '----:com.apple.iTunes:DATE_LAST_PLAYED',
+    'playCount': '----:com.apple.iTunes:PLAY_COUNT',
+    'votes': '----:com.apple.iTunes:VOTES',
+    'rating': '----:com.apple.iTunes:RATING'
+}
+
+# Atom key and part (pair of integers) of the track/disc number and total fields
+NUMBER_OF_TOTAL_FIELD_KEYS = {
+    'trackNumber': ('trkn', 0),
+    'totalTracks': ('trkn', 1),
+    'discNumber': ('disk', 0),
+    'totalDiscs': ('disk', 1)
+}
+
+STANDARD_ATOM_KEYS = set(TAG_FIELD_KEYS.values()) | {'trkn', 'disk'}
+
+# Track/disc number value written to the trkn/disk atoms: a number and an optional total ('3/12')
+_NUMBER_OF_TOTAL_PATTERN = re.compile(r'^\s*(\d*)\s*(?:/\s*(\d*)\s*)?$')
+
+# Atom keys that are read as file properties or artwork (or not at all), rather than as other tags
+IGNORED_ATOM_KEYS = {
+    'covr',
+    '----:com.apple.iTunes:replaygain_album_gain',
+    '----:com.apple.iTunes:replaygain_album_peak',
+    '----:com.apple.iTunes:replaygain_track_gain',
+    '----:com.apple.iTunes:replaygain_track_peak',
+    'itunsmpb',
+    'itunnorm'
+}
+
+# Path of the atom holding the cover art pictures
+COVER_ATOM_PATH = [b'moov', b'udta', b'meta', b'ilst', b'covr']
+
+# Mime types of the cover art pictures, by the data type of their data atom
+COVER_DATA_TYPE_MIME_TYPES = {
+    13: 'image/jpeg',
+    14: 'image/png',
+    27: 'image/bmp'
+}
+
+class AudioFormatHandlerM4A(AudioFormatHandlerBase):
+    formatName = 'M4A'
+
+    def _loadMutagenInterface(self, audioFilepath):
+        return MP4(audioFilepath)
+
+    def _loadMutagenTags(self, audioFilepath):
         '''
+        Reads only the metadata item list (moov.udta.meta.ilst) of the m4a file: the atom tree is
+        walked, but the track info is not parsed.
         '''
-        # mutagenInterface = mutagen.File(self.audioFilepath)
-
-        # artworkBinaryData = []
-        # try:
-        #     picsData = mutagenInterface.tags['covr']
-        #     if (isinstance(picsData, list)):
-        #         for picData in picsData:
-        #             artworkBinaryData.append(bytes(picData))
-            
-        #     else:
-        #         artworkBinaryData.append(bytes(picsData))
-
-        #     return artworkBinaryData
-
-        # except KeyError:
-        #     return None
-        raise NotImplementedError("Getting album artwork is not implemented yet (this will require use of an external program)")
+        with open(audioFilepath, 'rb') as audioFile:
+            atoms = Atoms(audioFile)
+            try:
+                atoms.path(b'moov', b'udta', b'meta', b'ilst')
+            except KeyError:
+                return None
 
+            return MP4Tags(atoms, audioFile)
 
-    def getProperties(self):
+    def _readEmbeddedArtwork(self, fileMmap):
         '''
+        Returns the pictures of the data atoms of the moov.udta.meta.ilst.covr atom of the file.
         '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
+        atomStart = 0
+        atomEnd = len(fileMmap)
+        for atomName in COVER_ATOM_PATH:
+            childAtom = _findAtom(fileMmap, atomStart, atomEnd, atomName)
+            if (childAtom is None):
+                return []
+
+            atomStart, atomEnd = childAtom
+            # The meta atom is a "full" atom: its children follow a version/flags field
+            if (atomName == b'meta'):
+                atomStart += 4
+
+        artworks = []
+        for atomName, dataAtomStart, dataAtomEnd in _getChildAtoms(fileMmap, atomStart, atomEnd):
+            if (atomName != b'data'):
+                continue
+
+            # The data atom holds a version byte and the 3-byte data type, a 4-byte locale, then
+            # the picture data
+            dataType = int.from_bytes(fileMmap[dataAtomStart + 1:dataAtomStart + 4], 'big')
+            pictureStart = dataAtomStart + 8
+
+            fileView = memoryview(fileMmap)
+            data = fileView[pictureStart:dataAtomEnd]
+            fileView.release()
+
+            artworks.append(artwork.EmbeddedArtwork(
+                data=data,
+                mimeType=COVER_DATA_TYPE_MIME_TYPES.get(dataType, ''),
+                pictureType=None,
+                description='',
+                offset=pictureStart
+            ))
+
+        return artworks
+
+    def _readProperties(self, snapshot):
+        '''
+        '''
+        mutagenInterface = snapshot.mutagenInterface
 
-        fileSize = mypycommons.file.getFileSizeBytes(self.audioFilepath)
-        fileDateModified = mypycommons.time.formatTimestampForDisplay(mypycommons.file.getFileDateModifiedTimestamp(self.audioFilepath))
+        fileSize = snapshot.fileSize
+        fileDateModified = mypycommons.time.formatTimestampForDisplay(snapshot.fileDateModifiedTimestamp)
         duration = mutagenInterface.info.length
-        format = 'M4A'
+        format = self.formatName
         codec = mutagenInterface.info.codec_description
         bitRate = mypycommons.convert.bitsToKilobits(mutagenInterface.info.bitrate)
         bitDepth = mutagenInterface.info.bits_per_sample
         numChannels = mutagenInterface.info.channels
         sampleRate = mutagenInterface.info.sample_rate
         replayGain = {
-            'albumGain': self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:replaygain_album_gain'),
-            'albumPeak': self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:replaygain_album_peak'),
-            'trackGain': self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:replaygain_track_gain'),
-            'trackPeak': self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:replaygain_track_peak')
+            'albumGain': self._getTagValueFromMutagenInterface(mutagenInterface.tags, '----:com.apple.iTunes:replaygain_album_gain'),
+            'albumPeak': self._getTagValueFromMutagenInterface(mutagenInterface.tags, '----:com.apple.iTunes:replaygain_album_peak'),
+            'trackGain': self._getTagValueFromMutagenInterface(mutagenInterface.tags, '----:com.apple.iTunes:replaygain_track_gain'),
+            'trackPeak': self._getTagValueFromMutagenInterface(mutagenInterface.tags, '----:com.apple.iTunes:replaygain_track_peak')
         }
 
         audioProperties = values.AudioFileProperties(
@@ -78,159 +171,90 @@ class AudioFormatHandlerM4A:
         return audioProperties
 
 
-    def getTags(self):
+    def _decodeTagField(self, mutagenTags, fieldName):
         '''
-        Returns an AudioFileTags object for the tag values for the M4A audio file
+        Returns the value of the given AudioFileTags field for the M4A audio file
         '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        # Standard M4A tags
-        title = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9nam')
-        artist = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9ART')
-        album = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9alb')
-        albumArtist = self._getTagValueFromMutagenInterface(mutagenInterface, 'aART')
-        composer = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9wrt')
-        date = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9day')
-        genre = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9gen')
-        lyrics = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9lyr')
-        comment = self._getTagValueFromMutagenInterface(mutagenInterface, '\xa9cmt')
-        trackNumOfTotal = self._getTagValueFromMutagenInterface(mutagenInterface, 'trkn')
-        discNumOfTotal = self._getTagValueFromMutagenInterface(mutagenInterface, 'disk')
-
-        if (isinstance(trackNumOfTotal, tuple)):
-            trackNumber = trackNumOfTotal[0]
-            totalTracks = trackNumOfTotal[1]
-            if (trackNumber == 0):
-                trackNumber = ''
-            if (totalTracks == 0):
-                totalTracks = ''
-        else:
-            trackNumber = ''
-            totalTracks = ''
-
-        if (isinstance(discNumOfTotal, tuple)):
-            discNumber = discNumOfTotal[0]
-            totalDiscs = discNumOfTotal[1]
-            if (discNumber == 0):
-                discNumber = ''
-            if (totalDiscs == 0):
-                totalDiscs = ''
-        else:
-            discNumber = ''
-            totalDiscs = ''
-        
-
-        # Nonstandard (custom) M4A tags
-        key = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:key')
-        bpm = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:BPM')
-        dateAdded = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:DATE_ADDED')
-        dateAllPlays = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:DATE_ALL_PLAYS')
-        dateLastPlayed = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:DATE_LAST_PLAYED') 
-        playCount = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:PLAY_COUNT')
-        votes = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:VOTES')
-        rating = self._getTagValueFromMutagenInterface(mutagenInterface, '----:com.apple.iTunes:RATING')
+        if (fieldName == 'OTHER_TAGS'):
+            return self._decodeOtherTags(mutagenTags)
+
+        if (fieldName in NUMBER_OF_TOTAL_FIELD_KEYS):
+            atomKey, partIndex = NUMBER_OF_TOTAL_FIELD_KEYS[fieldName]
+            numberOfTotal = self._getTagValueFromMutagenInterface(mutagenTags, atomKey)
+
+            # The number and total are stored as a pair of integers, 0 when not set
+            if (isinstance(numberOfTotal, tuple) and numberOfTotal[partIndex] != 0):
+                return str(numberOfTotal[partIndex])
+            else:
+                return ''
+
+        return self._getTagValueFromMutagenInterface(mutagenTags, TAG_FIELD_KEYS[fieldName])
+
+    def _decodeOtherTags(self, mutagenTags):
         otherTags = {}
+        for tagKey in mutagenTags.keys():
+            if (tagKey in STANDARD_ATOM_KEYS or tagKey in IGNORED_ATOM_KEYS):
+                continue
 
-        tagFieldKeysM4A = [
-            '\xa9nam', 
-            '\xa9ART',
-            '\xa9alb', 
-            'aART', 
-            '\xa9wrt', 
-            '\xa9day', 
-            '\xa9gen', 
-            '\xa9lyr', 
-            '\xa9cmt',
-            'trkn', 
-            'disk', 
-            '----:com.apple.iTunes:key', 
-            '----:com.apple.iTunes:BPM', 
-            '----:com.apple.iTunes:DATE_ADDED', 
-            '----:com.apple.iTunes:DATE_ALL_PLAYS', 
-            '----:com.apple.iTunes:DATE_LAST_PLAYED',
-            '----:com.apple.iTunes:PLAY_COUNT', 
-            '----:com.apple.iTunes:VOTES', 
-            '----:com.apple.iTunes:RATING'
-        ]
-
-        mutagenTagKeys = list(mutagenInterface.keys())
-        relevantTagKeys = self._removeUnneededTagKeysFromTagKeysList(mutagenTagKeys)
-
-        otherTagKeys = []
-        for tagKey in relevantTagKeys:
-            if (tagKey not in tagFieldKeysM4A):
-                otherTagKeys.append(tagKey)
-
-        for tagKey in otherTagKeys:
-            tagValue = self._getTagValueFromMutagenInterface(mutagenInterface, tagKey)
+            tagValue = self._getTagValueFromMutagenInterface(mutagenTags, tagKey)
             tagNameFormatted = self._formatM4AKeyToTagName(tagKey)
             otherTags[tagNameFormatted] = tagValue
 
-        audioFileTags = values.AudioFileTags(
-            title=title,
-            artist=artist,
-            album=album,
-            albumArtist=albumArtist,
-            composer=composer,
-            date=date,
-            genre=genre, 
-            trackNumber=str(trackNumber),
-            totalTracks=str(totalTracks),
-            discNumber=str(discNumber),
-            totalDiscs=str(totalDiscs),
-            bpm=bpm,
-            key=key,
-            lyrics=lyrics,
-            comment=comment,
-            dateAdded=dateAdded,
-            dateAllPlays=dateAllPlays, 
-            dateLastPlayed=dateLastPlayed, 
-            playCount=playCount, 
-            votes=votes, 
-            rating=rating,
-            OTHER_TAGS=otherTags
-        )
-        return audioFileTags
-
-    def setTags(self, audioFileTags):
-        '''
-        '''
-        mutagenInterface = MP4(self.audioFilepath)
-
-        # Standard M4A tags
-        # mutagenInterface['\xa9nam'] = audioFileTags.title
-        # mutagenInterface['\xa9ART'] = audioFileTags.artist
-        # mutagenInterface['\xa9alb'] = audioFileTags.album
-        # mutagenInterface['aART'] = audioFileTags.albumArtist
-        # mutagenInterface['\xa9gen'] = audioFileTags.genre
-
-        # Nonstandard (custom) M4A tags
-        mutagenInterface['----:com.apple.iTunes:DATE_ALL_PLAYS'] = (audioFileTags.dateAllPlays).encode('utf-8')
-        mutagenInterface['----:com.apple.iTunes:DATE_LAST_PLAYED'] = (audioFileTags.dateLastPlayed).encode('utf-8')
-        mutagenInterface['----:com.apple.iTunes:PLAY_COUNT'] = (audioFileTags.playCount).encode('utf-8')
-        mutagenInterface['----:com.apple.iTunes:VOTES'] = (audioFileTags.votes).encode('utf-8')
-        mutagenInterface['----:com.apple.iTunes:RATING'] = (audioFileTags.rating).encode('utf-8')
-
-        mutagenInterface.save()
-
-    def _removeUnneededTagKeysFromTagKeysList(self, m4aKeys):
-        keysToRemove = [
-            'covr',
-            '----:com.apple.iTunes:replaygain_album_gain',
-            '----:com.apple.iTunes:replaygain_album_peak',
-            '----:com.apple.iTunes:replaygain_track_gain',
-            '----:com.apple.iTunes:replaygain_track_peak',
-            'itunsmpb',
-            'itunnorm'
-        ]
-
-        for removeKey in keysToRemove:
-            try:
-                m4aKeys.remove(removeKey)
-            except:
-                pass
+        return otherTags
+
+    def _applyTagValues(self, mutagenInterface, tagValues):
+        for fieldName, value in tagValues.items():
+            if (fieldName in TAG_FIELD_KEYS):
+                self._setTagValueInMutagenInterface(mutagenInterface, TAG_FIELD_KEYS[fieldName], value)
+
+        # The number and total of the track/disc are stored together in a single atom, as a pair
+        # of integers (0 when not set): keep the current value of the part that is not being changed
+        for atomKey, numberFieldName, totalFieldName in [('trkn', 'trackNumber', 'totalTracks'), ('disk', 'discNumber', 'totalDiscs')]:
+            if (numberFieldName in tagValues or totalFieldName in tagValues):
+                currentNumberOfTotal = self._getTagValueFromMutagenInterface(mutagenInterface.tags, atomKey)
+                if (not isinstance(currentNumberOfTotal, tuple)):
+                    currentNumberOfTotal = (0, 0)
+
+                number = currentNumberOfTotal[0]
+                total = currentNumberOfTotal[1]
+                if (numberFieldName in tagValues):
+                    # The number may be given with its total, e.g. '3/12' (as in ID3 TRCK frames)
+                    number, numberTotal = _parseNumberOfTotal(tagValues[numberFieldName], numberFieldName)
+                    if (numberTotal is not None and totalFieldName not in tagValues):
+                        total = numberTotal
+                if (totalFieldName in tagValues):
+                    total = _parseNumberOfTotal(tagValues[totalFieldName], totalFieldName)[0]
+
+                if (number or total):
+                    mutagenInterface.tags[atomKey] = [(number, total)]
+                elif (atomKey in mutagenInterface.tags):
+                    del mutagenInterface.tags[atomKey]
+
+    def _applyCustomTagValue(self, mutagenInterface, tagName, value):
+        self._removeCustomTag(mutagenInterface, tagName)
 
-        return m4aKeys
+        tagName = tagName.upper()
+        self._setTagValueInMutagenInterface(mutagenInterface, "----:com.apple.iTunes:{}".format(tagName), value)
+
+    def _removeCustomTag(self, mutagenInterface, tagName):
+        # Custom tag names are case insensitive (see _formatM4AKeyToTagName): remove every atom
+        # that is read as this tag, except for the atoms of the standard tags
+        tagName = tagName.lower()
+        for tagKey in list(mutagenInterface.tags.keys()):
+            if (tagKey not in STANDARD_ATOM_KEYS and self._formatM4AKeyToTagName(tagKey) == tagName):
+                del mutagenInterface.tags[tagKey]
+
+    def _setTagValueInMutagenInterface(self, mutagenInterface, mutagenKey, value):
+        if (not value):
+            if (mutagenKey in mutagenInterface.tags):
+                del mutagenInterface.tags[mutagenKey]
+
+        # Freeform (custom) atoms hold bytes, the other text atoms hold strings: values are set as
+        # lists, the same as mutagen loads them, since the snapshot keeps using this interface
+        elif ('----:com.apple.iTunes:' in mutagenKey):
+            mutagenInterface.tags[mutagenKey] = [(value).encode('utf-8')]
+        else:
+            mutagenInterface.tags[mutagenKey] = [value]
 
     def _formatM4AKeyToTagName(self, m4aKey):
         if ("----:com.apple.iTunes:" in m4aKey):
@@ -240,10 +264,13 @@ class AudioFormatHandlerM4A:
 
         return tagName.lower()
 
-    def _getTagValueFromMutagenInterface(self, mutagenInterface, mutagenKey):
+    def _getTagValueFromMutagenInterface(self, mutagenTags, mutagenKey):
+        # The file has no tags (ilst atom) at all
+        if (mutagenTags is None):
+            return ''
 
         try:    
-            mutagenValue = mutagenInterface.tags[mutagenKey]
+            mutagenValue = mutagenTags[mutagenKey]
 
             if ('----:com.apple.iTunes:' in mutagenKey):
                 if (len(mutagenValue) == 1):
@@ -267,11 +294,52 @@ class AudioFormatHandlerM4A:
 
         return tagValue
 
-    def setCustomTag(self, tagName, value):
-        mutagenInterface = MP4(self.audioFilepath)
-
-        tagName = tagName.upper()
-        tagKey = "----:com.apple.iTunes:{}".format(tagName)
-        mutagenInterface[tagKey] = (value).encode('utf-8')
+def _getChildAtoms(buffer, start, end):
+    '''
+    Yields a (name, contentStart, contentEnd) tuple for each atom between the given offsets of the
+    buffer.
+    '''
+    position = start
+    while (position + 8 <= end):
+        atomSize = int.from_bytes(buffer[position:position + 4], 'big')
+        atomName = buffer[position + 4:position + 8]
+        headerSize = 8
+
+        if (atomSize == 1):
+            # 64-bit atom size
+            atomSize = int.from_bytes(buffer[position + 8:position + 16], 'big')
+            headerSize = 16
+        elif (atomSize == 0):
+            # The atom runs to the end of its parent
+            atomSize = end - position
+
+        if (atomSize < headerSize or position + atomSize > end):
+            raise ValueError("Invalid atom '{}' at offset {}: size {} is out of range".format(atomName, position, atomSize))
+
+        yield (atomName, position + headerSize, position + atomSize)
+        position += atomSize
+
+def _findAtom(buffer, start, end, atomName):
+    '''
+    Returns the (contentStart, contentEnd) offsets of the first child atom with the given name
+    between the given offsets of the buffer, or None if there is none.
+    '''
+    for childAtomName, contentStart, contentEnd in _getChildAtoms(buffer, start, end):
+        if (childAtomName == atomName):
+            return (contentStart, contentEnd)
+
+    return None
+
+def _parseNumberOfTotal(value, fieldName):
+    '''
+    Returns the (number, total or None) of the given track/disc number or total value: a number,
+    optionally followed by '/' and a total ('3', ' 3', '3/12'). An empty value is (0, None).
+    Raises a ValueError if the value doesn't start with a number.
+    '''
+    match = _NUMBER_OF_TOTAL_PATTERN.match(str(value) if (value is not None) else '')
+    if (match is None):
+        raise ValueError("Invalid value '{}' for tag '{}' of an M4A file: expected a number, or a number and a total like '3/12'".format(value, fieldName))
+
+    number, total = match.groups()
+    return (int(number or 0), int(total) if (total) else None)
 
-        mutagenInterface.save()
\ No newline at end of file
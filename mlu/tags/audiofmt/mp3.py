@@ -4,10 +4,9 @@ mlu.tags.audiofmt.mp3
 Module containing class which reads data for a single mp3 audio file.
 '''
 
-import mutagen
 from mutagen.mp3 import BitrateMode
 from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3, TXXX
+from mutagen.id3 import ID3, ID3NoHeaderError, TXXX, COMM, Frames, BitPaddedInt
 
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
@@ -15,41 +14,174 @@ import com.nwrobel.mypycommons.time
 import com.nwrobel.mypycommons.convert
 
 from mlu.tags import values
+from mlu.tags import artwork
+from mlu.tags.audiofmt.base import AudioFormatHandlerBase
+
+# ID3 frame keys of the MLU standard tag fields that are stored in a frame of their own: the
+# track/disc number and total fields are stored together in the TRCK/TPOS frames
+TAG_FIELD_KEYS = {
+    'title': 'TIT2',
+    'artist': 'TPE1',
+    'album': 'TALB',
+    'albumArtist': 'TPE2',
+    'composer': 'TCOM',
+    'date': 'TDRC',
+    'genre': 'TCON',
+    'bpm': 'TBPM',
+    'key': 'TXXX:Key',
+    'lyrics': 'TXXX:LYRICS',
+    'comment': 'COMM::eng',
+    'dateAdded': 'TXXX:DATE_ADDED',
+    'dateAllPlays': 'TXXX:DATE_ALL_PLAYS',
+    'dateLastPlayed': 'TXXX:DATE_LAST_PLAYED',
+    'playCount': 'TXXX:PLAY_COUNT',
+    'votes': 'TXXX:VOTES',
+    'rating': 'TXXX:RATING'
+}
+
+# Frame key and part ("number/total") of the track/disc number and total fields
+NUMBER_OF_TOTAL_FIELD_KEYS = {
+    'trackNumber': ('TRCK', 0),
+    'totalTracks': ('TRCK', 1),
+    'discNumber': ('TPOS', 0),
+    'totalDiscs': ('TPOS', 1)
+}
+
+STANDARD_FRAME_KEYS = set(TAG_FIELD_KEYS.values()) | {'TRCK', 'TPOS'}
+
+# Frame keys that are read as file properties (or not at all), rather than as other tags
+IGNORED_FRAME_KEYS = {
+    'COMM:ID3v1 Comment:eng',
+    'TXXX:replaygain_album_gain',
+    'TXXX:replaygain_album_peak',
+    'TXXX:replaygain_track_gain',
+    'TXXX:replaygain_track_peak'
+}
+
+# Text encodings of the description of an APIC frame, by the encoding byte of the frame
+APIC_TEXT_ENCODINGS = {
+    0: 'latin-1',
+    1: 'utf-16',
+    2: 'utf-16-be',
+    3: 'utf-8'
+}
+
+class AudioFormatHandlerMP3(AudioFormatHandlerBase):
+    formatName = 'MP3'
+
+    def _readEmbeddedArtwork(self, fileMmap):
+        '''
+        Returns the pictures of the APIC frames of the ID3v2 tag of the file. The frames are found
+        by walking the frame headers in the memory map; if any picture frame is not stored as
+        plain bytes (the tag or frame is unsynchronised, compressed or encrypted) or the tag is not
+        ID3v2.3/2.4, the pictures are decoded by mutagen instead.
+        '''
+        if (fileMmap[:3] != b'ID3'):
+            return []
+
+        majorVersion = fileMmap[3]
+        tagFlags = fileMmap[5]
+        if (majorVersion not in (3, 4) or tagFlags & 0x80):
+            return self._readDecodedEmbeddedArtwork()
+
+        tagEnd = min(10 + BitPaddedInt(fileMmap[6:10]), len(fileMmap))
+        position = 10
 
-class AudioFormatHandlerMP3:
-    def __init__(self, audioFilepath):
-        self.audioFilepath = audioFilepath
+        # Skip the extended header: its size includes itself in v2.4, but not in v2.3
+        if (tagFlags & 0x40):
+            if (majorVersion == 4):
+                position += BitPaddedInt(fileMmap[10:14])
+            else:
+                position += 4 + int.from_bytes(fileMmap[10:14], 'big')
+
+        artworks = []
+        while (position + 10 <= tagEnd):
+            frameId = fileMmap[position:position + 4]
+            if (frameId[0] == 0):
+                # Reached the padding
+                break
+
+            if (majorVersion == 4):
+                frameSize = BitPaddedInt(fileMmap[position + 4:position + 8])
+            else:
+                frameSize = int.from_bytes(fileMmap[position + 4:position + 8], 'big')
+
+            formatFlags = fileMmap[position + 9]
+            bodyStart = position + 10
+            bodyEnd = min(bodyStart + frameSize, tagEnd)
+
+            if (frameId == b'APIC'):
+                if (majorVersion == 4):
+                    needsDecoding = bool(formatFlags & 0x0E)
+                    if (formatFlags & 0x01):
+                        # Skip the data length indicator
+                        bodyStart += 4
+                else:
+                    needsDecoding = bool(formatFlags & 0xC0)
+                    if (formatFlags & 0x20):
+                        # Skip the group identifier
+                        bodyStart += 1
+
+                if (needsDecoding):
+                    for pictureArtwork in artworks:
+                        pictureArtwork.data.release()
+                    return self._readDecodedEmbeddedArtwork()
+
+                artworks.append(self._readApicFrame(fileMmap, bodyStart, bodyEnd))
+
+            position += 10 + frameSize
+
+        return artworks
+
+    def _readApicFrame(self, fileMmap, bodyStart, bodyEnd):
+        textEncoding = fileMmap[bodyStart]
+        mimeTypeEnd = fileMmap.find(b'\x00', bodyStart + 1, bodyEnd)
+        mimeType = fileMmap[bodyStart + 1:mimeTypeEnd].decode('latin-1')
+        pictureType = fileMmap[mimeTypeEnd + 1]
+        descriptionStart = mimeTypeEnd + 2
+
+        # The description ends with a null character, which is 2 (aligned) bytes for UTF-16
+        if (textEncoding in (1, 2)):
+            descriptionEnd = fileMmap.find(b'\x00\x00', descriptionStart, bodyEnd)
+            while ((descriptionEnd - descriptionStart) % 2 == 1):
+                descriptionEnd = fileMmap.find(b'\x00\x00', descriptionEnd + 1, bodyEnd)
+            dataStart = descriptionEnd + 2
+        else:
+            descriptionEnd = fileMmap.find(b'\x00', descriptionStart, bodyEnd)
+            dataStart = descriptionEnd + 1
 
-    def getEmbeddedArtwork(self):
-        # mutagenInterface = mutagen.File(self.audioFilepath)
+        if (descriptionEnd < 0):
+            raise ValueError("Invalid APIC frame in '{}': picture description is not terminated".format(self.audioFilepath))
 
-        # pictureTags = []
-        # mutagenTagKeys = list(mutagenInterface.keys())
+        descriptionBytes = fileMmap[descriptionStart:descriptionEnd]
+        description = descriptionBytes.decode(APIC_TEXT_ENCODINGS.get(textEncoding, 'latin-1'), 'replace')
 
-        # for tagKey in mutagenTagKeys:
-        #     if ("APIC:" in tagKey):
-        #         pictureTags.append(tagKey)
+        fileView = memoryview(fileMmap)
+        data = fileView[dataStart:bodyEnd]
+        fileView.release()
 
-        # if (pictureTags):
-        #     artworksBinaryData = []
-        #     for picTag in pictureTags:
-        #         picData = mutagenInterface[picTag].data
-        #         artworksBinaryData.append(picData)
-                
-        #     return artworksBinaryData
+        return artwork.EmbeddedArtwork(data=data, mimeType=mimeType, pictureType=pictureType, description=description, offset=dataStart)
 
-        # else:
-        #     return None
-        raise NotImplementedError("Getting album artwork is not implemented yet (this will require use of an external program)")
+    def _readDecodedEmbeddedArtwork(self):
+        artworks = []
+        for pictureFrame in ID3(self.audioFilepath).getall('APIC'):
+            artworks.append(artwork.EmbeddedArtwork(
+                data=memoryview(pictureFrame.data),
+                mimeType=pictureFrame.mime,
+                pictureType=int(pictureFrame.type),
+                description=pictureFrame.desc,
+                offset=None
+            ))
 
+        return artworks
 
-    def getProperties(self):
-        mutagenInterface = mutagen.File(self.audioFilepath)
+    def _readProperties(self, snapshot):
+        mutagenInterface = snapshot.mutagenInterface
 
-        fileSize = mypycommons.file.getFileSizeBytes(self.audioFilepath)
-        fileDateModified = mypycommons.time.formatTimestampForDisplay(mypycommons.file.getFileDateModifiedTimestamp(self.audioFilepath))
+        fileSize = snapshot.fileSize
+        fileDateModified = mypycommons.time.formatTimestampForDisplay(snapshot.fileDateModifiedTimestamp)
         duration = mutagenInterface.info.length
-        format = 'MP3'
+        format = self.formatName
 
         bitRateModeType = mutagenInterface.info.bitrate_mode
         if (bitRateModeType == BitrateMode.CBR):
@@ -66,10 +198,10 @@ class AudioFormatHandlerMP3:
         numChannels = mutagenInterface.info.channels
         sampleRate = mutagenInterface.info.sample_rate
         replayGain = {
-            'albumGain': self._getTagValueFromMutagenInterface('TXXX:replaygain_album_gain'),
-            'albumPeak': self._getTagValueFromMutagenInterface('TXXX:replaygain_album_peak'),
-            'trackGain': self._getTagValueFromMutagenInterface('TXXX:replaygain_track_gain'),
-            'trackPeak': self._getTagValueFromMutagenInterface('TXXX:replaygain_track_peak')
+            'albumGain': self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:replaygain_album_gain'),
+            'albumPeak': self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:replaygain_album_peak'),
+            'trackGain': self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:replaygain_track_gain'),
+            'trackPeak': self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:replaygain_track_peak')
         }
 
         audioProperties = values.AudioFileProperties(
@@ -88,156 +220,87 @@ class AudioFormatHandlerMP3:
         )
         return audioProperties
 
-    def getTags(self):
+    def _decodeTagField(self, mutagenTags, fieldName):
         '''
-        Returns an AudioFileTags object for the tag values for the Mp3 audio file
+        Returns the value of the given AudioFileTags field for the Mp3 audio file
         '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        title = self._getTagValueFromMutagenInterface(mutagenInterface, 'TIT2')
-        artist = self._getTagValueFromMutagenInterface(mutagenInterface, 'TPE1')
-        album = self._getTagValueFromMutagenInterface(mutagenInterface, 'TALB')
-        albumArtist = self._getTagValueFromMutagenInterface(mutagenInterface, 'TPE2')
-        genre = self._getTagValueFromMutagenInterface(mutagenInterface, 'TCON')
-        bpm = self._getTagValueFromMutagenInterface(mutagenInterface, 'TBPM')
-        date = self._getTagValueFromMutagenInterface(mutagenInterface, 'TDRC').text
-
-        trackNumOfTotal = self._getTagValueFromMutagenInterface(mutagenInterface, 'TRCK')
-        discNumOfTotal = self._getTagValueFromMutagenInterface(mutagenInterface, 'TPOS')
-
-        if ('/' in trackNumOfTotal):
-            parts = trackNumOfTotal.split('/')
-            trackNumber = parts[0]
-            totalTracks = parts[1]
-        else:
-            trackNumber = trackNumOfTotal
-            totalTracks = ''
+        if (fieldName == 'OTHER_TAGS'):
+            return self._decodeOtherTags(mutagenTags)
 
-        if ('/' in discNumOfTotal):
-            parts = discNumOfTotal.split('/')
-            discNumber = parts[0]
-            totalDiscs = parts[1]
-        else:
-            discNumber = discNumOfTotal
-            totalDiscs = ''
-
-        composer = self._getTagValueFromMutagenInterface(mutagenInterface, 'TCOM')
-        key = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:Key')
-        lyrics = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:LYRICS')
-        comment = self._getTagValueFromMutagenInterface(mutagenInterface, 'COMM::eng')
-        dateAdded = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:DATE_ADDED')
-        dateAllPlays = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:DATE_ALL_PLAYS')
-        dateLastPlayed = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:DATE_LAST_PLAYED') 
-        playCount = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:PLAY_COUNT')
-        votes = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:VOTES')
-        rating = self._getTagValueFromMutagenInterface(mutagenInterface, 'TXXX:RATING')
+        if (fieldName in NUMBER_OF_TOTAL_FIELD_KEYS):
+            frameKey, partIndex = NUMBER_OF_TOTAL_FIELD_KEYS[fieldName]
+            numberOfTotal = self._getTagValueFromMutagenInterface(mutagenTags, frameKey)
+            return self._splitNumberOfTotal(numberOfTotal)[partIndex]
+
+        return self._getTagValueFromMutagenInterface(mutagenTags, TAG_FIELD_KEYS[fieldName])
+
+    def _decodeOtherTags(self, mutagenTags):
         otherTags = {}
+        for tagKey in mutagenTags.keys():
+            if (tagKey in STANDARD_FRAME_KEYS or tagKey in IGNORED_FRAME_KEYS or "APIC:" in tagKey):
+                continue
 
-        tagFieldKeysMp3 = [
-            'TIT2', 
-            'TPE1', 
-            'TALB', 
-            'TPE2', 
-            'TCOM', 
-            'TDRC', 
-            'TCON', 
-            'TRCK', 
-            'TPOS',
-            'TBPM', 
-            'TXXX:Key', 
-            'TXXX:LYRICS', 
-            'COMM::eng', 
-            'TXXX:DATE_ADDED', 
-            'TXXX:DATE_ALL_PLAYS', 
-            'TXXX:DATE_LAST_PLAYED',
-            'TXXX:PLAY_COUNT', 
-            'TXXX:VOTES', 
-            'TXXX:RATING'
-        ]
-
-        mutagenTagKeys = list(mutagenInterface.keys())
-        relevantTagKeys = self._removeUnneededTagKeysFromTagKeysList(mutagenTagKeys)
-
-        otherTagKeys = []
-        for tagKey in relevantTagKeys:
-            if (tagKey not in tagFieldKeysMp3):
-                otherTagKeys.append(tagKey)
-
-        for tagKey in otherTagKeys:
-            tagValue = self._getTagValueFromMutagenInterface(mutagenInterface, tagKey)
+            tagValue = self._getTagValueFromMutagenInterface(mutagenTags, tagKey)
             tagNameFormatted = self._formatMp3KeyToTagName(tagKey)
             otherTags[tagNameFormatted] = tagValue
 
-        audioFileTags = values.AudioFileTags(
-            title=title,
-            artist=artist,
-            album=album,
-            albumArtist=albumArtist,
-            composer=composer,
-            date=date,
-            genre=genre, 
-            trackNumber=trackNumber,
-            totalTracks=totalTracks,
-            discNumber=discNumber,
-            totalDiscs=totalDiscs,
-            bpm=bpm,
-            key=key,
-            lyrics=lyrics,
-            comment=comment,
-            dateAdded=dateAdded,
-            dateAllPlays=dateAllPlays, 
-            dateLastPlayed=dateLastPlayed, 
-            playCount=playCount, 
-            votes=votes, 
-            rating=rating,
-            OTHER_TAGS=otherTags
-        )
+        return otherTags
 
-        return audioFileTags
+    def _applyTagValues(self, mutagenInterface, tagValues):
+        for fieldName, value in tagValues.items():
+            if (fieldName in TAG_FIELD_KEYS):
+                self._setFrameInMutagenInterface(mutagenInterface, TAG_FIELD_KEYS[fieldName], value)
 
-    def setTags(self, audioFileTags):
-        '''
-        '''
-        # Use the EasyId3 interface for setting the standard Mp3 tags
-        # mutagenInterface = EasyID3(self.audioFilepath)
-
-        # mutagenInterface['title'] = audioFileTags.title
-        # mutagenInterface['artist'] = audioFileTags.artist
-        # mutagenInterface['album'] = audioFileTags.album
-        # mutagenInterface['albumartist'] = audioFileTags.albumArtist
-        # mutagenInterface['genre'] = audioFileTags.genre
-
-        # mutagenInterface.save()
-        
-        # Use the ID3 interface for setting the nonstandard Mp3 tags
-        mutagenInterface = ID3(self.audioFilepath, v2_version=3)
-
-        mutagenInterface['TXXX:DATE_ALL_PLAYS'] = TXXX(3, desc='DATE_ALL_PLAYS', text=audioFileTags.dateAllPlays)
-        mutagenInterface['TXXX:DATE_LAST_PLAYED'] = TXXX(3, desc='DATE_LAST_PLAYED', text=audioFileTags.dateLastPlayed)
-        mutagenInterface['TXXX:PLAY_COUNT'] = TXXX(3, desc='PLAY_COUNT', text=audioFileTags.playCount)
-        mutagenInterface['TXXX:VOTES'] = TXXX(3, desc='VOTES', text=audioFileTags.votes)
-        mutagenInterface['TXXX:RATING'] = TXXX(3, desc='RATING', text=audioFileTags.rating)
-
-        mutagenInterface.save(v2_version=3)
-
-    def _removeUnneededTagKeysFromTagKeysList(self, mp3TagKeys):
-        ignoreKeysMp3 = [
-            'COMM:ID3v1 Comment:eng',
-            'TXXX:replaygain_album_gain',
-            'TXXX:replaygain_album_peak',
-            'TXXX:replaygain_track_gain',
-            'TXXX:replaygain_track_peak'
-        ]
-
-        relevantKeys = []
-        for tagKey in mp3TagKeys:
-            if ("APIC:" not in tagKey):
-                relevantKeys.append(tagKey)
-
-        for ignoreKey in ignoreKeysMp3:
-            relevantKeys.remove(ignoreKey)
-
-        return relevantKeys
+        # The number and total of the track/disc are stored together in a single frame, as
+        # "number/total": keep the current value of the part that is not being changed
+        for frameKey, numberFieldName, totalFieldName in [('TRCK', 'trackNumber', 'totalTracks'), ('TPOS', 'discNumber', 'totalDiscs')]:
+            if (numberFieldName in tagValues or totalFieldName in tagValues):
+                currentNumber, currentTotal = self._splitNumberOfTotal(self._getTagValueFromMutagenInterface(mutagenInterface, frameKey))
+                number = tagValues.get(numberFieldName, currentNumber)
+                total = tagValues.get(totalFieldName, currentTotal)
+
+                if (total):
+                    numberOfTotal = "{}/{}".format(number, total)
+                else:
+                    numberOfTotal = number
+
+                self._setFrameInMutagenInterface(mutagenInterface, frameKey, numberOfTotal)
+
+    def _applyCustomTagValue(self, mutagenInterface, tagName, value):
+        self._removeCustomTag(mutagenInterface, tagName)
+
+        tagName = tagName.upper()
+        self._setFrameInMutagenInterface(mutagenInterface, "TXXX:{}".format(tagName), value)
+
+    def _removeCustomTag(self, mutagenInterface, tagName):
+        # Custom tag names are case insensitive (see _formatMp3KeyToTagName): remove every frame
+        # that is read as this tag, except for the frames of the standard tags
+        tagName = tagName.lower()
+        for tagKey in list(mutagenInterface.tags.keys()):
+            if (tagKey not in STANDARD_FRAME_KEYS and self._formatMp3KeyToTagName(tagKey) == tagName):
+                del mutagenInterface.tags[tagKey]
+
+    def _setFrameInMutagenInterface(self, mutagenInterface, frameKey, value):
+        if (not value):
+            if (frameKey in mutagenInterface.tags):
+                del mutagenInterface.tags[frameKey]
+            return
+
+        if (frameKey.startswith('TXXX:')):
+            frame = TXXX(encoding=3, desc=frameKey[5:], text=value)
+        elif (frameKey == 'COMM::eng'):
+            frame = COMM(encoding=3, lang='eng', desc='', text=value)
+        else:
+            frame = Frames[frameKey](encoding=3, text=value)
+
+        mutagenInterface.tags[frameKey] = frame
+
+    def _splitNumberOfTotal(self, numberOfTotal):
+        if ('/' in numberOfTotal):
+            parts = numberOfTotal.split('/')
+            return (parts[0], parts[1])
+        else:
+            return (numberOfTotal, '')
 
     def _formatMp3KeyToTagName(self, mp3Key):
         if ("TXXX:" in mp3Key):
@@ -251,10 +314,11 @@ class AudioFormatHandlerMP3:
         try:
             mutagenValue = mutagenInterface[mutagenKey].text
 
+            # Values of the timestamp frames (e.g. TDRC) are ID3TimeStamp objects: read their text
             if (len(mutagenValue) == 1):
-                tagValue = mutagenValue[0]
+                tagValue = str(mutagenValue[0])
             elif (len(mutagenValue) > 1):
-                tagValue = ';'.join(mutagenValue)
+                tagValue = ';'.join(str(value) for value in mutagenValue)
             else:
                 tagValue = ''
 
@@ -263,12 +327,21 @@ class AudioFormatHandlerMP3:
 
         return tagValue 
 
-    def setCustomTag(self, tagName, value):
-        mutagenInterface = ID3(self.audioFilepath, v2_version=3)
-
-        tagName = tagName.upper()
-        tagKey = "TXXX:{}".format(tagName)
-
-        mutagenInterface[tagKey] = TXXX(3, desc=tagName, text=value)
 
-        mutagenInterface.save(v2_version=3)
\ No newline at end of file
+    def _loadMutagenTags(self, audioFilepath):
+        '''
+        Reads only the ID3 tag of the mp3 file, without reading the MPEG stream info.
+        '''
+        try:
+            return ID3(audioFilepath)
+        except ID3NoHeaderError:
+            return None
+
+    def _saveMutagenInterface(self, mutagenInterface, paddingDecision):
+        # Tags are written as ID3v2.3: convert the frames the same way that loading the tags with
+        # v2_version=3 would, then convert them back so the snapshot matches a fresh (v2.4) parse
+        mutagenInterface.tags.update_to_v23()
+        try:
+            mutagenInterface.save(v2_version=3, padding=paddingDecision)
+        finally:
+            mutagenInterface.tags.update_to_v24()
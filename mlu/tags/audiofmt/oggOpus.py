@@ -4,7 +4,10 @@ mlu.tags.audiofmt.oggOpus
 Module containing class which reads data for a single ogg OPUS audio file.
 '''
 
-import mutagen
+import base64
+
+from mutagen.ogg import OggPage
+from mutagen.oggopus import OggOpusVComment, OggOpusHeaderError
 
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
@@ -12,40 +15,51 @@ import com.nwrobel.mypycommons.time
 import com.nwrobel.mypycommons.convert
 
 from mlu.tags import values
+from mlu.tags import artwork
+from mlu.tags.audiofmt.vorbis import VorbisCommentFormatHandlerBase
 
-class AudioFormatHandlerOggOpus:
-    def __init__(self, audioFilepath):
-        self.audioFilepath = audioFilepath
+class AudioFormatHandlerOggOpus(VorbisCommentFormatHandlerBase):
+    formatName = 'OGG Opus'
 
-    def getEmbeddedArtwork(self):
+    def _loadMutagenTags(self, audioFilepath):
         '''
+        Reads only the OpusTags packet that follows the identification header at the start of the
+        file: unlike a full parse, the last page of the stream is not searched for to get the length.
         '''
-        # mutagenInterface = mutagen.File(self.audioFilepath)
+        with open(audioFilepath, 'rb') as audioFile:
+            firstPage = OggPage(audioFile)
+            if (not firstPage.packets[0].startswith(b'OpusHead')):
+                raise OggOpusHeaderError("'{}' is not a valid Ogg Opus file".format(audioFilepath))
+
+            # The comment reader only needs the serial number of the Opus stream from the info
+            return OggOpusVComment(audioFile, firstPage)
 
-        # try:
-        #     picturesStrList = mutagenInterface['metadata_block_picture']
-        # except KeyError:
-        #     picturesStrList = None
+    def _getEmbeddedArtworkList(self):
+        '''
+        Returns an EmbeddedArtworkList of the pictures of the metadata_block_picture comments of
+        the file. These are base64 encoded FLAC PICTURE blocks, so each picture is decoded into
+        memory (the data does not point into the file and has no offset).
+        '''
+        mutagenTags = self._getSnapshot(tagsOnly=True).mutagenTags
+        if (mutagenTags is None or 'metadata_block_picture' not in mutagenTags):
+            return artwork.EmbeddedArtworkList([])
 
-        # artworksBinaryData = []
-        # if (picturesStrList):
-        #     for pictureStr in picturesStrList:
-        #         artworksBinaryData.append(pictureStr.encode('utf-8'))
-        #     return artworksBinaryData
+        artworks = []
+        for encodedPicture in mutagenTags['metadata_block_picture']:
+            pictureBlock = base64.b64decode(encodedPicture)
+            artworks.append(artwork.readFlacPicture(pictureBlock, 0, len(pictureBlock), offsetInFile=False))
 
-        # else:
-        #     return None
-        raise NotImplementedError("Getting album artwork is not implemented yet (this will require use of an external program)")
+        return artwork.EmbeddedArtworkList(artworks)
 
-    def getProperties(self):
+    def _readProperties(self, snapshot):
         '''
         '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
+        mutagenInterface = snapshot.mutagenInterface
 
-        fileSize = mypycommons.file.getFileSizeBytes(self.audioFilepath)
-        fileDateModified = mypycommons.time.formatTimestampForDisplay(mypycommons.file.getFileDateModifiedTimestamp(self.audioFilepath))
+        fileSize = snapshot.fileSize
+        fileDateModified = mypycommons.time.formatTimestampForDisplay(snapshot.fileDateModifiedTimestamp)
         duration = mutagenInterface.info.length
-        format = 'OGG Opus'
+        format = self.formatName
         #bitRate = mypycommons.convert.bitsToKilobits(mutagenInterface.info.bitrate)
         #bitDepth = mutagenInterface.info.bits_per_sample
         numChannels = mutagenInterface.info.channels
@@ -72,150 +86,3 @@ class AudioFormatHandlerOggOpus:
             codec=None
         )
         return audioProperties
-
-
-    def getTags(self):
-        '''
-        Returns an AudioFileTags object for the tag values for the FLAC audio file
-        '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-        tags = mutagenInterface.tags
-
-        title = self._getTagValueFromMutagenInterface(mutagenInterface, 'title')
-        artist = self._getTagValueFromMutagenInterface(mutagenInterface, 'artist')
-        album = self._getTagValueFromMutagenInterface(mutagenInterface, 'album')
-        albumArtist = self._getTagValueFromMutagenInterface(mutagenInterface, 'albumartist')
-        composer = self._getTagValueFromMutagenInterface(mutagenInterface, 'composer')
-        date = self._getTagValueFromMutagenInterface(mutagenInterface, 'date')
-        genre = self._getTagValueFromMutagenInterface(mutagenInterface, 'genre')
-        trackNumber = self._getTagValueFromMutagenInterface(mutagenInterface, 'tracknumber')
-        totalTracks = self._getTagValueFromMutagenInterface(mutagenInterface, 'tracktotal')
-        discNumber = self._getTagValueFromMutagenInterface(mutagenInterface, 'discnumber')
-        totalDiscs = self._getTagValueFromMutagenInterface(mutagenInterface, 'disctotal')
-        bpm = self._getTagValueFromMutagenInterface(mutagenInterface, 'bpm')
-        key = self._getTagValueFromMutagenInterface(mutagenInterface, 'key')
-        lyrics = self._getTagValueFromMutagenInterface(mutagenInterface, 'lyrics')
-        comment = self._getTagValueFromMutagenInterface(mutagenInterface, 'comment')
-        dateAdded = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_added')
-        dateAllPlays = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_all_plays')
-        dateLastPlayed = self._getTagValueFromMutagenInterface(mutagenInterface, 'date_last_played') 
-        playCount = self._getTagValueFromMutagenInterface(mutagenInterface, 'play_count')
-        votes = self._getTagValueFromMutagenInterface(mutagenInterface, 'votes')
-        rating = self._getTagValueFromMutagenInterface(mutagenInterface, 'rating')
-        otherTags = {}
-
-        tagFieldKeysFlac = [
-            'title', 
-            'artist', 
-            'album', 
-            'albumartist', 
-            'composer', 
-            'date', 
-            'genre', 
-            'tracknumber', 
-            'tracktotal', 
-            'discnumber', 
-            'disctotal', 
-            'bpm', 
-            'key', 
-            'lyrics',  
-            'comment', 
-            'date_added', 
-            'date_all_plays', 
-            'date_last_played',
-            'play_count',
-            'votes', 
-            'rating'
-        ]
-
-        mutagenTagKeys = mutagenInterface.tags.keys()
-        relevantTagKeys = self._removeUnneededTagKeysFromTagKeysList(mutagenTagKeys)
-
-        otherTagNames = []
-        for tagKey in relevantTagKeys:
-            if (tagKey.lower() not in tagFieldKeysFlac):
-                otherTagNames.append(tagKey.lower())
-
-        for tagNameKey in otherTagNames:
-            tagValue = self._getTagValueFromMutagenInterface(mutagenInterface, tagNameKey)
-            otherTags[tagNameKey] = tagValue
-
-        audioFileTags = values.AudioFileTags(
-            title=title,
-            artist=artist,
-            album=album,
-            albumArtist=albumArtist,
-            composer=composer,
-            date=date,
-            genre=genre, 
-            trackNumber=trackNumber,
-            totalTracks=totalTracks,
-            discNumber=discNumber,
-            totalDiscs=totalDiscs,
-            bpm=bpm,
-            key=key,
-            lyrics=lyrics,
-            comment=comment,
-            dateAdded=dateAdded,
-            dateAllPlays=dateAllPlays, 
-            dateLastPlayed=dateLastPlayed, 
-            playCount=playCount, 
-            votes=votes, 
-            rating=rating,
-            OTHER_TAGS=otherTags
-        )
-
-        return audioFileTags
-
-    def setTags(self, audioFileTags):
-        '''
-        '''
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        mutagenInterface['date_all_plays'] = audioFileTags.dateAllPlays
-        mutagenInterface['date_last_played'] = audioFileTags.dateLastPlayed
-        mutagenInterface['play_count'] = audioFileTags.playCount
-        mutagenInterface['votes'] = audioFileTags.votes
-        mutagenInterface['rating'] = audioFileTags.rating
-
-        mutagenInterface.save()
-
-    def _removeUnneededTagKeysFromTagKeysList(self, flacKeys):
-        keysToRemove = [
-            'replaygain_album_gain',
-            'replaygain_album_peak',
-            'replaygain_track_gain',
-            'replaygain_track_peak'
-        ]
-
-        for removeKey in keysToRemove:
-            try:
-                flacKeys.remove(removeKey)
-            except:
-                pass
-
-        return flacKeys
-
-    def _getTagValueFromMutagenInterface(self, mutagenInterface, mutagenKey):
-        try:
-            mutagenValue = mutagenInterface[mutagenKey]
-
-            if (len(mutagenValue) == 1):
-                tagValue = mutagenValue[0]
-            elif (len(mutagenValue) > 1):
-                tagValue = ';'.join(mutagenValue)
-            else:
-                tagValue = ''
-
-        except KeyError:
-            tagValue = ''
-
-        return tagValue
-
-    def setCustomTag(self, tagName, value):
-        mutagenInterface = mutagen.File(self.audioFilepath)
-
-        tagName = tagName.lower()
-        mutagenInterface[tagName] = value
-
-        mutagenInterface.save() 
\ No newline at end of file
@@ -0,0 +1,156 @@
+'''
+mlu.tags.audiofmt.vorbis
+
+Module containing the base class shared by the handlers of the audio formats that store their tags
+in a Vorbis comment block (FLAC, Ogg Opus), and the decoder of the comment block.
+
+The comment block is decoded in a single pass: each comment is looked up once in the key -> field
+table and its value added to the field, rather than looking up each field's key in the block.
+'''
+
+from mlu.tags import values
+from mlu.tags.audiofmt.base import AudioFormatHandlerBase
+
+# Vorbis comment keys of the MLU standard tag fields
+TAG_FIELD_KEYS = {
+    'title': 'title',
+    'artist': 'artist',
+    'album': 'album',
+    'albumArtist': 'albumartist',
+    'composer': 'composer',
+    'date': 'date',
+    'genre': 'genre',
+    'trackNumber': 'tracknumber',
+    'totalTracks': 'tracktotal',
+    'discNumber': 'discnumber',
+    'totalDiscs': 'disctotal',
+    'bpm': 'bpm',
+    'key': 'key',
+    'lyrics': 'lyrics',
+    'comment': 'comment',
+    'dateAdded': 'date_added',
+    'dateAllPlays': 'date_all_plays',
+    'dateLastPlayed': 'date_last_played',
+    'playCount': 'play_count',
+    'votes': 'votes',
+    'rating': 'rating'
+}
+
+# The same table, by (lowercase) comment key
+KEY_FIELD_NAMES = {tagKey: fieldName for fieldName, tagKey in TAG_FIELD_KEYS.items()}
+
+STANDARD_TAG_KEYS = set(TAG_FIELD_KEYS.values())
+
+# Vorbis comment keys that are read as file properties (or not at all), rather than as other tags
+IGNORED_TAG_KEYS = {
+    'replaygain_album_gain',
+    'replaygain_album_peak',
+    'replaygain_track_gain',
+    'replaygain_track_peak'
+}
+
+# Separator of the values of a comment key that appears more than once
+MULTIPLE_VALUES_SEPARATOR = ';'
+
+def decodeVorbisComment(vorbisComment):
+    '''
+    Returns a dict of AudioFileTags field name (including OTHER_TAGS) to value for the given
+    mutagen Vorbis comment block (a list of (key, value) comments), decoded in a single pass. Keys
+    are matched in any case; the values of a key that appears more than once are joined with ';',
+    and a field whose key is not in the block is ''.
+    '''
+    fieldValueLists = {}
+    otherTagValueLists = {}
+
+    for tagKey, value in vorbisComment:
+        tagKey = tagKey.lower()
+        fieldName = KEY_FIELD_NAMES.get(tagKey)
+
+        if (fieldName is not None):
+            valueLists = fieldValueLists
+            valueKey = fieldName
+        elif (tagKey not in IGNORED_TAG_KEYS):
+            valueLists = otherTagValueLists
+            valueKey = tagKey
+        else:
+            continue
+
+        valueList = valueLists.get(valueKey)
+        if (valueList is None):
+            valueLists[valueKey] = [value]
+        else:
+            valueList.append(value)
+
+    fieldValues = dict.fromkeys(values.AUDIO_FILE_TAGS_FIELDS, '')
+    for fieldName, valueList in fieldValueLists.items():
+        fieldValues[fieldName] = valueList[0] if (len(valueList) == 1) else MULTIPLE_VALUES_SEPARATOR.join(valueList)
+
+    fieldValues['OTHER_TAGS'] = {
+        tagName: valueList[0] if (len(valueList) == 1) else MULTIPLE_VALUES_SEPARATOR.join(valueList)
+        for tagName, valueList in otherTagValueLists.items()
+    }
+
+    return fieldValues
+
+class VorbisCommentFields:
+    '''
+    Holds the tag field values of a Vorbis comment block, decoded (with decodeVorbisComment()) the
+    first time that one of them is needed.
+    '''
+    def __init__(self, vorbisComment):
+        self._vorbisComment = vorbisComment
+        self._fieldValues = None
+
+    def getFieldValue(self, fieldName):
+        if (self._fieldValues is None):
+            # A file without tags is given as an empty dict rather than a comment block
+            self._fieldValues = decodeVorbisComment(self._vorbisComment if (self._vorbisComment) else [])
+            self._vorbisComment = None
+
+        return self._fieldValues[fieldName]
+
+class VorbisCommentFormatHandlerBase(AudioFormatHandlerBase):
+    '''
+    Base class for the handlers of the audio formats whose tags are a Vorbis comment block.
+    '''
+    def _readTags(self, mutagenTags):
+        # A new VorbisCommentFields for each read, since the block may have been changed by a write
+        return super()._readTags(VorbisCommentFields(mutagenTags))
+
+    def _decodeTagField(self, commentFields, fieldName):
+        '''
+        Returns the value of the given AudioFileTags field from the given VorbisCommentFields.
+        '''
+        return commentFields.getFieldValue(fieldName)
+
+    def _applyTagValues(self, mutagenInterface, tagValues):
+        for fieldName, value in tagValues.items():
+            self._setTagValueInMutagenInterface(mutagenInterface, TAG_FIELD_KEYS[fieldName], value)
+
+    def _applyCustomTagValue(self, mutagenInterface, tagName, value):
+        self._setTagValueInMutagenInterface(mutagenInterface, tagName.lower(), value)
+
+    def _removeCustomTag(self, mutagenInterface, tagName):
+        self._setTagValueInMutagenInterface(mutagenInterface, tagName.lower(), '')
+
+    def _setTagValueInMutagenInterface(self, mutagenInterface, mutagenKey, value):
+        if (value):
+            mutagenInterface[mutagenKey] = value
+        elif (mutagenKey in mutagenInterface.tags):
+            del mutagenInterface.tags[mutagenKey]
+
+    def _getTagValueFromMutagenInterface(self, mutagenInterface, mutagenKey):
+        try:
+            mutagenValue = mutagenInterface[mutagenKey]
+
+            if (len(mutagenValue) == 1):
+                tagValue = mutagenValue[0]
+            elif (len(mutagenValue) > 1):
+                tagValue = MULTIPLE_VALUES_SEPARATOR.join(mutagenValue)
+            else:
+                tagValue = ''
+
+        except KeyError:
+            tagValue = ''
+
+        return tagValue
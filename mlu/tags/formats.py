@@ -0,0 +1,196 @@
+'''
+mlu.tags.formats
+
+Module containing the registry of the audio formats supported by MLU. Each format has a file type
+name (e.g. 'flac'), the file extensions it is usually stored with, its format handler class (by
+module and class name, so that the format module and mutagen are only imported once a file of the
+format is opened) and a function that recognizes the format from the first bytes of a file.
+
+The format of a file is detected from its content rather than its extension, so a mislabelled file
+(e.g. an MP3 file named .flac) is still read with the right handler, and a file that is not audio
+at all is rejected without a parse. The header of each file is read once: the detected format is
+cached until the file changes on disk.
+'''
+
+import os
+import threading
+import importlib
+from collections import OrderedDict
+
+# Number of bytes read from the start of a file (after an ID3v2 tag, if any) to detect its format
+HEADER_READ_SIZE = 64
+
+# Number of detected formats kept in the cache
+DETECTION_CACHE_SIZE = 4096
+
+ID3V2_HEADER_SIZE = 10
+
+class AudioFormat:
+    '''
+    Data structure holding the registration of a single audio format.
+
+    Params:
+        fileType: name of the format, as used by MLU (e.g. 'flac')
+        handlerModuleName: name of the module of the format handler class
+        handlerClassName: name of the format handler class (an AudioFormatHandlerBase subclass)
+        sniffFunc: function (header, hasId3Tag) -> bool that tells whether a file is of this format,
+            given the first bytes of the file following its ID3v2 tag and whether the file starts
+            with an ID3v2 tag
+        fileExtensions: file extensions (lowercase, without the dot) of the format
+        extensionFallback: use the format for files with one of its extensions whose content is not
+            recognized by any format (for formats whose files may start with junk bytes)
+    '''
+    def __init__(self, fileType, handlerModuleName, handlerClassName, sniffFunc, fileExtensions, extensionFallback=False):
+        self.fileType = fileType
+        self.handlerModuleName = handlerModuleName
+        self.handlerClassName = handlerClassName
+        self.sniffFunc = sniffFunc
+        self.fileExtensions = fileExtensions
+        self.extensionFallback = extensionFallback
+        self._handlerClass = None
+
+    def getHandlerClass(self):
+        '''
+        Returns the format handler class, importing its module on first use.
+        '''
+        if (self._handlerClass is None):
+            self._handlerClass = getattr(importlib.import_module(self.handlerModuleName), self.handlerClassName)
+
+        return self._handlerClass
+
+# Registered formats, in the order that they are tried when detecting the format of a file
+_audioFormats = OrderedDict()
+_formatsByExtension = {}
+
+# File types of the registered formats: this list is updated in place when a format is registered
+REGISTERED_FILE_TYPES = []
+
+_detectionCache = OrderedDict()
+_detectionCacheLock = threading.Lock()
+
+def registerAudioFormat(audioFormat):
+    '''
+    Registers the given AudioFormat, replacing the format with the same file type if there is one.
+    Formats are tried in registration order when detecting the format of a file.
+    '''
+    _audioFormats[audioFormat.fileType] = audioFormat
+    for fileExtension in audioFormat.fileExtensions:
+        _formatsByExtension[fileExtension] = audioFormat
+
+    if (audioFormat.fileType not in REGISTERED_FILE_TYPES):
+        REGISTERED_FILE_TYPES.append(audioFormat.fileType)
+
+    clearDetectionCache()
+
+def getAudioFormat(fileType):
+    '''
+    Returns the registered AudioFormat with the given file type, or None.
+    '''
+    return _audioFormats.get(fileType)
+
+def getAudioFormatHandlerClass(fileType):
+    '''
+    Returns the format handler class of the given registered file type.
+    '''
+    return _audioFormats[fileType].getHandlerClass()
+
+def getFileTypeFromExtension(filepath):
+    '''
+    Returns the file type of the registered format that the extension of the given filepath
+    belongs to (in any case), or None.
+    '''
+    audioFormat = _formatsByExtension.get(os.path.splitext(filepath)[1][1:].lower())
+    return (audioFormat.fileType if (audioFormat is not None) else None)
+
+def hasSupportedFileExtension(filepath):
+    return (getFileTypeFromExtension(filepath) is not None)
+
+def detectAudioFileType(audioFilepath):
+    '''
+    Returns the file type of the registered format of the given audio file, detected from its
+    content, or None if the file is not of a supported format. If the content is not recognized,
+    the format of the file extension is used if that format allows it (see AudioFormat).
+    '''
+    fileStat = os.stat(audioFilepath)
+    cacheKey = (os.path.abspath(audioFilepath), fileStat.st_size, fileStat.st_mtime_ns, fileStat.st_ino)
+
+    with _detectionCacheLock:
+        if (cacheKey in _detectionCache):
+            _detectionCache.move_to_end(cacheKey)
+            return _detectionCache[cacheKey]
+
+    fileType = _detectAudioFileType(audioFilepath)
+
+    with _detectionCacheLock:
+        _detectionCache[cacheKey] = fileType
+        while (len(_detectionCache) > DETECTION_CACHE_SIZE):
+            _detectionCache.popitem(last=False)
+
+    return fileType
+
+def clearDetectionCache():
+    with _detectionCacheLock:
+        _detectionCache.clear()
+
+def _detectAudioFileType(audioFilepath):
+    header, hasId3Tag = readFileHeader(audioFilepath)
+
+    for audioFormat in _audioFormats.values():
+        if (audioFormat.sniffFunc(header, hasId3Tag)):
+            return audioFormat.fileType
+
+    audioFormat = _formatsByExtension.get(os.path.splitext(audioFilepath)[1][1:].lower())
+    if (audioFormat is not None and audioFormat.extensionFallback):
+        return audioFormat.fileType
+
+    return None
+
+def readFileHeader(audioFilepath):
+    '''
+    Returns a tuple of (header, hasId3Tag): the first HEADER_READ_SIZE bytes of the given file
+    following its ID3v2 tag (if it starts with one), and whether it starts with one.
+    '''
+    with open(audioFilepath, 'rb') as audioFile:
+        header = audioFile.read(HEADER_READ_SIZE)
+        if (not header.startswith(b'ID3') or len(header) < ID3V2_HEADER_SIZE):
+            return (header, False)
+
+        # The tag size is a 28-bit synchsafe int, not counting the header (or the footer, if flag 4
+        # is set)
+        sizeBytes = header[6:10]
+        tagSize = (sizeBytes[0] << 21) | (sizeBytes[1] << 14) | (sizeBytes[2] << 7) | sizeBytes[3]
+        tagEnd = ID3V2_HEADER_SIZE + tagSize + (10 if (header[5] & 0x10) else 0)
+
+        audioFile.seek(tagEnd)
+        return (audioFile.read(HEADER_READ_SIZE), True)
+
+def sniffFlac(header, hasId3Tag):
+    return header.startswith(b'fLaC')
+
+def sniffMp3(header, hasId3Tag):
+    # An ID3v2 tag that is not followed by another format's header is taken as an MP3 file, since
+    # the first MPEG frame may not directly follow the tag (padding, junk)
+    if (hasId3Tag):
+        return True
+
+    # MPEG audio frame sync: 11 set bits, and a layer (bits 1-2 of the second byte) of I, II or
+    # III (layer 0 is reserved; ADTS AAC streams have it set to 0)
+    return (len(header) >= 2 and header[0] == 0xFF and (header[1] & 0xE0) == 0xE0 and (header[1] & 0x06) != 0)
+
+def sniffM4a(header, hasId3Tag):
+    # An MP4 file is a sequence of atoms (32-bit size, then the type): the first is usually ftyp
+    return (len(header) >= 8 and header[4:8] in (b'ftyp', b'moov', b'free', b'skip', b'wide', b'mdat'))
+
+def sniffOggOpus(header, hasId3Tag):
+    # The first Ogg page holds the Opus identification header: the packet data starts after the
+    # 27-byte page header and the segment table
+    if (len(header) < 27 or not header.startswith(b'OggS')):
+        return False
+
+    packetStart = 27 + header[26]
+    return (header[packetStart:packetStart + 8] == b'OpusHead')
+
+registerAudioFormat(AudioFormat('flac', 'mlu.tags.audiofmt.flac', 'AudioFormatHandlerFLAC', sniffFlac, ['flac']))
+registerAudioFormat(AudioFormat('m4a', 'mlu.tags.audiofmt.m4a', 'AudioFormatHandlerM4A', sniffM4a, ['m4a']))
+registerAudioFormat(AudioFormat('opus', 'mlu.tags.audiofmt.oggOpus', 'AudioFormatHandlerOggOpus', sniffOggOpus, ['opus']))
+registerAudioFormat(AudioFormat('mp3', 'mlu.tags.audiofmt.mp3', 'AudioFormatHandlerMP3', sniffMp3, ['mp3'], extensionFallback=True))
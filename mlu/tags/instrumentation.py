@@ -0,0 +1,338 @@
+'''
+mlu.tags.instrumentation
+
+Module containing the instrumentation hooks of the audio file handlers: each phase of reading or
+writing an audio file (parsing the file, checking it on disk, decoding the tags/properties,
+reading the artwork, saving the tags) is run in a timed span, which is reported to the
+instrumentation object of the handler along with the audio format, the I/O counters of the thread
+during the phase, the bytes of the file memory mapped by the phase (artwork) and, for saves,
+whether the file had to be fully rewritten.
+
+The thread I/O counters (threadBytesRead, threadBytesWritten) are the bytes passed to the read()
+and write() calls of the thread running the phase, as counted by the kernel: they include any other
+I/O done by the thread during the span (e.g. logging), and do not include data read through a
+memory map, which is reported by the handlers as bytesMapped instead. Embedded pictures that can't be
+viewed in the map (e.g. base64 or unsynchronised) are decoded into memory and reported as
+bytesDecoded.
+
+The default instrumentation does nothing (its spans are a shared no-op object), so the hooks cost
+next to nothing unless an instrumentation is set, e.g. a SpanHistogramAggregator:
+
+    aggregator = instrumentation.SpanHistogramAggregator()
+    instrumentation.setDefaultInstrumentation(aggregator)
+    ...
+    print(aggregator.formatSummary())
+'''
+
+import os
+import time
+import bisect
+import threading
+
+# Names of the spans emitted by the handlers
+SPAN_PARSE = 'parse'
+SPAN_PARSE_TAGS_ONLY = 'parseTagsOnly'
+SPAN_STAT = 'stat'
+SPAN_DECODE_TAG_FIELD = 'decodeTagField'
+SPAN_DECODE_PROPERTIES = 'decodeProperties'
+SPAN_READ_ARTWORK = 'readArtwork'
+SPAN_SAVE = 'save'
+SPAN_COMMIT_WRITE_BATCH = 'commitWriteBatch'
+
+# Upper bounds (ms) of the latency histogram buckets of the aggregator (the last bucket has no
+# upper bound)
+DEFAULT_HISTOGRAM_BOUNDS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# Per-thread I/O counters of the kernel (Linux only): bytes passed to the read() and write() calls
+# of the thread, for any file or socket
+THREAD_IO_COUNTERS_FILEPATH = '/proc/thread-self/io'
+
+class _NullSpan:
+    '''
+    Span of the no-op instrumentation: a single shared object that records nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+    def setAttribute(self, name, value):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class Instrumentation:
+    '''
+    Base class for the instrumentation of the audio file handlers. This base class does nothing:
+    subclasses that record spans set enabled and override span().
+    '''
+    # Whether or not the spans are recorded: the handlers skip the extra work of the hooks (e.g.
+    # wrapping the tag decode function) when this is false
+    enabled = False
+
+    def span(self, name, formatName, audioFilepath=None, measureIo=False):
+        '''
+        Returns a context manager for a timed span of the given phase of the handler of the given
+        format. If measureIo is given, the I/O counters of the current thread are measured over the
+        span (where the platform allows it, see the module docstring).
+        '''
+        return NULL_SPAN
+
+class Span:
+    '''
+    A timed span of a single phase, reported to the instrumentation when it ends.
+
+    Attributes:
+        name, formatName, audioFilepath: what the span measured
+        durationSeconds: duration of the span (set when it ends)
+        attributes: dict of extra values: 'threadBytesRead' and 'threadBytesWritten' (if I/O was
+            measured, see the module docstring), 'bytesMapped' (bytes of the file viewed through a
+            memory map, artwork), 'bytesDecoded' (bytes of artwork decoded into memory),
+            'fullRewrite' (saves), 'error' (exception type name, if the
+            phase failed)
+    '''
+    __slots__ = ('_instrumentation', 'name', 'formatName', 'audioFilepath', 'durationSeconds', 'attributes', '_measureIo', '_startTime', '_startIoCounters')
+
+    def __init__(self, instrumentation, name, formatName, audioFilepath, measureIo):
+        self._instrumentation = instrumentation
+        self.name = name
+        self.formatName = formatName
+        self.audioFilepath = audioFilepath
+        self.durationSeconds = None
+        self.attributes = {}
+        self._measureIo = measureIo
+        self._startTime = None
+        self._startIoCounters = None
+
+    def __enter__(self):
+        if (self._measureIo):
+            self._startIoCounters = getThreadIoCounters()
+        self._startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.durationSeconds = time.perf_counter() - self._startTime
+
+        if (self._startIoCounters is not None):
+            endIoCounters = getThreadIoCounters()
+            if (endIoCounters is not None):
+                startRead, startWritten, startCountersSize = self._startIoCounters
+                endRead, endWritten, endCountersSize = endIoCounters
+                # Don't count the read of the counters file at the start of the span
+                self.attributes['threadBytesRead'] = max(endRead - startRead - startCountersSize, 0)
+                self.attributes['threadBytesWritten'] = endWritten - startWritten
+
+        if (excType is not None):
+            self.attributes['error'] = excType.__name__
+
+        self._instrumentation.onSpanEnd(self)
+        return False
+
+    def setAttribute(self, name, value):
+        self.attributes[name] = value
+
+class RecordingInstrumentation(Instrumentation):
+    '''
+    Instrumentation that times the spans and passes each finished Span to onSpanEnd(), which
+    calls the given function (if any). Subclass and override onSpanEnd() to process the spans.
+
+    Params:
+        onSpanEndFunc: function called with each finished Span (from the thread that ran it)
+        measureIo: measure the thread I/O counters over the parse, artwork and save spans
+    '''
+    enabled = True
+
+    def __init__(self, onSpanEndFunc=None, measureIo=True):
+        self._onSpanEndFunc = onSpanEndFunc
+        self.measureIo = measureIo
+
+    def span(self, name, formatName, audioFilepath=None, measureIo=False):
+        return Span(self, name, formatName, audioFilepath, measureIo and self.measureIo)
+
+    def onSpanEnd(self, span):
+        if (self._onSpanEndFunc is not None):
+            self._onSpanEndFunc(span)
+
+class SpanStats:
+    '''
+    Aggregated stats of the spans with the same name and format: count, total/min/max duration, a
+    latency histogram, total thread bytes read and written, total bytes memory mapped and decoded,
+    full rewrite and error counts.
+    '''
+    def __init__(self, histogramBoundsMs):
+        self.histogramBoundsMs = histogramBoundsMs
+        self.histogramCounts = [0] * (len(histogramBoundsMs) + 1)
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.minSeconds = None
+        self.maxSeconds = None
+        self.threadBytesRead = 0
+        self.threadBytesWritten = 0
+        self.bytesMapped = 0
+        self.bytesDecoded = 0
+        self.fullRewrites = 0
+        self.errors = 0
+
+    def add(self, span):
+        durationSeconds = span.durationSeconds
+        self.count += 1
+        self.totalSeconds += durationSeconds
+        self.minSeconds = durationSeconds if (self.minSeconds is None) else min(self.minSeconds, durationSeconds)
+        self.maxSeconds = durationSeconds if (self.maxSeconds is None) else max(self.maxSeconds, durationSeconds)
+        self.histogramCounts[bisect.bisect_left(self.histogramBoundsMs, durationSeconds * 1000)] += 1
+
+        attributes = span.attributes
+        self.threadBytesRead += attributes.get('threadBytesRead', 0)
+        self.threadBytesWritten += attributes.get('threadBytesWritten', 0)
+        self.bytesMapped += attributes.get('bytesMapped', 0)
+        self.bytesDecoded += attributes.get('bytesDecoded', 0)
+        if (attributes.get('fullRewrite')):
+            self.fullRewrites += 1
+        if ('error' in attributes):
+            self.errors += 1
+
+    def getPercentileMs(self, percentile):
+        '''
+        Returns an estimate of the given latency percentile (0-100), in ms: the upper bound of the
+        histogram bucket it falls in (or the max duration, for the last bucket).
+        '''
+        if (self.count == 0):
+            return None
+
+        rank = self.count * (percentile / 100.0)
+        cumulativeCount = 0
+        for bucketIndex, bucketCount in enumerate(self.histogramCounts):
+            cumulativeCount += bucketCount
+            if (cumulativeCount >= rank and bucketCount > 0):
+                if (bucketIndex < len(self.histogramBoundsMs)):
+                    return min(self.histogramBoundsMs[bucketIndex], self.maxSeconds * 1000)
+                break
+
+        return self.maxSeconds * 1000
+
+    def toDict(self):
+        histogram = []
+        for bucketIndex, bucketCount in enumerate(self.histogramCounts):
+            upperBoundMs = self.histogramBoundsMs[bucketIndex] if (bucketIndex < len(self.histogramBoundsMs)) else None
+            histogram.append({'upperBoundMs': upperBoundMs, 'count': bucketCount})
+
+        return {
+            'count': self.count,
+            'totalSeconds': self.totalSeconds,
+            'meanMs': (self.totalSeconds / self.count) * 1000 if (self.count) else None,
+            'minMs': self.minSeconds * 1000 if (self.minSeconds is not None) else None,
+            'maxMs': self.maxSeconds * 1000 if (self.maxSeconds is not None) else None,
+            'p50Ms': self.getPercentileMs(50),
+            'p99Ms': self.getPercentileMs(99),
+            'threadBytesRead': self.threadBytesRead,
+            'threadBytesWritten': self.threadBytesWritten,
+            'bytesMapped': self.bytesMapped,
+            'bytesDecoded': self.bytesDecoded,
+            'fullRewrites': self.fullRewrites,
+            'errors': self.errors,
+            'histogram': histogram
+        }
+
+class SpanHistogramAggregator(RecordingInstrumentation):
+    '''
+    Instrumentation that aggregates the spans per audio format and span name, with latency
+    histograms (see SpanStats). Safe to use from multiple threads.
+
+    Params:
+        histogramBoundsMs: upper bounds (ms) of the histogram buckets, in increasing order
+        measureIo: see RecordingInstrumentation
+    '''
+    def __init__(self, histogramBoundsMs=None, measureIo=True):
+        super().__init__(measureIo=measureIo)
+        self.histogramBoundsMs = list(histogramBoundsMs) if (histogramBoundsMs is not None) else list(DEFAULT_HISTOGRAM_BOUNDS_MS)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def onSpanEnd(self, span):
+        statsKey = (span.formatName, span.name)
+        with self._lock:
+            spanStats = self._stats.get(statsKey)
+            if (spanStats is None):
+                spanStats = SpanStats(self.histogramBoundsMs)
+                self._stats[statsKey] = spanStats
+
+            spanStats.add(span)
+
+    def getSummary(self):
+        '''
+        Returns a dict of format name to span name to the stats dict of those spans (see
+        SpanStats.toDict()).
+        '''
+        with self._lock:
+            summary = {}
+            for (formatName, spanName), spanStats in sorted(self._stats.items()):
+                summary.setdefault(formatName, {})[spanName] = spanStats.toDict()
+
+            return summary
+
+    def formatSummary(self):
+        '''
+        Returns the summary as a text table, one line per format and span name.
+        '''
+        lines = ["{:6} {:18} {:>8} {:>10} {:>10} {:>10} {:>12} {:>12} {:>12} {:>12} {:>8}".format(
+            'format', 'span', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'thread read', 'thread wrote', 'mapped', 'decoded', 'rewrites'
+        )]
+        for formatName, formatSummary in self.getSummary().items():
+            for spanName, stats in formatSummary.items():
+                lines.append("{:6} {:18} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>12} {:>12} {:>12} {:>12} {:>8}".format(
+                    formatName, spanName, stats['count'], stats['meanMs'], stats['p50Ms'], stats['p99Ms'],
+                    stats['threadBytesRead'], stats['threadBytesWritten'], stats['bytesMapped'], stats['bytesDecoded'], stats['fullRewrites']
+                ))
+
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+def getThreadIoCounters():
+    '''
+    Returns the I/O counters of the current thread as a tuple of (bytes read, bytes written, size
+    of the counters data read), or None if the platform doesn't provide them.
+    '''
+    try:
+        fd = os.open(THREAD_IO_COUNTERS_FILEPATH, os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        countersData = os.read(fd, 1024)
+    finally:
+        os.close(fd)
+
+    bytesRead = None
+    bytesWritten = None
+    for line in countersData.split(b'\n'):
+        if (line.startswith(b'rchar:')):
+            bytesRead = int(line[6:])
+        elif (line.startswith(b'wchar:')):
+            bytesWritten = int(line[6:])
+
+    if (bytesRead is None or bytesWritten is None):
+        return None
+
+    return (bytesRead, bytesWritten, len(countersData))
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+_defaultInstrumentation = NULL_INSTRUMENTATION
+
+def getDefaultInstrumentation():
+    '''
+    Returns the instrumentation used by the handlers that are not given one of their own.
+    '''
+    return _defaultInstrumentation
+
+def setDefaultInstrumentation(instrumentation):
+    '''
+    Sets the instrumentation used by the handlers created from now on that are not given one of
+    their own (None restores the no-op instrumentation).
+    '''
+    global _defaultInstrumentation
+    _defaultInstrumentation = instrumentation if (instrumentation is not None) else NULL_INSTRUMENTATION
@@ -2,63 +2,72 @@
 mlu.tags.io
 
 This module deals with reading tag and property values and album art of an audio file. 
-Supports FLAC, Mp3, and M4A audio file types. 
+Supports FLAC, Mp3, M4A and Opus audio file types (see mlu.tags.formats). 
 '''
 
 import logging
 from mlu.tags import values
-
-from mlu.tags.audiofmt import flac
-from mlu.tags.audiofmt import mp3
-from mlu.tags.audiofmt import m4a
-from mlu.tags.audiofmt import oggOpus
+from mlu.tags import formats
+from mlu.tags import instrumentation
 
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
-import com.nwrobel.mypycommons.time
 
 logger = logging.getLogger("mluGlobalLogger")
 
-SUPPORTED_AUDIO_TYPES = ['flac', 'mp3', 'm4a', 'opus']
+# File types of the supported audio formats (see mlu.tags.formats, which this list is kept in sync
+# with as formats are registered)
+SUPPORTED_AUDIO_TYPES = formats.REGISTERED_FILE_TYPES
 
 class AudioFileMetadataHandler:
     '''
     Class that reads data for a single audio file.
 
+    The audio file is parsed once and that parse is reused by all the read and write methods until
+    the file changes on disk (its size or modification time changes), so reading the tags and
+    properties of a file and then writing new tag values costs a single parse and a single save.
+
     Params:
         audioFilepath: absolute filepath of the audio file
+        writePolicy: mlu.tags.writepolicy.TagWritePolicy that decides how much padding is kept in
+            the file's tag block when tags are written (optional)
+        instrumentation: mlu.tags.instrumentation.Instrumentation that timed spans of the reads and
+            writes are reported to (optional, see mlu.tags.instrumentation)
+        journal: mlu.tags.journal.TagWriteJournal that the tag writes are journaled with, for
+            crash-safe writes (optional, see mlu.tags.journal)
     '''
-    def __init__(self, audioFilepath):
+    def __init__(self, audioFilepath, writePolicy=None, instrumentation=None, journal=None):
         # validate that the filepath exists
         if (not mypycommons.file.isFile(audioFilepath)):
             raise ValueError("Class attribute 'audioFilepath' must be a valid filepath to an existing file: invalid value '{}'".format(audioFilepath))
 
         self.audioFilepath = audioFilepath
+        self.journal = journal
 
-        # Strip the dot from the file extension to get the audio file type, used by this class
-        self._audioFileType = mypycommons.file.getFileExtension(self.audioFilepath).replace('.', '')
+        # Detect the audio file type from the file content (the extension may be wrong)
+        self._audioFileType = formats.detectAudioFileType(self.audioFilepath)
 
         # Check that the given audio file type is supported
-        if (self._audioFileType.lower() not in SUPPORTED_AUDIO_TYPES):
+        if (self._audioFileType is None):
             raise Exception("Cannot open file '{}': Audio file format is not supported".format(self.audioFilepath))
 
-        if (self._audioFileType == 'flac'):
-            self._audioFmtHandler = flac.AudioFormatHandlerFLAC(self.audioFilepath)
-
-        elif (self._audioFileType == 'mp3'):
-            self._audioFmtHandler = mp3.AudioFormatHandlerMP3(self.audioFilepath)
+        extensionFileType = formats.getFileTypeFromExtension(self.audioFilepath)
+        if (extensionFileType is not None and extensionFileType != self._audioFileType):
+            logger.debug("Audio file '{}' is named as a '{}' file but is a '{}' file".format(self.audioFilepath, extensionFileType, self._audioFileType))
 
-        elif (self._audioFileType == 'm4a'):
-            self._audioFmtHandler = m4a.AudioFormatHandlerM4A(self.audioFilepath)
+        handlerClass = formats.getAudioFormatHandlerClass(self._audioFileType)
+        self._audioFmtHandler = handlerClass(self.audioFilepath, writePolicy, instrumentation)
 
-        elif (self._audioFileType == 'opus'):
-            self._audioFmtHandler = oggOpus.AudioFormatHandlerOggOpus(self.audioFilepath)
-
-    def getTags(self):
+    def getTags(self, tagsOnly=False):
         '''
         Returns tags of the audio file
+
+        Params:
+            tagsOnly: read only the tag block of the file, without parsing the audio stream. This
+                is faster when the properties of the file are not needed; getting the properties
+                or writing tags afterwards parses the whole file.
         '''
-        return self._audioFmtHandler.getTags()
+        return self._audioFmtHandler.getTags(tagsOnly=tagsOnly)
 
     def setTags(self, audioFileTags):
         '''
@@ -75,13 +84,11 @@ class AudioFileMetadataHandler:
         if (not isinstance(audioFileTags, values.AudioFileTags)):
             raise ValueError("Given AudioFileTags object is not valid")
 
-        # Check to see whether or not the new tags to be set are actually new (did the values actually
-        # change?): if not, a write operation is not needed
-        currentTags = self.getTags()
-        if (currentTags.equals(audioFileTags)):
-            logger.debug("setTags() write operation skipped (no change needed): the current tag values are the same as the new given tag values")
-        else:
-            self._audioFmtHandler.setTags(audioFileTags)
+        # The write batch checks whether or not the new tag values are actually new (did the
+        # values actually change?): if not, a write operation is not needed
+        writeBatch = self.createWriteBatch()
+        writeBatch.setTags(audioFileTags, values.STATS_TAGS_FIELDS)
+        writeBatch.commit()
 
     def getProperties(self):
         '''
@@ -91,7 +98,8 @@ class AudioFileMetadataHandler:
 
     def getEmbeddedArtwork(self):
         '''
-        Returns the embedded artwork binary data of the audio file
+        Returns the embedded artwork of the audio file, as an mlu.tags.artwork.EmbeddedArtworkList
+        (which must be closed once the pictures are no longer needed)
         '''
         return self._audioFmtHandler.getEmbeddedArtwork()
 
@@ -99,7 +107,130 @@ class AudioFileMetadataHandler:
         '''
         Sets the value of a given custom (nonstandard) tag for the audio file. 
         '''
-        self._audioFmtHandler.setCustomTag(tagName, value)
+        writeBatch = self.createWriteBatch()
+        writeBatch.setCustomTag(tagName, value)
+        writeBatch.commit()
+
+    def createWriteBatch(self):
+        '''
+        Returns a new AudioFileTagWriteBatch for the audio file, which collects any number of tag
+        changes and then writes them all with a single save of the file.
+        '''
+        return AudioFileTagWriteBatch(self)
+
+
+class AudioFileTagWriteBatch:
+    '''
+    Class that collects tag changes for a single audio file and writes them with a single save
+    of the file when committed. Changes that would not change the current tag values are dropped,
+    and the file is not written at all if nothing changes.
+
+    It can be used as a context manager, which commits the changes if no exception is raised:
+
+        with handler.createWriteBatch() as writeBatch:
+            writeBatch.setTag('rating', '8')
+            writeBatch.setCustomTag('mood', 'happy')
+
+    Params:
+        audioFileMetadataHandler: the AudioFileMetadataHandler of the audio file to write to
+    '''
+    def __init__(self, audioFileMetadataHandler):
+        self._handler = audioFileMetadataHandler
+        self._tagValues = {}
+        self._customTagValues = {}
+        self._removedCustomTagNames = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.commit()
+
+    def setTag(self, tagName, value):
+        '''
+        Sets the value of a standard tag, given by its AudioFileTags field name (e.g. 'albumArtist').
+        An empty value removes the tag from the file.
+        '''
+        if (tagName not in values.AUDIO_FILE_TAGS_FIELDS):
+            raise ValueError("Cannot set tag '{}': not a standard tag field of AudioFileTags".format(tagName))
+
+        self._tagValues[tagName] = value
+
+    def setTags(self, audioFileTags, tagNames=None):
+        '''
+        Sets the values of the standard tags from the given AudioFileTags object: all of them, or
+        only those with the given field names.
+        '''
+        if (tagNames is None):
+            tagNames = values.AUDIO_FILE_TAGS_FIELDS
+
+        for tagName in tagNames:
+            self.setTag(tagName, getattr(audioFileTags, tagName))
+
+    def setCustomTag(self, tagName, value):
+        '''
+        Sets the value of a custom (nonstandard) tag.
+        '''
+        tagName = tagName.lower()
+        self._removedCustomTagNames.discard(tagName)
+        self._customTagValues[tagName] = value
+
+    def removeCustomTag(self, tagName):
+        '''
+        Removes a custom (nonstandard) tag from the file.
+        '''
+        tagName = tagName.lower()
+        self._customTagValues.pop(tagName, None)
+        self._removedCustomTagNames.add(tagName)
+
+    def hasChanges(self):
+        return bool(self._tagValues or self._customTagValues or self._removedCustomTagNames)
+
+    def commit(self):
+        '''
+        Writes the collected tag changes to the audio file with a single save, then clears them.
+        Returns True if the file was written, or False if the write was skipped because none of the
+        changes would change the current tag values.
+        '''
+        audioFmtHandler = self._handler._audioFmtHandler
+        with audioFmtHandler.instrumentation.span(instrumentation.SPAN_COMMIT_WRITE_BATCH, audioFmtHandler.formatName, audioFmtHandler.audioFilepath) as span:
+            written = self._commit()
+            span.setAttribute('written', written)
+
+        return written
+
+    def _commit(self):
+        currentTags = self._handler.getTags()
+
+        tagValues = {
+            tagName: value for tagName, value in self._tagValues.items()
+            if (value != getattr(currentTags, tagName))
+        }
+        customTagValues = {
+            tagName: value for tagName, value in self._customTagValues.items()
+            if (value != currentTags.OTHER_TAGS.get(tagName))
+        }
+        removedCustomTagNames = [
+            tagName for tagName in self._removedCustomTagNames
+            if (tagName in currentTags.OTHER_TAGS)
+        ]
+
+        self._tagValues = {}
+        self._customTagValues = {}
+        self._removedCustomTagNames = set()
+
+        if (not (tagValues or customTagValues or removedCustomTagNames)):
+            logger.debug("Tags write operation skipped (no change needed): the current tag values are the same as the new given tag values")
+            return False
+
+        if (self._handler.journal is not None):
+            self._handler.journal.writeTags(self._handler._audioFmtHandler, currentTags, tagValues, customTagValues, removedCustomTagNames)
+        else:
+            self._handler._audioFmtHandler.writeTags(tagValues, customTagValues, removedCustomTagNames)
+
+        return True
+
 
 
     
@@ -206,4 +337,3 @@ class AudioFileMetadataHandler:
     #     mutagenInterface['----:com.apple.iTunes:PLAY_COUNT'] = (audioFileTags.playCount).encode('utf-8')
     #     mutagenInterface['----:com.apple.iTunes:VOTES'] = (audioFileTags.votes).encode('utf-8')
     #     mutagenInterface['----:com.apple.iTunes:RATING'] = (audioFileTags.rating).encode('utf-8')
-
@@ -0,0 +1,348 @@
+'''
+mlu.tags.journal
+
+Module containing the write-ahead journal used for crash-safe tag writes. Before the tags of an
+audio file are written, an entry holding the values of the changed tags before and after the write
+is saved to the journal dir; it is removed once the write has been verified. If the process dies
+(or the NAS goes away) in the middle of the write, the entries left in the journal tell exactly
+which files may not have their new values, and recover() finishes (or undoes) those writes on
+restart, so a failed mass update does not require re-verifying the whole library.
+
+The write itself is done in one of two ways:
+
+    atomic (default): the audio file is copied next to itself, the tags are written to the copy,
+        which is read back to verify them, and the copy is then moved over the original with
+        os.replace(). The original file is never partially written, at the cost of copying it.
+    in place: the tags are written to the file directly (only the tag block is written when the new
+        tags fit in its padding, see mlu.tags.writepolicy), then read back to verify them.
+
+The journal is used by setting it on the AudioFileMetadataHandler of the file:
+
+    tagWriteJournal = TagWriteJournal()
+    tagWriteJournal.recover()
+    handler = io.AudioFileMetadataHandler(audioFilepath, journal=tagWriteJournal)
+    handler.setCustomTag('mood', 'happy')
+'''
+
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+import com.nwrobel.mypycommons.time
+
+from mlu.settings import MLUSettings
+from mlu.tags import io
+
+logger = logging.getLogger("mluGlobalLogger")
+
+DEFAULT_JOURNAL_DIRNAME = 'tag-journal'
+JOURNAL_ENTRY_FILE_EXTENSION = '.json'
+JOURNAL_VERSION = 1
+
+# Prefix of the copies of audio files that atomic writes are made to
+TEMP_AUDIO_FILE_PREFIX = '.mlu-journal-'
+
+class TagWriteVerificationError(Exception):
+    '''
+    Raised when the tags read back from an audio file after a journaled write do not have the
+    values that were written.
+    '''
+    pass
+
+class TagJournalRecoverySummary:
+    '''
+    Data structure holding the counts of what a recovery of the journal did with the entries left
+    in it.
+    '''
+    def __init__(self):
+        self.alreadyCommitted = 0
+        self.rolledForward = 0
+        self.rolledBack = 0
+        self.failed = 0
+
+    def __str__(self):
+        return "already committed: {}, rolled forward: {}, rolled back: {}, failed: {}".format(
+            self.alreadyCommitted, self.rolledForward, self.rolledBack, self.failed
+        )
+
+class TagWriteJournalEntry:
+    '''
+    Data structure holding a single journaled tag write: the values of the changed tags before and
+    after the write. Standard tags are given by their AudioFileTags field name (an empty value means
+    that the tag is not set), custom tags by their lowercase name (None means that the tag is not
+    set).
+    '''
+    def __init__(self, entryId, audioFilepath, oldTagValues, newTagValues, oldCustomTagValues, newCustomTagValues, atomic, created):
+        self.entryId = entryId
+        self.audioFilepath = audioFilepath
+        self.oldTagValues = oldTagValues
+        self.newTagValues = newTagValues
+        self.oldCustomTagValues = oldCustomTagValues
+        self.newCustomTagValues = newCustomTagValues
+        self.atomic = atomic
+        self.created = created
+
+    def toDict(self):
+        return {
+            'version': JOURNAL_VERSION,
+            'entryId': self.entryId,
+            'audioFilepath': self.audioFilepath,
+            'oldTagValues': self.oldTagValues,
+            'newTagValues': self.newTagValues,
+            'oldCustomTagValues': self.oldCustomTagValues,
+            'newCustomTagValues': self.newCustomTagValues,
+            'atomic': self.atomic,
+            'created': self.created
+        }
+
+    @classmethod
+    def fromDict(cls, entryDict):
+        return cls(
+            entryId=entryDict['entryId'],
+            audioFilepath=entryDict['audioFilepath'],
+            oldTagValues=entryDict['oldTagValues'],
+            newTagValues=entryDict['newTagValues'],
+            oldCustomTagValues=entryDict['oldCustomTagValues'],
+            newCustomTagValues=entryDict['newCustomTagValues'],
+            atomic=entryDict['atomic'],
+            created=entryDict['created']
+        )
+
+    def getTempAudioFilepath(self):
+        '''
+        Returns the filepath of the copy of the audio file used for an atomic write of this entry.
+        '''
+        audioFileDir, audioFilename = os.path.split(self.audioFilepath)
+        # The copy keeps the name (and extension) of the file after the prefix
+        return os.path.join(audioFileDir, "{}{}-{}".format(TEMP_AUDIO_FILE_PREFIX, self.entryId, audioFilename))
+
+class TagWriteJournal:
+    '''
+    Class that journals the tag writes of the audio file handlers it is set on (see the module
+    docstring). Safe to use from multiple threads.
+
+    Params:
+        journalDir: dir of the journal entry files, defaults to a dir in the MLU cache dir. It
+            should be on a local disk, rather than with the audio files on the NAS.
+        atomic: write tags through a copy of the file that is moved over the original, rather than
+            in place
+    '''
+    def __init__(self, journalDir=None, atomic=True):
+        if (journalDir is None):
+            journalDir = mypycommons.file.joinPaths(MLUSettings.cacheDir, DEFAULT_JOURNAL_DIRNAME)
+
+        self.journalDir = MLUSettings.createDirectory(journalDir)
+        self.atomic = atomic
+        self._lock = threading.Lock()
+
+    def writeTags(self, audioFmtHandler, currentTags, tagValues, customTagValues, removedCustomTagNames=()):
+        '''
+        Writes tag changes to the audio file of the given format handler, journaled: the change is
+        logged before the file is written and the entry is removed once the new values are verified.
+        Raises TagWriteVerificationError if the values read back don't match (the entry is then
+        kept, unless the write was atomic and the original file was left untouched).
+
+        Params:
+            audioFmtHandler: the mlu.tags.audiofmt format handler of the audio file
+            currentTags: the current AudioFileTags of the file
+            tagValues, customTagValues, removedCustomTagNames: the tag changes, as given to the
+                format handler's writeTags()
+        '''
+        newCustomTagValues = {tagName.lower(): value for tagName, value in customTagValues.items()}
+        for tagName in removedCustomTagNames:
+            newCustomTagValues[tagName.lower()] = None
+
+        entry = TagWriteJournalEntry(
+            entryId=uuid.uuid4().hex,
+            audioFilepath=os.path.abspath(audioFmtHandler.audioFilepath),
+            oldTagValues={fieldName: getattr(currentTags, fieldName) for fieldName in tagValues},
+            newTagValues=dict(tagValues),
+            oldCustomTagValues={tagName: currentTags.OTHER_TAGS.get(tagName) for tagName in newCustomTagValues},
+            newCustomTagValues=newCustomTagValues,
+            atomic=self.atomic,
+            created=mypycommons.time.getCurrentTimestamp()
+        )
+
+        self._saveEntry(entry)
+        try:
+            self._applyEntryValues(audioFmtHandler, entry, entry.newTagValues, entry.newCustomTagValues)
+        except:
+            # A failed atomic write leaves the original file untouched: there is nothing to recover
+            if (entry.atomic):
+                self._removeEntry(entry)
+            raise
+
+        self._removeEntry(entry)
+
+    def getPendingEntries(self):
+        '''
+        Returns the TagWriteJournalEntry objects of the writes that were started but not verified
+        (left by a process that died mid-write, or by a failed write), oldest first.
+        '''
+        entries = []
+        with self._lock:
+            entryFilenames = [filename for filename in os.listdir(self.journalDir) if filename.endswith(JOURNAL_ENTRY_FILE_EXTENSION)]
+
+        for entryFilename in entryFilenames:
+            entryFilepath = os.path.join(self.journalDir, entryFilename)
+            try:
+                with open(entryFilepath, 'r', encoding='utf-8') as entryFile:
+                    entries.append(TagWriteJournalEntry.fromDict(json.load(entryFile)))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Skipping unreadable tag write journal entry '{}': {}".format(entryFilepath, e))
+
+        entries.sort(key=lambda entry: entry.created)
+        return entries
+
+    def recover(self, rollback=False):
+        '''
+        Resolves the entries left in the journal: the leftover copy of an atomic write is removed,
+        then each file that doesn't have the new tag values of its entry is written again with
+        them (rolled forward), or with the old values if rollback is given. The entry of a file
+        that can't be read or written is kept. Returns a TagJournalRecoverySummary.
+        '''
+        summary = TagJournalRecoverySummary()
+        for entry in self.getPendingEntries():
+            tempAudioFilepath = entry.getTempAudioFilepath()
+            if (os.path.exists(tempAudioFilepath)):
+                os.remove(tempAudioFilepath)
+
+            try:
+                if (not os.path.exists(entry.audioFilepath)):
+                    logger.warning("Dropping tag write journal entry of audio file '{}': the file no longer exists".format(entry.audioFilepath))
+                    summary.failed += 1
+                    self._removeEntry(entry)
+                    continue
+
+                audioFmtHandler = io.AudioFileMetadataHandler(entry.audioFilepath)._audioFmtHandler
+                currentTags = audioFmtHandler.getTags(tagsOnly=True)
+
+                if (rollback):
+                    if (not _tagsHaveValues(currentTags, entry.oldTagValues, entry.oldCustomTagValues)):
+                        self._applyEntryValues(audioFmtHandler, entry, entry.oldTagValues, entry.oldCustomTagValues)
+                    summary.rolledBack += 1
+                elif (_tagsHaveValues(currentTags, entry.newTagValues, entry.newCustomTagValues)):
+                    summary.alreadyCommitted += 1
+                else:
+                    self._applyEntryValues(audioFmtHandler, entry, entry.newTagValues, entry.newCustomTagValues)
+                    summary.rolledForward += 1
+
+                self._removeEntry(entry)
+
+            except Exception as e:
+                logger.error("Failed to recover the tag write of audio file '{}', keeping its journal entry: {}".format(entry.audioFilepath, e))
+                summary.failed += 1
+
+        logger.info("Recovered tag write journal '{}': {}".format(self.journalDir, summary))
+        return summary
+
+    def _applyEntryValues(self, audioFmtHandler, entry, tagValues, customTagValues):
+        '''
+        Writes the given tag values (as held by a journal entry) to the audio file of the given
+        format handler, atomically or in place depending on the entry, and verifies them.
+        '''
+        removedCustomTagNames = [tagName for tagName, value in customTagValues.items() if (value is None)]
+        setCustomTagValues = {tagName: value for tagName, value in customTagValues.items() if (value is not None)}
+
+        if (entry.atomic):
+            tempAudioFilepath = entry.getTempAudioFilepath()
+            try:
+                shutil.copy2(entry.audioFilepath, tempAudioFilepath)
+                tempFmtHandler = audioFmtHandler.__class__(tempAudioFilepath, audioFmtHandler.writePolicy, audioFmtHandler.instrumentation)
+                tempFmtHandler.writeTags(tagValues, setCustomTagValues, removedCustomTagNames)
+                _syncFile(tempAudioFilepath)
+                self._verifyTags(tempFmtHandler, tagValues, customTagValues)
+
+                os.replace(tempAudioFilepath, entry.audioFilepath)
+            except:
+                if (os.path.exists(tempAudioFilepath)):
+                    os.remove(tempAudioFilepath)
+                raise
+            finally:
+                # The file was replaced (or not): the snapshot of the handler must not be reused
+                audioFmtHandler.discardSnapshot()
+
+            _syncDirectory(os.path.dirname(entry.audioFilepath))
+
+        else:
+            audioFmtHandler.writeTags(tagValues, setCustomTagValues, removedCustomTagNames)
+            _syncFile(entry.audioFilepath)
+            self._verifyTags(audioFmtHandler.__class__(entry.audioFilepath), tagValues, customTagValues)
+
+    def _verifyTags(self, audioFmtHandler, tagValues, customTagValues):
+        '''
+        Reads the tags of the audio file of the given format handler back from disk and checks that
+        they have the given values.
+        '''
+        audioFmtHandler.discardSnapshot()
+        if (not _tagsHaveValues(audioFmtHandler.getTags(tagsOnly=True), tagValues, customTagValues)):
+            raise TagWriteVerificationError("Tags read back from audio file '{}' after the write do not have the written values".format(audioFmtHandler.audioFilepath))
+
+    def _getEntryFilepath(self, entry):
+        return os.path.join(self.journalDir, entry.entryId + JOURNAL_ENTRY_FILE_EXTENSION)
+
+    def _saveEntry(self, entry):
+        '''
+        Saves the entry file (written to a temp file that is moved in place, then synced, so that
+        the entry is complete on disk before the audio file is touched).
+        '''
+        entryFilepath = self._getEntryFilepath(entry)
+        tempEntryFilepath = entryFilepath + '.tmp'
+        with open(tempEntryFilepath, 'w', encoding='utf-8') as entryFile:
+            json.dump(entry.toDict(), entryFile)
+            entryFile.flush()
+            os.fsync(entryFile.fileno())
+
+        with self._lock:
+            os.replace(tempEntryFilepath, entryFilepath)
+            _syncDirectory(self.journalDir)
+
+    def _removeEntry(self, entry):
+        with self._lock:
+            entryFilepath = self._getEntryFilepath(entry)
+            if (os.path.exists(entryFilepath)):
+                os.remove(entryFilepath)
+
+def _tagsHaveValues(audioFileTags, tagValues, customTagValues):
+    '''
+    Returns whether the given AudioFileTags have the given standard tag values and custom tag values
+    (None for a custom tag that must not be set).
+    '''
+    for fieldName, value in tagValues.items():
+        if ((getattr(audioFileTags, fieldName) or '') != (value or '')):
+            return False
+
+    for tagName, value in customTagValues.items():
+        if (audioFileTags.OTHER_TAGS.get(tagName) != value):
+            return False
+
+    return True
+
+def _syncFile(filepath):
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _syncDirectory(dirPath):
+    '''
+    Syncs the given dir, so that a file created in or moved into it is on disk. Not supported on
+    every platform/filesystem, in which case it is skipped.
+    '''
+    try:
+        fd = os.open(dirPath, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,198 @@
+'''
+mlu.tags.payload
+
+Module for hashing the audio payload of an audio file: the part of the file that holds the audio
+data, without the tag blocks. The payload hash of a file does not change when its tags are
+written (even when the file is rewritten to resize its tag block), so it tells a change of the
+tags of a file from a change of its audio, and finds files with the same audio and different tags.
+
+The payload of each format is:
+
+    MP3: the data after the ID3v2 tag and before the APE and ID3v1 tags
+    FLAC: the audio frames, after the metadata blocks (and before an ID3v1 tag)
+    M4A: the data of the 'mdat' atoms
+    Ogg Opus: the packet data of the audio pages, after the header packets (the page headers are
+        left out, since their sequence numbers and checksums change with the size of the tags)
+'''
+
+import os
+import struct
+import hashlib
+
+from mlu.tags import formats
+
+HASH_READ_SIZE = 1024 * 1024
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_TAG_SIZE = 128
+APE_TAG_FOOTER_SIZE = 32
+OGG_PAGE_HEADER_SIZE = 27
+
+def getAudioPayloadHash(audioFilepath):
+    '''
+    Returns the SHA-256 hex digest of the audio payload of the given audio file (see the module
+    docstring), so that files with the same audio and different tags have the same hash. Raises an
+    exception if the file is not of a supported format.
+    '''
+    fileType = formats.detectAudioFileType(audioFilepath)
+    hasher = hashlib.sha256()
+
+    with open(audioFilepath, 'rb') as audioFile:
+        if (fileType == 'opus'):
+            _hashOggAudioPackets(audioFile, hasher, headerPacketCount=2)
+        else:
+            payloadRanges = _getPayloadRanges(audioFile, fileType, os.fstat(audioFile.fileno()).st_size)
+            for start, end in payloadRanges:
+                _hashFileRange(audioFile, hasher, start, end)
+
+    return hasher.hexdigest()
+
+def tryGetAudioPayloadHash(audioFilepath):
+    '''
+    Returns a (payload hash, None) tuple for the given audio file, or (None, error description) if
+    hashing its payload failed. This function does not raise, so it can be mapped over a pool.
+    '''
+    try:
+        return (getAudioPayloadHash(audioFilepath), None)
+    except Exception as e:
+        return (None, "{}: {}".format(type(e).__name__, e))
+
+def _getPayloadRanges(audioFile, fileType, fileSize):
+    '''
+    Returns the list of (start, end) byte ranges of the audio payload of the given file of the
+    given type (other than Ogg).
+    '''
+    if (fileType == 'm4a'):
+        return _getMp4MdatRanges(audioFile, fileSize)
+
+    start = _getId3v2TagSize(audioFile)
+    end = _getTrailingTagsStart(audioFile, fileSize)
+
+    if (fileType == 'flac'):
+        start = _getFlacAudioStart(audioFile, start)
+    elif (fileType != 'mp3'):
+        raise ValueError("Cannot hash the audio payload of '{}': unsupported file type '{}'".format(audioFile.name, fileType))
+
+    return [(start, max(start, end))]
+
+def _getId3v2TagSize(audioFile):
+    '''
+    Returns the size of the ID3v2 tag at the start of the file (including its header and footer),
+    or 0 if there is none.
+    '''
+    audioFile.seek(0)
+    header = audioFile.read(ID3V2_HEADER_SIZE)
+    if (len(header) < ID3V2_HEADER_SIZE or not header.startswith(b'ID3')):
+        return 0
+
+    tagSize = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    return ID3V2_HEADER_SIZE + tagSize + (10 if (header[5] & 0x10) else 0)
+
+def _getTrailingTagsStart(audioFile, fileSize):
+    '''
+    Returns the offset of the tags at the end of the file (an ID3v1 tag, and an APEv2 tag before
+    it), or the file size if there are none.
+    '''
+    end = fileSize
+    if (end >= ID3V1_TAG_SIZE):
+        audioFile.seek(end - ID3V1_TAG_SIZE)
+        if (audioFile.read(3) == b'TAG'):
+            end -= ID3V1_TAG_SIZE
+
+    if (end >= APE_TAG_FOOTER_SIZE):
+        audioFile.seek(end - APE_TAG_FOOTER_SIZE)
+        footer = audioFile.read(APE_TAG_FOOTER_SIZE)
+        if (footer.startswith(b'APETAGEX')):
+            # The tag size includes the footer but not the header (present if flag bit 31 is set)
+            tagSize, itemCount, flags = struct.unpack('<III', footer[12:24])
+            end -= tagSize + (APE_TAG_FOOTER_SIZE if (flags & 0x80000000) else 0)
+
+    return max(end, 0)
+
+def _getFlacAudioStart(audioFile, streamStart):
+    '''
+    Returns the offset of the first audio frame of the FLAC stream starting at the given offset (the
+    end of its metadata blocks).
+    '''
+    audioFile.seek(streamStart)
+    if (audioFile.read(4) != b'fLaC'):
+        raise ValueError("'{}' is not a valid FLAC file".format(audioFile.name))
+
+    position = streamStart + 4
+    while (True):
+        blockHeader = audioFile.read(4)
+        if (len(blockHeader) < 4):
+            return position
+
+        blockLength = int.from_bytes(blockHeader[1:], 'big')
+        position += 4 + blockLength
+        if (blockHeader[0] & 0x80):
+            return position
+
+        audioFile.seek(position)
+
+def _getMp4MdatRanges(audioFile, fileSize):
+    '''
+    Returns the (start, end) ranges of the data of the top-level 'mdat' atoms of the MP4 file.
+    '''
+    ranges = []
+    position = 0
+    while (position + 8 <= fileSize):
+        audioFile.seek(position)
+        atomHeader = audioFile.read(8)
+        atomSize, atomType = struct.unpack('>I4s', atomHeader)
+        headerSize = 8
+
+        if (atomSize == 1):
+            atomSize = struct.unpack('>Q', audioFile.read(8))[0]
+            headerSize = 16
+        elif (atomSize == 0):
+            atomSize = fileSize - position
+
+        if (atomSize < headerSize):
+            raise ValueError("'{}' has an invalid MP4 atom at offset {}".format(audioFile.name, position))
+
+        if (atomType == b'mdat'):
+            ranges.append((position + headerSize, min(position + atomSize, fileSize)))
+
+        position += atomSize
+
+    if (not ranges):
+        raise ValueError("'{}' has no MP4 'mdat' atom".format(audioFile.name))
+
+    return ranges
+
+def _hashOggAudioPackets(audioFile, hasher, headerPacketCount):
+    '''
+    Hashes the packet data of the pages of the Ogg stream that follow its header packets. The page
+    headers are skipped, since their sequence numbers and checksums change when the header packets
+    (the tags) change size. The audio data always starts on a new page.
+    '''
+    audioFile.seek(0)
+    completedPackets = 0
+
+    while (True):
+        pageHeader = audioFile.read(OGG_PAGE_HEADER_SIZE)
+        if (len(pageHeader) < OGG_PAGE_HEADER_SIZE):
+            break
+        if (not pageHeader.startswith(b'OggS')):
+            raise ValueError("'{}' has an invalid Ogg page".format(audioFile.name))
+
+        segmentTable = audioFile.read(pageHeader[26])
+        pageData = audioFile.read(sum(segmentTable))
+
+        if (completedPackets < headerPacketCount):
+            completedPackets += sum(1 for lacingValue in segmentTable if (lacingValue < 255))
+        else:
+            hasher.update(pageData)
+
+def _hashFileRange(audioFile, hasher, start, end):
+    audioFile.seek(start)
+    remaining = end - start
+    while (remaining > 0):
+        data = audioFile.read(min(HASH_READ_SIZE, remaining))
+        if (not data):
+            break
+
+        hasher.update(data)
+        remaining -= len(data)
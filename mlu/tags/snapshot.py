@@ -0,0 +1,100 @@
+'''
+mlu.tags.snapshot
+
+Module containing the data structure which holds the result of parsing a single audio file, so
+that the same parse can be reused for reading tags, reading properties and writing tags.
+'''
+
+import os
+
+def getFileStatSignature(fileStat):
+    '''
+    Returns the values of the given os.stat_result that are used to tell whether or not a file has
+    changed on disk since it was last read: the file size and the modification time (ns).
+    '''
+    return (fileStat.st_size, fileStat.st_mtime_ns)
+
+class AudioFileSnapshot:
+    '''
+    Data structure holding a parsed (mutagen) interface for a single audio file, together with the
+    file stat info taken when the file was parsed and the tags/properties decoded from it.
+
+    The snapshot is valid until the file's size or modification time changes on disk. The decoded
+    tags and properties are filled in by the audio format handler the first time they are needed.
+
+    A tags-only snapshot holds just the tag block of the file (read without parsing the audio
+    stream) and no mutagen interface: it can be used to read tags, but not properties or writes.
+
+    Params:
+        audioFilepath: absolute filepath of the audio file
+        mutagenInterface: the parsed mutagen object for the file, or None for a tags-only snapshot
+        fileStat: os.stat_result of the file, taken before the file was parsed
+        mutagenTags: the mutagen tags object read for a tags-only snapshot
+    '''
+    def __init__(self, audioFilepath, mutagenInterface, fileStat, mutagenTags=None):
+        self.audioFilepath = audioFilepath
+        self.mutagenInterface = mutagenInterface
+        self.isTagsOnly = (mutagenInterface is None)
+        self.tags = None
+        self.properties = None
+        self._mutagenTags = mutagenTags
+        self._setFileStat(fileStat)
+
+    @property
+    def mutagenTags(self):
+        '''
+        The mutagen tags object of the file (None if the file has no tags).
+        '''
+        if (self.isTagsOnly):
+            return self._mutagenTags
+        else:
+            return self.mutagenInterface.tags
+
+    @classmethod
+    def load(cls, audioFilepath, loadMutagenInterfaceFunc):
+        '''
+        Parses the given audio file with the given function and returns a new snapshot for it.
+        The file is stat'ed before it is parsed, so a write that happens during the parse will
+        make the snapshot invalid rather than going unnoticed.
+        '''
+        fileStat = os.stat(audioFilepath)
+        mutagenInterface = loadMutagenInterfaceFunc(audioFilepath)
+
+        return cls(audioFilepath, mutagenInterface, fileStat)
+
+    @classmethod
+    def loadTagsOnly(cls, audioFilepath, loadMutagenTagsFunc):
+        '''
+        Reads just the tag block of the given audio file with the given function and returns a new
+        tags-only snapshot for it.
+        '''
+        fileStat = os.stat(audioFilepath)
+        mutagenTags = loadMutagenTagsFunc(audioFilepath)
+
+        return cls(audioFilepath, None, fileStat, mutagenTags=mutagenTags)
+
+    def isCurrent(self):
+        '''
+        Returns whether or not the snapshot still matches the audio file on disk.
+        '''
+        try:
+            fileStat = os.stat(self.audioFilepath)
+        except OSError:
+            return False
+
+        return (getFileStatSignature(fileStat) == self.statSignature)
+
+    def refreshAfterWrite(self):
+        '''
+        Updates the snapshot after its mutagen interface was saved to the audio file. The interface
+        already holds the values that were written, so the file is not parsed again: only the stat
+        info is updated and the decoded tags/properties are dropped so they get decoded again.
+        '''
+        self._setFileStat(os.stat(self.audioFilepath))
+        self.tags = None
+        self.properties = None
+
+    def _setFileStat(self, fileStat):
+        self.fileSize = fileStat.st_size
+        self.fileDateModifiedTimestamp = fileStat.st_mtime
+        self.statSignature = getFileStatSignature(fileStat)
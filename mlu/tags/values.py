@@ -8,10 +8,222 @@ Modified: 2021-12-17
 Module containing the data structures used to hold audio file tags and properties values.
 '''
 
-class AudioFileTags:
+from array import array
+
+# Names of the standard tag fields of AudioFileTags (all except OTHER_TAGS), in constructor order
+AUDIO_FILE_TAGS_FIELDS = [
+    'title',
+    'artist',
+    'album',
+    'albumArtist',
+    'composer',
+    'date',
+    'genre',
+    'trackNumber',
+    'totalTracks',
+    'discNumber',
+    'totalDiscs',
+    'bpm',
+    'key',
+    'lyrics',
+    'comment',
+    'dateAdded',
+    'dateAllPlays',
+    'dateLastPlayed',
+    'playCount',
+    'votes',
+    'rating'
+]
+
+# Names of the tag fields holding the playback statistics and rating of a file: these are the
+# fields written by setTags()
+STATS_TAGS_FIELDS = [
+    'dateAllPlays',
+    'dateLastPlayed',
+    'playCount',
+    'votes',
+    'rating'
+]
+
+# Names of the fields of AudioFileProperties, in constructor order
+AUDIO_FILE_PROPERTIES_FIELDS = [
+    'fileSize',
+    'fileDateModified',
+    'duration',
+    'format',
+    'bitRate',
+    'sampleRate',
+    'numChannels',
+    'replayGain',
+    'bitDepth',
+    'encoder',
+    'bitRateMode',
+    'codec'
+]
+
+class LazyFieldDecoder:
+    '''
+    Decodes the field values of a lazy AudioFileTags/AudioFileProperties object on demand, one
+    field at a time, with the given function (field name -> value). Each decoded value is cached,
+    so objects that share the decoder (copies of the same object) only decode each field once.
+    '''
+    def __init__(self, decodeFieldFunc):
+        self._decodeFieldFunc = decodeFieldFunc
+        self._values = {}
+
+    def decodeField(self, fieldName):
+        try:
+            return self._values[fieldName]
+        except KeyError:
+            pass
+
+        if (self._decodeFieldFunc is None):
+            raise ValueError("Cannot decode field '{}': the decoder was detached from its source".format(fieldName))
+
+        value = self._decodeFieldFunc(fieldName)
+        self._values[fieldName] = value
+        return value
+
+    def detach(self, fieldNames):
+        '''
+        Decodes all of the given fields that have not been decoded yet and drops the decode
+        function, so that the decoded values no longer depend on (or change with) the source that
+        they were decoded from.
+        '''
+        for fieldName in fieldNames:
+            self.decodeField(fieldName)
+
+        self._decodeFieldFunc = None
+
+class LazyFieldValues:
+    '''
+    Base class for the value data structures, allowing an object to be created without its field
+    values (see createLazy()): each field is then decoded the first time that it is accessed.
+    Subclasses list their fields in FIELD_NAMES and as their __slots__.
+
+    Objects are compared by their field values, and can be hashed (the hash changes if a field
+    value of the object is changed).
+    '''
+    __slots__ = ('_fieldDecoder',)
+    FIELD_NAMES = []
+
+    @classmethod
+    def createLazy(cls, fieldDecoder):
+        '''
+        Returns a new object whose field values are decoded on demand by the given LazyFieldDecoder.
+        '''
+        lazyValues = cls.__new__(cls)
+        lazyValues._fieldDecoder = fieldDecoder
+        return lazyValues
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set: decode the field if this is a lazy object
+        if (name not in self.FIELD_NAMES):
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+        fieldDecoder = self._getFieldDecoder()
+        if (fieldDecoder is None):
+            raise AttributeError("'{}' object has no value for field '{}'".format(type(self).__name__, name))
+
+        value = fieldDecoder.decodeField(name)
+        # Mutable values are copied, since the decoded value is shared by all copies of the object
+        if (isinstance(value, dict)):
+            value = dict(value)
+
+        setattr(self, name, value)
+        return value
+
+    def __eq__(self, other):
+        if (type(self) is not type(other)):
+            return NotImplemented
+
+        return (self._getFieldValuesTuple() == other._getFieldValuesTuple())
+
+    def __hash__(self):
+        hashableValues = []
+        for value in self._getFieldValuesTuple():
+            if (isinstance(value, dict)):
+                value = frozenset(value.items())
+            hashableValues.append(value)
+
+        return hash(tuple(hashableValues))
+
+    def __getstate__(self):
+        # Decode all the fields before pickling, the decoder (and what it decodes from) stays here
+        return self.toDict()
+
+    def __setstate__(self, state):
+        self._fieldDecoder = None
+        for fieldName, value in state.items():
+            setattr(self, fieldName, value)
+
+    def toDict(self):
+        '''
+        Returns a dict of field name to value, for all the fields of the object.
+        '''
+        return {fieldName: getattr(self, fieldName) for fieldName in self.FIELD_NAMES}
+
+    def isDecoded(self, fieldName):
+        '''
+        Returns whether or not the value of the given field is set on the object (always true for an
+        object that is not lazy).
+        '''
+        return (self._getSetFieldValue(fieldName) is not _NOT_SET)
+
+    def detach(self):
+        '''
+        Decodes all the fields of a lazy object (and of the copies that share its decoder) that have
+        not been decoded yet, so that it no longer depends on the parsed tag block it was created
+        from. Must be called before that tag block is changed.
+        '''
+        fieldDecoder = self._getFieldDecoder()
+        if (fieldDecoder is not None):
+            fieldDecoder.detach(self.FIELD_NAMES)
+
+    def copy(self):
+        '''
+        Returns a new object with the same field values as this one. The copy of a lazy object
+        shares its decoder: fields that are not decoded yet stay lazy in the copy.
+        '''
+        valuesCopy = type(self).__new__(type(self))
+        valuesCopy._fieldDecoder = self._getFieldDecoder()
+
+        for fieldName in self.FIELD_NAMES:
+            value = self._getSetFieldValue(fieldName)
+            if (value is not _NOT_SET):
+                if (isinstance(value, dict)):
+                    value = dict(value)
+                setattr(valuesCopy, fieldName, value)
+
+        return valuesCopy
+
+    def _getFieldValuesTuple(self):
+        return tuple(getattr(self, fieldName) for fieldName in self.FIELD_NAMES)
+
+    def _getFieldDecoder(self):
+        try:
+            return object.__getattribute__(self, '_fieldDecoder')
+        except AttributeError:
+            return None
+
+    def _getSetFieldValue(self, fieldName):
+        # Gets the value of the field without decoding it (object.__getattribute__ does not fall
+        # back to __getattr__)
+        try:
+            return object.__getattribute__(self, fieldName)
+        except AttributeError:
+            return _NOT_SET
+
+# Marker for a field that has no value set on an object (yet)
+_NOT_SET = object()
+
+class AudioFileTags(LazyFieldValues):
     '''
     Data structure holding the values for a single audio file of all the tags supported by MLU.
     '''
+    FIELD_NAMES = AUDIO_FILE_TAGS_FIELDS + ['OTHER_TAGS']
+    __slots__ = tuple(FIELD_NAMES)
+
     def __init__(
         self, 
         title,
@@ -37,6 +249,7 @@ class AudioFileTags:
         rating,
         OTHER_TAGS
     ):
+        self._fieldDecoder = None
         self.title = title
         self.artist = artist
         self.album = album
@@ -61,38 +274,44 @@ class AudioFileTags:
         self.OTHER_TAGS = OTHER_TAGS
 
     def equals(self, otherAudioFileTags):
-        tagsAreEqual = (
-            self.title == otherAudioFileTags.title and
-            self.artist == otherAudioFileTags.artist and
-            self.album == otherAudioFileTags.album and
-            self.albumArtist == otherAudioFileTags.albumArtist and
-            self.composer == otherAudioFileTags.composer and
-            self.date == otherAudioFileTags.date and
-            self.genre == otherAudioFileTags.genre and
-            self.trackNumber == otherAudioFileTags.trackNumber and
-            self.totalTracks == otherAudioFileTags.totalTracks and
-            self.discNumber == otherAudioFileTags.discNumber and
-            self.totalDiscs == otherAudioFileTags.totalDiscs and
-            self.bpm == otherAudioFileTags.bpm and
-            self.key == otherAudioFileTags.key and
-            self.lyrics == otherAudioFileTags.lyrics and
-            self.comment == otherAudioFileTags.comment and
-            self.dateAdded == otherAudioFileTags.dateAdded and
-            self.dateAllPlays == otherAudioFileTags.dateAllPlays and
-            self.dateLastPlayed == otherAudioFileTags.dateLastPlayed and
-            self.playCount == otherAudioFileTags.playCount and
-            self.votes == otherAudioFileTags.votes and
-            self.rating == otherAudioFileTags.rating and
-            self.OTHER_TAGS == otherAudioFileTags.OTHER_TAGS
-        )
-
-        return tagsAreEqual
-
-class AudioFileProperties:
+        return (self == otherAudioFileTags)
+
+    def diff(self, otherAudioFileTags):
+        '''
+        Returns the differences from these tags to the given (newer) tags, as a dict of field name
+        to (old value, new value) for each standard field that changed. Changed custom tags are
+        given under 'OTHER_TAGS', as a dict of tag name to (old value, new value), where a value is
+        None if the tag is not set on that side.
+        '''
+        tagsDiff = {}
+        for fieldName in AUDIO_FILE_TAGS_FIELDS:
+            oldValue = getattr(self, fieldName)
+            newValue = getattr(otherAudioFileTags, fieldName)
+            if (oldValue != newValue):
+                tagsDiff[fieldName] = (oldValue, newValue)
+
+        oldOtherTags = self.OTHER_TAGS or {}
+        newOtherTags = otherAudioFileTags.OTHER_TAGS or {}
+        otherTagsDiff = {}
+        for tagName in set(oldOtherTags) | set(newOtherTags):
+            oldValue = oldOtherTags.get(tagName)
+            newValue = newOtherTags.get(tagName)
+            if (oldValue != newValue):
+                otherTagsDiff[tagName] = (oldValue, newValue)
+
+        if (otherTagsDiff):
+            tagsDiff['OTHER_TAGS'] = otherTagsDiff
+
+        return tagsDiff
+
+class AudioFileProperties(LazyFieldValues):
     '''
     Data structure holding the values for a single audio file of all the file properties supported 
     by MLU.
     '''
+    FIELD_NAMES = AUDIO_FILE_PROPERTIES_FIELDS
+    __slots__ = tuple(FIELD_NAMES)
+
     def __init__(
         self,
         fileSize,
@@ -108,6 +327,7 @@ class AudioFileProperties:
         bitRateMode,
         codec
     ):
+        self._fieldDecoder = None
         self.fileSize = fileSize
         self.fileDateModified = fileDateModified
         self.duration = duration
@@ -119,4 +339,109 @@ class AudioFileProperties:
         self.bitDepth = bitDepth
         self.encoder = encoder
         self.bitRateMode = bitRateMode
-        self.codec = codec
\ No newline at end of file
+        self.codec = codec
+
+class InternedValueColumn:
+    '''
+    Column of values stored as indexes into a pool of the distinct values in the column: each
+    distinct value is stored once, and each row takes 4 bytes (an unsigned int index).
+    '''
+    def __init__(self):
+        self.pool = []
+        self._poolIndexes = {}
+        self.indexes = array('I')
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def __getitem__(self, row):
+        return self.pool[self.indexes[row]]
+
+    def append(self, value):
+        self.indexes.append(self.getPoolIndex(value, add=True))
+
+    def getPoolIndex(self, value, add=False):
+        '''
+        Returns the index of the given value in the pool, or None if the value is not in the pool
+        (unless add is given, in which case the value is added to the pool).
+        '''
+        poolIndex = self._poolIndexes.get(value)
+        if (poolIndex is None and add):
+            poolIndex = len(self.pool)
+            self.pool.append(value)
+            self._poolIndexes[value] = poolIndex
+
+        return poolIndex
+
+class AudioFileTagsBatch:
+    '''
+    Columnar container for the tags of many audio files: each tag field is stored as an
+    InternedValueColumn, so repeated values (artists, albums, genres, empty values) are only
+    stored once. This takes a fraction of the memory of holding an AudioFileTags object per file.
+
+    The OTHER_TAGS of each file are stored in the same way, as a sorted tuple of (name, value)
+    pairs.
+    '''
+    def __init__(self, audioFileTagsList=()):
+        self._columns = {fieldName: InternedValueColumn() for fieldName in AudioFileTags.FIELD_NAMES}
+        self.extend(audioFileTagsList)
+
+    def __len__(self):
+        return len(self._columns['title'])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.getTags(row)
+
+    def append(self, audioFileTags):
+        for fieldName, column in self._columns.items():
+            value = getattr(audioFileTags, fieldName)
+            if (fieldName == 'OTHER_TAGS'):
+                value = tuple(sorted(value.items()))
+
+            column.append(value)
+
+    def extend(self, audioFileTagsList):
+        for audioFileTags in audioFileTagsList:
+            self.append(audioFileTags)
+
+    def getTags(self, row):
+        '''
+        Returns a new AudioFileTags object with the tag values of the given row.
+        '''
+        tagValues = {fieldName: column[row] for fieldName, column in self._columns.items()}
+        tagValues['OTHER_TAGS'] = dict(tagValues['OTHER_TAGS'])
+
+        return AudioFileTags(**tagValues)
+
+    def getValue(self, row, fieldName):
+        '''
+        Returns the value of the given tag field of the given row.
+        '''
+        value = self._columns[fieldName][row]
+        if (fieldName == 'OTHER_TAGS'):
+            value = dict(value)
+
+        return value
+
+    def getColumn(self, fieldName):
+        '''
+        Returns the InternedValueColumn of the given tag field (OTHER_TAGS values are stored as
+        sorted tuples of (name, value) pairs).
+        '''
+        return self._columns[fieldName]
+
+    def findRows(self, fieldName, value):
+        '''
+        Returns the list of rows whose value of the given tag field equals the given value. Only the
+        pool indexes are compared, not the values themselves.
+        '''
+        column = self._columns[fieldName]
+        if (fieldName == 'OTHER_TAGS'):
+            value = tuple(sorted(value.items()))
+
+        poolIndex = column.getPoolIndex(value)
+        if (poolIndex is None):
+            return []
+
+        return [row for row, rowPoolIndex in enumerate(column.indexes) if (rowPoolIndex == poolIndex)]
@@ -0,0 +1,131 @@
+'''
+mlu.tags.writepolicy
+
+Module containing the policy that decides how much padding is left in the tag block of an audio
+file when tags are written, and the stats of how often a tag write forced a full rewrite of the
+file.
+
+When the new tags fit in the tag block of a file (tags + padding), they are patched in place and
+only the tag block is written. When they don't fit, the tag block has to grow, and everything that
+follows it in the file (the audio data) has to be moved: for a large file, that is a rewrite of
+the whole file. The policy reserves a larger amount of padding whenever the tag block has to be
+resized, so that later tag updates (e.g. play count bumps) fit in the padding.
+'''
+
+import threading
+
+# Padding (bytes) reserved in the tag block whenever it has to be resized
+DEFAULT_RESERVED_PADDING = 16 * 1024
+
+# Padding (bytes) that must be left after a write for it to be done in place: if less would be
+# left, the tag block is resized to the reserved padding instead
+DEFAULT_MIN_PADDING = 1024
+
+class TagWriteStats:
+    '''
+    Class that counts, per audio format, how many tag writes were patched in place and how many
+    forced a full rewrite of the file. Safe to use from multiple threads.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def recordWrite(self, formatName, fullRewrite):
+        with self._lock:
+            formatCounts = self._counts.setdefault(formatName, {'inPlace': 0, 'fullRewrite': 0})
+            if (fullRewrite):
+                formatCounts['fullRewrite'] += 1
+            else:
+                formatCounts['inPlace'] += 1
+
+    def getCounts(self):
+        '''
+        Returns a dict of format name to a dict with the 'inPlace' and 'fullRewrite' write counts.
+        '''
+        with self._lock:
+            return {formatName: dict(formatCounts) for formatName, formatCounts in self._counts.items()}
+
+    def getFullRewriteRatio(self, formatName=None):
+        '''
+        Returns the fraction of the tag writes (of the given format, or all formats) that forced a
+        full rewrite of the file, or None if there were no writes.
+        '''
+        counts = self.getCounts()
+        if (formatName is not None):
+            counts = {formatName: counts.get(formatName, {'inPlace': 0, 'fullRewrite': 0})}
+
+        fullRewrites = sum(formatCounts['fullRewrite'] for formatCounts in counts.values())
+        totalWrites = fullRewrites + sum(formatCounts['inPlace'] for formatCounts in counts.values())
+        if (totalWrites == 0):
+            return None
+
+        return (fullRewrites / totalWrites)
+
+    def reset(self):
+        with self._lock:
+            self._counts = {}
+
+class TagWritePaddingDecision:
+    '''
+    Padding callback for a single mutagen save (mutagen calls it with a PaddingInfo object). It
+    applies the policy and remembers whether the write will be done in place or not.
+    '''
+    def __init__(self, reservedPadding, minPadding):
+        self._reservedPadding = reservedPadding
+        self._minPadding = minPadding
+
+        # Stays None if mutagen never asks for the padding (e.g. an Opus tag that has to preserve
+        # trailing data): that write is counted as a full rewrite
+        self.fullRewrite = None
+
+    def __call__(self, paddingInfo):
+        # Keep the padding that is left if it's enough: the tag block keeps its size, so only the
+        # tag block is written. Never shrink the padding, since that also moves the audio data.
+        if (paddingInfo.padding >= self._minPadding):
+            newPadding = paddingInfo.padding
+        else:
+            newPadding = max(self._reservedPadding, self._minPadding)
+
+        self.fullRewrite = (newPadding != paddingInfo.padding)
+        return newPadding
+
+    def isFullRewrite(self):
+        '''
+        Returns whether or not the save that used this callback rewrote the whole file.
+        '''
+        return (self.fullRewrite is None or self.fullRewrite)
+
+class TagWritePolicy:
+    '''
+    Class defining how much padding is kept in the tag block of audio files when tags are written.
+
+    Params:
+        reservedPadding: padding (bytes) reserved in the tag block whenever it has to be resized
+        minPadding: padding (bytes) that must be left after a write for it to be done in place
+        stats: TagWriteStats object that the outcome of each write is recorded to, defaults to
+            the module-wide stats (tagWriteStats)
+    '''
+    def __init__(self, reservedPadding=DEFAULT_RESERVED_PADDING, minPadding=DEFAULT_MIN_PADDING, stats=None):
+        if (reservedPadding < 0 or minPadding < 0):
+            raise ValueError("Values for 'reservedPadding' and 'minPadding' must not be negative")
+
+        self.reservedPadding = reservedPadding
+        self.minPadding = minPadding
+        self.stats = stats if (stats is not None) else tagWriteStats
+
+    def createPaddingDecision(self):
+        '''
+        Returns a new padding callback to pass to a single mutagen save.
+        '''
+        return TagWritePaddingDecision(self.reservedPadding, self.minPadding)
+
+    def recordWrite(self, formatName, paddingDecision):
+        '''
+        Records the outcome of a completed save that used the given padding callback.
+        '''
+        self.stats.recordWrite(formatName, paddingDecision.isFullRewrite())
+
+# Stats of all tag writes done with a policy that was not given its own stats object
+tagWriteStats = TagWriteStats()
+
+DEFAULT_TAG_WRITE_POLICY = TagWritePolicy()
@@ -0,0 +1,276 @@
+'''
+test.benchmark.tagsio_benchmark
+
+Benchmark of the tags I/O hot paths of mlu.tags.io (getTags, getProperties, setTags,
+setCustomTag, getEmbeddedArtwork), per audio format, on a synthetic library generated with
+test.helpers.audiogen. The throughput and latency percentiles of each operation are written to a
+JSON report, which can be compared with the report of a previous run (--compare) to find
+regressions between versions.
+
+Usage:
+    python test/benchmark/tagsio_benchmark.py --files-per-format 50 --tags-size large --artwork
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+
+import mutagen
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+from mlu.tags import io
+from test.helpers import audiogen
+
+BENCHMARK_OPERATIONS = ['getTags', 'getTagsOnly', 'getProperties', 'setTags', 'setCustomTag', 'getEmbeddedArtwork']
+LATENCY_PERCENTILES = [50, 90, 95, 99]
+
+# Ratio of the median latency of an operation to that of the baseline report (--compare) above
+# which the operation is reported as a regression
+REGRESSION_THRESHOLD_RATIO = 1.10
+
+def generateLibrary(libraryDir, audioFormats, filesPerFormat, tagsSize, withArtwork, durationSeconds):
+    '''
+    Generates the synthetic audio files of the benchmark library and returns a dict of audio
+    format to the list of filepaths.
+    '''
+    audioFilepaths = {}
+    for audioFormat in audioFormats:
+        formatDir = mypycommons.file.joinPaths(libraryDir, audioFormat)
+        os.makedirs(formatDir, exist_ok=True)
+
+        audioFilepaths[audioFormat] = []
+        for seed in range(filesPerFormat):
+            audioFilepath = mypycommons.file.joinPaths(formatDir, "track-{}.{}".format(seed, audioFormat))
+            audiogen.createSyntheticAudioFile(
+                audioFilepath,
+                audioFormat,
+                seed=seed,
+                durationSeconds=durationSeconds,
+                tagsSize=tagsSize,
+                withArtwork=withArtwork
+            )
+            audioFilepaths[audioFormat].append(audioFilepath)
+
+    return audioFilepaths
+
+def runOperation(operationName, audioFilepath, iteration):
+    '''
+    Runs a single benchmarked operation on the given file, with a new handler (so that each call
+    parses the file, as it would in a library scan). Field values are all decoded, since tags are
+    decoded lazily.
+    '''
+    handler = io.AudioFileMetadataHandler(audioFilepath)
+
+    if (operationName == 'getTags'):
+        handler.getTags().toDict()
+
+    elif (operationName == 'getTagsOnly'):
+        handler.getTags(tagsOnly=True).toDict()
+
+    elif (operationName == 'getProperties'):
+        handler.getProperties().toDict()
+
+    elif (operationName == 'setTags'):
+        tags = handler.getTags()
+        tags.playCount = str(iteration)
+        tags.dateLastPlayed = str(1600000000 + iteration)
+        handler.setTags(tags)
+
+    elif (operationName == 'setCustomTag'):
+        handler.setCustomTag('MLUBENCHMARK', str(iteration))
+
+    elif (operationName == 'getEmbeddedArtwork'):
+        with handler.getEmbeddedArtwork() as artworks:
+            for artwork in artworks:
+                artwork.length
+
+    else:
+        raise ValueError("Unknown benchmark operation '{}'".format(operationName))
+
+def getPercentile(sortedValues, percentile):
+    '''
+    Returns the given percentile (0-100) of the given sorted values, interpolating linearly
+    between the closest ranks.
+    '''
+    if (not sortedValues):
+        return None
+
+    rank = (len(sortedValues) - 1) * (percentile / 100.0)
+    lowerIndex = int(rank)
+    upperIndex = min(lowerIndex + 1, len(sortedValues) - 1)
+    return sortedValues[lowerIndex] + (sortedValues[upperIndex] - sortedValues[lowerIndex]) * (rank - lowerIndex)
+
+def getLatencySummary(latencies):
+    '''
+    Returns a dict summarizing the given latencies (seconds): the count, total time, throughput
+    (operations per second) and the latency (ms) min, mean, max and percentiles.
+    '''
+    sortedLatencies = sorted(latencies)
+    totalSeconds = sum(sortedLatencies)
+    latencyMs = {
+        'min': sortedLatencies[0] * 1000,
+        'mean': (totalSeconds / len(sortedLatencies)) * 1000,
+        'max': sortedLatencies[-1] * 1000
+    }
+    for percentile in LATENCY_PERCENTILES:
+        latencyMs["p{}".format(percentile)] = getPercentile(sortedLatencies, percentile) * 1000
+
+    return {
+        'count': len(sortedLatencies),
+        'totalSeconds': totalSeconds,
+        'opsPerSecond': (len(sortedLatencies) / totalSeconds) if (totalSeconds > 0) else None,
+        'latencyMs': latencyMs
+    }
+
+def runBenchmark(audioFilepaths, operations, iterations, warmupIterations):
+    '''
+    Times each operation on each file of each format and returns a dict of audio format to
+    operation name to latency summary (see getLatencySummary()).
+    '''
+    results = {}
+    for audioFormat, formatFilepaths in audioFilepaths.items():
+        results[audioFormat] = {}
+
+        for operationName in operations:
+            for iteration in range(warmupIterations):
+                for audioFilepath in formatFilepaths:
+                    runOperation(operationName, audioFilepath, iteration)
+
+            latencies = []
+            for iteration in range(iterations):
+                for audioFilepath in formatFilepaths:
+                    startTime = time.perf_counter()
+                    runOperation(operationName, audioFilepath, iteration)
+                    latencies.append(time.perf_counter() - startTime)
+
+            results[audioFormat][operationName] = getLatencySummary(latencies)
+
+    return results
+
+def compareReports(report, baselineReport):
+    '''
+    Returns a list of comparison lines of the median latency of each operation in the given
+    report with that of the baseline report, flagging those that are slower than the regression
+    threshold.
+    '''
+    lines = []
+    for audioFormat, formatResults in report['results'].items():
+        for operationName, summary in formatResults.items():
+            baselineSummary = baselineReport['results'].get(audioFormat, {}).get(operationName)
+            if (baselineSummary is None):
+                continue
+
+            median = summary['latencyMs']['p50']
+            baselineMedian = baselineSummary['latencyMs']['p50']
+            ratio = (median / baselineMedian) if (baselineMedian) else None
+            flag = "  REGRESSION" if (ratio is not None and ratio > REGRESSION_THRESHOLD_RATIO) else ""
+            lines.append("{:5} {:20} p50 {:9.3f} ms (baseline {:9.3f} ms, x{}){}".format(
+                audioFormat, operationName, median, baselineMedian, "{:.2f}".format(ratio) if (ratio is not None) else "?", flag
+            ))
+
+    return lines
+
+def getGitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=projectRoot, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def getMluVersion():
+    versionFilepath = mypycommons.file.joinPaths(projectRoot, 'VERSION.txt')
+    if (not os.path.isfile(versionFilepath)):
+        return None
+
+    with open(versionFilepath, 'r') as versionFile:
+        return versionFile.read().strip()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the MLU tags I/O hot paths")
+    parser.add_argument('--formats', default=','.join(audiogen.SYNTHETIC_AUDIO_FORMATS), help="comma separated audio formats")
+    parser.add_argument('--files-per-format', type=int, default=20)
+    parser.add_argument('--tags-size', choices=[audiogen.TAGS_SIZE_SMALL, audiogen.TAGS_SIZE_LARGE], default=audiogen.TAGS_SIZE_SMALL)
+    parser.add_argument('--artwork', action='store_true', help="embed a cover picture in the files")
+    parser.add_argument('--duration', type=int, default=30, help="duration (seconds) of the synthetic files")
+    parser.add_argument('--operations', default=','.join(BENCHMARK_OPERATIONS), help="comma separated operations")
+    parser.add_argument('--iterations', type=int, default=3, help="timed runs over each file")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed runs over each file")
+    parser.add_argument('--output', default=None, help="filepath of the JSON report")
+    parser.add_argument('--compare', default=None, help="filepath of a previous JSON report to compare with")
+    args = parser.parse_args()
+
+    audioFormats = [audioFormat.strip() for audioFormat in args.formats.split(',') if (audioFormat.strip())]
+    operations = [operationName.strip() for operationName in args.operations.split(',') if (operationName.strip())]
+    for operationName in operations:
+        if (operationName not in BENCHMARK_OPERATIONS):
+            raise ValueError("Unknown benchmark operation '{}'".format(operationName))
+
+    libraryDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'benchmark-library')
+    if (os.path.exists(libraryDir)):
+        shutil.rmtree(libraryDir)
+
+    try:
+        print("Generating {} files per format ({})...".format(args.files_per_format, ', '.join(audioFormats)))
+        audioFilepaths = generateLibrary(libraryDir, audioFormats, args.files_per_format, args.tags_size, args.artwork, args.duration)
+
+        print("Running benchmark...")
+        results = runBenchmark(audioFilepaths, operations, args.iterations, args.warmup)
+    finally:
+        shutil.rmtree(libraryDir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.time(),
+        'mluVersion': getMluVersion(),
+        'gitRevision': getGitRevision(),
+        'python': platform.python_version(),
+        'mutagen': mutagen.version_string,
+        'platform': platform.platform(),
+        'config': {
+            'formats': audioFormats,
+            'filesPerFormat': args.files_per_format,
+            'tagsSize': args.tags_size,
+            'artwork': args.artwork,
+            'durationSeconds': args.duration,
+            'operations': operations,
+            'iterations': args.iterations,
+            'warmupIterations': args.warmup
+        },
+        'results': results
+    }
+
+    outputFilepath = args.output
+    if (outputFilepath is None):
+        outputFilepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.cacheDir), "benchmark-tagsio-{}.json".format(int(report['timestamp'])))
+
+    with open(outputFilepath, 'w') as outputFile:
+        json.dump(report, outputFile, indent=2)
+
+    for audioFormat, formatResults in results.items():
+        for operationName, summary in formatResults.items():
+            print("{:5} {:20} {:9.1f} ops/s  p50 {:8.3f} ms  p99 {:8.3f} ms".format(
+                audioFormat, operationName, summary['opsPerSecond'] or 0, summary['latencyMs']['p50'], summary['latencyMs']['p99']
+            ))
+
+    if (args.compare is not None):
+        with open(args.compare, 'r') as baselineFile:
+            baselineReport = json.load(baselineFile)
+
+        print("Compared with '{}':".format(args.compare))
+        for line in compareReports(report, baselineReport):
+            print(line)
+
+    print("Report written to '{}'".format(outputFilepath))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+test.helpers.audiogen
+
+This module contains functions for generating synthetic audio files (FLAC, MP3, M4A, Opus) for
+tests and benchmarks. The files have valid containers and headers, so they can be read and tagged
+like real files, but their audio payload is random bytes (it can't be played). The files are
+deterministic for the same arguments.
+'''
+
+import io
+import base64
+import random
+import struct
+
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TPE2, TCOM, TDRC, TCON, TRCK, TPOS, COMM, TXXX, APIC
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+from mutagen.oggopus import OggOpus
+from mutagen.ogg import OggPage
+from PIL import Image
+
+SYNTHETIC_AUDIO_FORMATS = ['flac', 'mp3', 'm4a', 'opus']
+
+TAGS_SIZE_SMALL = 'small'
+TAGS_SIZE_LARGE = 'large'
+
+# Number of custom tags and the length (characters) of the lyrics of a file with large tags
+LARGE_TAGS_CUSTOM_TAG_COUNT = 40
+LARGE_TAGS_LYRICS_LENGTH = 8000
+
+SAMPLE_RATE = 44100
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo, no CRC: each frame is 417 bytes, 1152 samples
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x64'
+MP3_FRAME_SIZE = 417
+MP3_FRAME_SAMPLES = 1152
+
+_artworkCache = {}
+
+def createSyntheticAudioFile(filepath, audioFormat, seed=0, durationSeconds=30, tagsSize=TAGS_SIZE_SMALL, withArtwork=False, artworkSize=500):
+    '''
+    Writes a synthetic audio file of the given format (one of SYNTHETIC_AUDIO_FORMATS) to the
+    given filepath, with tags (whose values depend on the seed) and optionally a front cover
+    picture (a JPEG of artworkSize x artworkSize pixels, the same for all files with this size).
+    The audio payload size is about that of a 128 kbps file of the given duration.
+    '''
+    randomGen = random.Random("{}-{}".format(audioFormat, seed))
+    payloadSize = (128000 // 8) * durationSeconds
+    artworkData = getSyntheticArtwork(artworkSize) if (withArtwork) else None
+    tagValues = getSyntheticTagValues(seed, tagsSize)
+
+    if (audioFormat == 'flac'):
+        _createFlacFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData)
+    elif (audioFormat == 'mp3'):
+        _createMp3File(filepath, randomGen, payloadSize, tagValues, artworkData)
+    elif (audioFormat == 'm4a'):
+        _createM4aFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData)
+    elif (audioFormat == 'opus'):
+        _createOpusFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData)
+    else:
+        raise ValueError("Unsupported synthetic audio format '{}'".format(audioFormat))
+
+def getSyntheticTagValues(seed, tagsSize=TAGS_SIZE_SMALL):
+    '''
+    Returns a dict of the tag values written to a synthetic audio file with the given seed: keys
+    are the names of the fields of mlu.tags.values.AudioFileTags, plus 'customTags' (a dict of
+    custom tag name to value).
+    '''
+    randomGen = random.Random(seed)
+    tagValues = {
+        'title': "Track {}".format(seed),
+        'artist': "Artist {}".format(seed % 50),
+        'album': "Album {}".format(seed % 200),
+        'albumArtist': "Artist {}".format(seed % 50),
+        'composer': "Composer {}".format(seed % 30),
+        'date': str(1960 + (seed % 60)),
+        'genre': randomGen.choice(['Rock', 'Jazz', 'Electronic', 'Classical', 'Hip-Hop']),
+        'trackNumber': str((seed % 12) + 1),
+        'totalTracks': '12',
+        'discNumber': '1',
+        'totalDiscs': '1',
+        'lyrics': '',
+        'comment': '',
+        'customTags': {}
+    }
+
+    if (tagsSize == TAGS_SIZE_LARGE):
+        words = ['love', 'night', 'light', 'road', 'heart', 'fire', 'rain', 'time', 'home', 'dream']
+        lyrics = []
+        while (sum(len(word) + 1 for word in lyrics) < LARGE_TAGS_LYRICS_LENGTH):
+            lyrics.append(randomGen.choice(words))
+
+        tagValues['lyrics'] = ' '.join(lyrics)
+        tagValues['comment'] = "Synthetic comment {} ".format(seed) * 50
+        tagValues['customTags'] = {
+            "CUSTOM{}".format(i): "value {} {}".format(i, randomGen.getrandbits(64)) for i in range(LARGE_TAGS_CUSTOM_TAG_COUNT)
+        }
+
+    elif (tagsSize != TAGS_SIZE_SMALL):
+        raise ValueError("Unsupported synthetic tags size '{}'".format(tagsSize))
+
+    return tagValues
+
+def getSyntheticArtwork(artworkSize=500):
+    '''
+    Returns the JPEG data of a synthetic cover picture of the given size (pixels).
+    '''
+    if (artworkSize not in _artworkCache):
+        image = Image.new('RGB', (artworkSize, artworkSize))
+        image.putdata([((x * 255) // artworkSize, (y * 255) // artworkSize, ((x + y) * 7) % 256) for y in range(artworkSize) for x in range(artworkSize)])
+        imageData = io.BytesIO()
+        image.save(imageData, format='JPEG', quality=90)
+        _artworkCache[artworkSize] = imageData.getvalue()
+
+    return _artworkCache[artworkSize]
+
+def _getRandomBytes(randomGen, size):
+    return randomGen.getrandbits(size * 8).to_bytes(size, 'little') if (size > 0) else b''
+
+def _getVorbisCommentValues(tagValues):
+    vorbisValues = {
+        'TITLE': tagValues['title'],
+        'ARTIST': tagValues['artist'],
+        'ALBUM': tagValues['album'],
+        'ALBUMARTIST': tagValues['albumArtist'],
+        'COMPOSER': tagValues['composer'],
+        'DATE': tagValues['date'],
+        'GENRE': tagValues['genre'],
+        'TRACKNUMBER': tagValues['trackNumber'],
+        'TRACKTOTAL': tagValues['totalTracks'],
+        'DISCNUMBER': tagValues['discNumber'],
+        'DISCTOTAL': tagValues['totalDiscs']
+    }
+    if (tagValues['lyrics']):
+        vorbisValues['LYRICS'] = tagValues['lyrics']
+    if (tagValues['comment']):
+        vorbisValues['COMMENT'] = tagValues['comment']
+    vorbisValues.update(tagValues['customTags'])
+
+    return vorbisValues
+
+def _getFlacPicture(artworkData):
+    picture = Picture()
+    picture.type = 3
+    picture.mime = 'image/jpeg'
+    picture.desc = 'Cover'
+    picture.data = artworkData
+    return picture
+
+def _createFlacFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData):
+    # STREAMINFO only (last metadata block): block sizes, frame sizes (unknown), sample rate,
+    # channels, bits per sample, total samples, MD5 (unset)
+    streamInfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6
+    streamInfo += struct.pack('>Q', (SAMPLE_RATE << 44) | (1 << 41) | (15 << 36) | (SAMPLE_RATE * durationSeconds))
+    streamInfo += b'\x00' * 16
+    with open(filepath, 'wb') as audioFile:
+        audioFile.write(b'fLaC' + struct.pack('>I', (0x80 << 24) | len(streamInfo)) + streamInfo)
+        audioFile.write(b'\xff\xf8' + _getRandomBytes(randomGen, payloadSize - 2))
+
+    audioFile = FLAC(filepath)
+    audioFile.add_tags()
+    for key, value in _getVorbisCommentValues(tagValues).items():
+        audioFile.tags[key] = value
+    if (artworkData is not None):
+        audioFile.add_picture(_getFlacPicture(artworkData))
+    audioFile.save()
+
+def _createMp3File(filepath, randomGen, payloadSize, tagValues, artworkData):
+    with open(filepath, 'wb') as audioFile:
+        for frameIndex in range(max(payloadSize // MP3_FRAME_SIZE, 1)):
+            audioFile.write(MP3_FRAME_HEADER + _getRandomBytes(randomGen, MP3_FRAME_SIZE - 4))
+
+    id3 = ID3()
+    id3.add(TIT2(encoding=3, text=tagValues['title']))
+    id3.add(TPE1(encoding=3, text=tagValues['artist']))
+    id3.add(TALB(encoding=3, text=tagValues['album']))
+    id3.add(TPE2(encoding=3, text=tagValues['albumArtist']))
+    id3.add(TCOM(encoding=3, text=tagValues['composer']))
+    id3.add(TDRC(encoding=3, text=tagValues['date']))
+    id3.add(TCON(encoding=3, text=tagValues['genre']))
+    id3.add(TRCK(encoding=3, text="{}/{}".format(tagValues['trackNumber'], tagValues['totalTracks'])))
+    id3.add(TPOS(encoding=3, text="{}/{}".format(tagValues['discNumber'], tagValues['totalDiscs'])))
+    if (tagValues['lyrics']):
+        id3.add(TXXX(encoding=3, desc='LYRICS', text=tagValues['lyrics']))
+    if (tagValues['comment']):
+        id3.add(COMM(encoding=3, lang='eng', desc='', text=tagValues['comment']))
+    for tagName, value in tagValues['customTags'].items():
+        id3.add(TXXX(encoding=3, desc=tagName, text=value))
+    if (artworkData is not None):
+        id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=artworkData))
+
+    id3.save(filepath)
+
+def _getMp4Atom(name, payload):
+    return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+def _getMp4FullAtom(name, payload):
+    return _getMp4Atom(name, b'\x00\x00\x00\x00' + payload)
+
+def _createM4aFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData):
+    # Minimal AAC-in-MP4 layout: ftyp, moov (mvhd + one sound track with an mp4a sample entry),
+    # mdat
+    sampleCount = SAMPLE_RATE * durationSeconds
+    ftyp = _getMp4Atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom')
+    mvhd = _getMp4FullAtom(b'mvhd', struct.pack('>IIII', 0, 0, SAMPLE_RATE, sampleCount) + b'\x00' * 80)
+    mdhd = _getMp4FullAtom(b'mdhd', struct.pack('>IIIIHH', 0, 0, SAMPLE_RATE, sampleCount, 0x55c4, 0))
+    hdlr = _getMp4FullAtom(b'hdlr', b'\x00' * 4 + b'soun' + b'\x00' * 13)
+    esds = _getMp4FullAtom(b'esds', b'\x03\x19\x00\x00\x00\x04\x11\x40\x15\x00\x00\x00\x00\x01\xf4\x00\x00\x01\xf4\x00\x05\x02\x12\x10\x06\x01\x02')
+    mp4a = _getMp4Atom(b'mp4a', b'\x00' * 6 + struct.pack('>H', 1) + b'\x00' * 8 + struct.pack('>HHHHI', 2, 16, 0, 0, SAMPLE_RATE << 16) + esds)
+    stsd = _getMp4FullAtom(b'stsd', struct.pack('>I', 1) + mp4a)
+    trak = _getMp4Atom(b'trak', _getMp4Atom(b'mdia', mdhd + hdlr + _getMp4Atom(b'minf', _getMp4Atom(b'stbl', stsd))))
+    moov = _getMp4Atom(b'moov', mvhd + trak)
+    mdat = _getMp4Atom(b'mdat', _getRandomBytes(randomGen, payloadSize))
+    with open(filepath, 'wb') as audioFile:
+        audioFile.write(ftyp + moov + mdat)
+
+    audioFile = MP4(filepath)
+    audioFile.add_tags()
+    audioFile.tags['\xa9nam'] = tagValues['title']
+    audioFile.tags['\xa9ART'] = tagValues['artist']
+    audioFile.tags['\xa9alb'] = tagValues['album']
+    audioFile.tags['aART'] = tagValues['albumArtist']
+    audioFile.tags['\xa9wrt'] = tagValues['composer']
+    audioFile.tags['\xa9day'] = tagValues['date']
+    audioFile.tags['\xa9gen'] = tagValues['genre']
+    audioFile.tags['trkn'] = [(int(tagValues['trackNumber']), int(tagValues['totalTracks']))]
+    audioFile.tags['disk'] = [(int(tagValues['discNumber']), int(tagValues['totalDiscs']))]
+    if (tagValues['lyrics']):
+        audioFile.tags['\xa9lyr'] = tagValues['lyrics']
+    if (tagValues['comment']):
+        audioFile.tags['\xa9cmt'] = tagValues['comment']
+    for tagName, value in tagValues['customTags'].items():
+        audioFile.tags["----:com.apple.iTunes:{}".format(tagName)] = [MP4FreeForm(value.encode('utf-8'))]
+    if (artworkData is not None):
+        audioFile.tags['covr'] = [MP4Cover(artworkData, imageformat=MP4Cover.FORMAT_JPEG)]
+    audioFile.save()
+
+def _createOpusFile(filepath, randomGen, payloadSize, durationSeconds, tagValues, artworkData):
+    preSkip = 312
+    serial = 1
+    headPage = OggPage()
+    headPage.packets = [b'OpusHead' + struct.pack('<BBHIhB', 1, 2, preSkip, 48000, 0, 0)]
+    headPage.serial = serial
+    headPage.sequence = 0
+    headPage.first = True
+    headPage.position = 0
+
+    tagsPage = OggPage()
+    tagsPage.packets = [b'OpusTags' + struct.pack('<I', 3) + b'mlu' + struct.pack('<I', 0)]
+    tagsPage.serial = serial
+    tagsPage.sequence = 1
+    tagsPage.position = 0
+
+    # Audio pages of up to 255 packets of 255 bytes each (a single byte of lacing per packet)
+    pages = [headPage, tagsPage]
+    packetSize = 255
+    packetCount = max(payloadSize // packetSize, 1)
+    pageCount = (packetCount + 254) // 255
+    for pageIndex in range(pageCount):
+        page = OggPage()
+        pagePacketCount = min(255, packetCount - pageIndex * 255)
+        page.packets = [b'\xfc' + _getRandomBytes(randomGen, packetSize - 2) for i in range(pagePacketCount)]
+        page.serial = serial
+        page.sequence = 2 + pageIndex
+        page.position = preSkip + (48000 * durationSeconds * (pageIndex + 1)) // pageCount
+        page.last = (pageIndex == pageCount - 1)
+        pages.append(page)
+
+    with open(filepath, 'wb') as audioFile:
+        for page in pages:
+            audioFile.write(page.write())
+
+    audioFile = OggOpus(filepath)
+    for key, value in _getVorbisCommentValues(tagValues).items():
+        audioFile.tags[key] = value
+    if (artworkData is not None):
+        audioFile.tags['METADATA_BLOCK_PICTURE'] = base64.b64encode(_getFlacPicture(artworkData).write()).decode('ascii')
+    audioFile.save()
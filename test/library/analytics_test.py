@@ -0,0 +1,72 @@
+'''
+Tests for mlu.library.analytics
+
+'''
+
+import unittest
+import sys
+import os
+import math
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+import mlu.library.analytics
+import mlu.tags.values
+
+def getTestProperties(duration, bitRate, sampleRate, bitDepth):
+    return mlu.tags.values.AudioFileProperties(
+        fileSize=1000,
+        fileDateModified='',
+        duration=duration,
+        format='FLAC',
+        bitRate=bitRate,
+        sampleRate=sampleRate,
+        numChannels=2,
+        replayGain={},
+        bitDepth=bitDepth,
+        encoder='',
+        bitRateMode='',
+        codec=''
+    )
+
+class TestLibraryAnalyticsModule(unittest.TestCase):
+    def setUp(self):
+        self.propertiesArray = mlu.library.analytics.getPropertiesArray([
+            getTestProperties(100.0, 900, 44100, 16),
+            getTestProperties(200.0, 1100, 44100, 24),
+            getTestProperties(300.5, 320, 48000, '')
+        ])
+
+    def test_getPropertiesArray(self):
+        '''
+        Tests that the numeric properties are exported, with missing values as NaN.
+        '''
+        self.assertEqual(3, len(self.propertiesArray))
+        self.assertEqual(44100, self.propertiesArray['sampleRate'][0])
+        self.assertTrue(math.isnan(self.propertiesArray['bitDepth'][2]))
+
+        columns = mlu.library.analytics.getPropertiesColumns(self.propertiesArray)
+        self.assertEqual(mlu.library.analytics.NUMERIC_PROPERTY_FIELDS, list(columns))
+
+    def test_Aggregates(self):
+        '''
+        Tests the aggregate helpers, which leave out the missing values.
+        '''
+        self.assertEqual(600.5, mlu.library.analytics.getTotalDuration(self.propertiesArray))
+        self.assertEqual(3000, mlu.library.analytics.getTotalFileSize(self.propertiesArray))
+        self.assertEqual({44100: 2, 48000: 1}, mlu.library.analytics.getValueCounts(self.propertiesArray, 'sampleRate'))
+        self.assertEqual({16: 1, 24: 1}, mlu.library.analytics.getValueCounts(self.propertiesArray, 'bitDepth'))
+
+        bitDepthSummary = mlu.library.analytics.getFieldSummary(self.propertiesArray, 'bitDepth')
+        self.assertEqual(2, bitDepthSummary['count'])
+        self.assertEqual(20, bitDepthSummary['mean'])
+
+        counts, binEdges = mlu.library.analytics.getHistogram(self.propertiesArray, 'bitRate', bins=[0, 500, 1000, 1500])
+        self.assertEqual([1, 1, 1], list(counts))
+        self.assertEqual(900, mlu.library.analytics.getPercentiles(self.propertiesArray, 'bitRate', percentiles=[50])[50])
+
+if __name__ == '__main__':
+    unittest.main()
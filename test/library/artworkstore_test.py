@@ -0,0 +1,103 @@
+'''
+Tests for mlu.library.artworkstore
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+from PIL import Image
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.artworkstore
+import mlu.tags.io
+from test.helpers import audiogen
+
+class TestLibraryArtworkStoreModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies a test FLAC file to the mlu temp dir, twice (as two tracks with the same artwork).
+        '''
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-artworkstore')
+        mypycommons.file.createDirectory(self.tempTestDir)
+
+        testAudioFile = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', 'test-1.flac')
+        self.audioFilepaths = []
+        for i in range(2):
+            audioFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'track-{}.flac'.format(i))
+            shutil.copyfile(testAudioFile, audioFilepath)
+            self.audioFilepaths.append(audioFilepath)
+
+        self.storeDir = mypycommons.file.joinPaths(self.tempTestDir, 'store')
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_ArtworkStore_Dedup(self):
+        '''
+        Tests that the same picture embedded in different files is stored once, with the same data.
+        '''
+        with mlu.library.artworkstore.ArtworkStore(storeDir=self.storeDir) as store:
+            hashes = [store.getAudioFileArtworkHashes(audioFilepath) for audioFilepath in self.audioFilepaths]
+            self.assertTrue(hashes[0])
+            self.assertEqual(hashes[0], hashes[1])
+
+            with mlu.tags.io.AudioFileMetadataHandler(self.audioFilepaths[0]).getEmbeddedArtwork() as artworks:
+                expectedData = [artwork.getBytes() for artwork in artworks]
+
+            for artworkHash, data in zip(hashes[0], expectedData):
+                with open(store.getImagePath(artworkHash), 'rb') as imageFile:
+                    self.assertEqual(data, imageFile.read())
+
+            self.assertEqual(sum(len(data) for data in set(expectedData)), store.getTotalSize())
+
+    def test_ArtworkStore_ThumbnailAndEviction(self):
+        '''
+        Tests that thumbnails fit in the requested size and that the least recently used entries
+        are evicted once the store is over its size limit.
+        '''
+        with mlu.library.artworkstore.ArtworkStore(storeDir=self.storeDir) as store:
+            artworkHash = store.getAudioFileArtworkHashes(self.audioFilepaths[0])[0]
+            thumbnailPath = store.getThumbnailPath(artworkHash, 64)
+            with Image.open(thumbnailPath) as thumbnail:
+                self.assertLessEqual(max(thumbnail.size), 64)
+
+            self.assertEqual(thumbnailPath, store.getThumbnailPath(artworkHash, 64))
+            self.assertIsNone(store.getThumbnailPath('0' * 64, 64))
+
+            store.maxSizeBytes = 0
+            self.assertGreater(store.evict(), 0)
+            self.assertEqual(0, store.getTotalSize())
+            self.assertIsNone(store.getImagePath(artworkHash))
+            self.assertFalse(os.path.exists(thumbnailPath))
+
+    def test_ArtworkStore_EvictionKeepsReturnedImages(self):
+        '''
+        Tests that the images returned for a file are kept when the store is over its limit, and
+        that the least recently used other images are evicted instead.
+        '''
+        otherAudioFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'other.flac')
+        audiogen.createSyntheticAudioFile(otherAudioFilepath, 'flac', durationSeconds=1, withArtwork=True)
+
+        with mlu.library.artworkstore.ArtworkStore(storeDir=self.storeDir, maxSizeBytes=1) as store:
+            otherHash = store.getAudioFileArtworkHashes(otherAudioFilepath)[0]
+            self.assertIsNotNone(store.getImagePath(otherHash))
+
+            for audioFilepath in self.audioFilepaths:
+                artworkHashes = store.getAudioFileArtworkHashes(audioFilepath)
+                self.assertTrue(artworkHashes)
+                for artworkHash in artworkHashes:
+                    self.assertIsNotNone(store.getImagePath(artworkHash))
+
+            self.assertIsNone(store.getImagePath(otherHash))
+
+if __name__ == '__main__':
+    unittest.main()
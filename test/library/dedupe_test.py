@@ -0,0 +1,82 @@
+'''
+Tests for mlu.library.dedupe
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.dedupe
+import mlu.tags.payload
+import mlu.library.scan
+import mlu.tags.io
+from test.helpers import audiogen
+
+class TestLibraryDedupeModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Creates synthetic audio files of each format in the mlu temp dir: a track, the same track
+        with other (larger) tags and artwork, and another recording with the same artist and title.
+        '''
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-dedupe')
+        mypycommons.file.createDirectory(self.tempTestDir)
+
+        self.audioFilepathsByFormat = {}
+        for audioFormat in audiogen.SYNTHETIC_AUDIO_FORMATS:
+            audioFilepaths = [mypycommons.file.joinPaths(self.tempTestDir, '{}.{}'.format(name, audioFormat)) for name in ['track', 'retagged', 'other']]
+            audiogen.createSyntheticAudioFile(audioFilepaths[0], audioFormat, seed=1, durationSeconds=5)
+            audiogen.createSyntheticAudioFile(audioFilepaths[1], audioFormat, seed=1, durationSeconds=5, tagsSize=audiogen.TAGS_SIZE_LARGE, withArtwork=True)
+            audiogen.createSyntheticAudioFile(audioFilepaths[2], audioFormat, seed=101, durationSeconds=5)
+            with mlu.tags.io.AudioFileMetadataHandler(audioFilepaths[2]).createWriteBatch() as writeBatch:
+                writeBatch.setTag('title', 'TRACK 1 (Remastered)')
+
+            self.audioFilepathsByFormat[audioFormat] = audioFilepaths
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_getAudioPayloadHash(self):
+        '''
+        Tests that the payload hash ignores the tags, but not the audio.
+        '''
+        for audioFormat, audioFilepaths in self.audioFilepathsByFormat.items():
+            payloadHashes = [mlu.tags.payload.getAudioPayloadHash(audioFilepath) for audioFilepath in audioFilepaths]
+            self.assertEqual(payloadHashes[0], payloadHashes[1], audioFormat)
+            self.assertNotEqual(payloadHashes[0], payloadHashes[2], audioFormat)
+
+    def test_findDuplicates(self):
+        '''
+        Tests that the retagged copies are found as exact duplicates, and the other recordings as
+        possible duplicates.
+        '''
+        entries = []
+        for audioFilepaths in self.audioFilepathsByFormat.values():
+            for audioFilepath in audioFilepaths:
+                scanResult = mlu.library.scan.readAudioFile(audioFilepath)
+                self.assertTrue(scanResult.succeeded(), scanResult.error)
+                entries.append((audioFilepath, scanResult.tags, scanResult.properties))
+
+        report = mlu.library.dedupe.findDuplicates(entries, workers=2)
+
+        self.assertEqual(12, report.filesConsidered)
+        self.assertEqual({}, report.errors)
+        self.assertCountEqual(
+            [sorted(audioFilepaths[:2]) for audioFilepaths in self.audioFilepathsByFormat.values()],
+            [group.audioFilepaths for group in report.exactGroups]
+        )
+        self.assertEqual(4, report.getDuplicateFileCount())
+        self.assertTrue(report.possibleGroups)
+        for group in report.possibleGroups:
+            self.assertFalse(group.isExact())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''
+Tests for mlu.library.fingerprint
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.fingerprint
+import mlu.tags.io
+from test.helpers import audiogen
+
+class TestLibraryFingerprintModule(unittest.TestCase):
+    def setUp(self):
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-fingerprint')
+        mypycommons.file.createDirectory(self.tempTestDir)
+
+        self.audioFilepaths = []
+        for audioFormat in audiogen.SYNTHETIC_AUDIO_FORMATS:
+            audioFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'track.{}'.format(audioFormat))
+            audiogen.createSyntheticAudioFile(audioFilepath, audioFormat, seed=1, durationSeconds=5)
+            self.audioFilepaths.append(os.path.abspath(audioFilepath))
+
+        self.fingerprintCache = mlu.library.fingerprint.AudioPayloadFingerprintCache(
+            mypycommons.file.joinPaths(self.tempTestDir, 'fingerprints.sqlite')
+        )
+
+    def tearDown(self):
+        self.fingerprintCache.close()
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_classifyChanges(self):
+        '''
+        Tests that retagged files are classified as tags-only changes, and files with new audio as
+        audio changes.
+        '''
+        fingerprintCache = self.fingerprintCache
+        fingerprint = mlu.library.fingerprint
+
+        changeKinds = fingerprintCache.classifyChanges(self.audioFilepaths, workers=2)
+        self.assertEqual({audioFilepath: fingerprint.CHANGE_NEW for audioFilepath in self.audioFilepaths}, changeKinds)
+
+        changeKinds = fingerprintCache.classifyChanges(self.audioFilepaths, workers=2)
+        self.assertEqual({audioFilepath: fingerprint.CHANGE_UNCHANGED for audioFilepath in self.audioFilepaths}, changeKinds)
+
+        for audioFilepath in self.audioFilepaths:
+            with mlu.tags.io.AudioFileMetadataHandler(audioFilepath).createWriteBatch() as writeBatch:
+                writeBatch.setTag('playCount', '12')
+                writeBatch.setTag('comment', 'x' * 10000)
+
+        changeKinds = fingerprintCache.classifyChanges(self.audioFilepaths, workers=2)
+        self.assertEqual({audioFilepath: fingerprint.CHANGE_TAGS_ONLY for audioFilepath in self.audioFilepaths}, changeKinds)
+
+        for audioFormat, audioFilepath in zip(audiogen.SYNTHETIC_AUDIO_FORMATS, self.audioFilepaths):
+            audiogen.createSyntheticAudioFile(audioFilepath, audioFormat, seed=2, durationSeconds=5)
+            self.assertEqual(fingerprint.CHANGE_AUDIO, fingerprintCache.classifyChange(audioFilepath), audioFormat)
+
+    def test_recordTagsOnlyWrite(self):
+        '''
+        Tests that a file recorded after a tag write by MLU is not seen as changed.
+        '''
+        audioFilepath = self.audioFilepaths[0]
+        payloadHash = self.fingerprintCache.getPayloadHash(audioFilepath)
+
+        with mlu.tags.io.AudioFileMetadataHandler(audioFilepath).createWriteBatch() as writeBatch:
+            writeBatch.setTag('playCount', '3')
+        self.fingerprintCache.recordTagsOnlyWrite(audioFilepath)
+
+        self.assertEqual(mlu.library.fingerprint.CHANGE_UNCHANGED, self.fingerprintCache.classifyChange(audioFilepath))
+        self.assertEqual(payloadHash, self.fingerprintCache.getPayloadHash(audioFilepath))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+'''
+Tests for mlu.library.index
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.index
+import mlu.tags.io
+
+class TestLibraryIndexModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Sets up a test library in the mlu temp dir with a copy of each test audio file, and a new
+        index file for it.
+        '''
+        testAudioFilesDir = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files')
+        self.libraryDir = os.path.abspath(mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-library'))
+        mypycommons.file.createDirectory(self.libraryDir)
+
+        self.audioFilepaths = []
+        testAudioFilesSrc = mypycommons.file.getChildPathsRecursive(rootDirPath=testAudioFilesDir, pathType='file')
+        for testAudioFile in testAudioFilesSrc:
+            mypycommons.file.copyToDirectory(path=testAudioFile, destDir=self.libraryDir)
+            self.audioFilepaths.append(mypycommons.file.joinPaths(self.libraryDir, os.path.basename(testAudioFile)))
+
+        indexFilepath = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-index.sqlite')
+        self.index = mlu.library.index.AudioFileIndex(indexFilepath)
+
+    def tearDown(self):
+        self.index.close()
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_AudioFileIndex_Update(self):
+        '''
+        Tests that the index stores the tags/properties of new files, and that later updates only
+        read the changed files and drop the deleted ones.
+        '''
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(len(self.audioFilepaths), summary.added)
+
+        for audioFilepath in self.audioFilepaths:
+            handler = mlu.tags.io.AudioFileMetadataHandler(audioFilepath)
+            self.assertTrue(handler.getTags().equals(self.index.getTags(audioFilepath)))
+            self.assertEqual(handler.getProperties().duration, self.index.getProperties(audioFilepath).duration)
+
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(len(self.audioFilepaths), summary.unchanged)
+        self.assertEqual(0, summary.added + summary.updated + summary.removed)
+
+        changedFilepath = self.audioFilepaths[0]
+        mlu.tags.io.AudioFileMetadataHandler(changedFilepath).setCustomTag('indextest', 'changed')
+        deletedFilepath = self.audioFilepaths[1]
+        mypycommons.file.deletePath(deletedFilepath)
+
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(1, summary.updated)
+        self.assertEqual(1, summary.removed)
+        self.assertEqual('changed', self.index.getTags(changedFilepath).OTHER_TAGS['indextest'])
+        self.assertIsNone(self.index.getTags(deletedFilepath))
+
+    def test_AudioFileIndex_FailedFiles(self):
+        '''
+        Tests that a file that can't be read is recorded as failed and is not read again until it
+        changes.
+        '''
+        brokenFilepath = mypycommons.file.joinPaths(self.libraryDir, 'broken.flac')
+        with open(brokenFilepath, 'wb') as brokenFile:
+            brokenFile.write(b'this is not a flac file')
+
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(1, summary.failed)
+        self.assertIn(brokenFilepath, self.index.getFailedAudioFiles())
+
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(0, summary.failed)
+        self.assertEqual(len(self.audioFilepaths) + 1, summary.unchanged)
+
+    def test_AudioFileIndex_Update_RootDirCase(self):
+        '''
+        Tests that updating a root dir doesn't touch the entries of another root dir whose name only
+        differs in case.
+        '''
+        otherLibraryDir = os.path.join(os.path.dirname(self.libraryDir), os.path.basename(self.libraryDir).upper())
+        mypycommons.file.createDirectory(otherLibraryDir)
+        mypycommons.file.copyToDirectory(path=self.audioFilepaths[0], destDir=otherLibraryDir)
+        otherAudioFilepath = mypycommons.file.joinPaths(otherLibraryDir, os.path.basename(self.audioFilepaths[0]))
+
+        self.index.update(self.libraryDir, workers=1)
+        summary = self.index.update(otherLibraryDir, workers=1)
+        self.assertEqual(1, summary.added)
+        self.assertEqual(0, summary.removed)
+
+        summary = self.index.update(self.libraryDir, workers=1)
+        self.assertEqual(len(self.audioFilepaths), summary.unchanged)
+        self.assertEqual(0, summary.removed)
+        self.assertIsNotNone(self.index.getTags(otherAudioFilepath))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+'''
+Tests for mlu.library.playstats
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+import threading
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+import com.nwrobel.mypycommons.time
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.playstats
+import mlu.tags.io
+
+class TestLibraryPlayStatsModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies a test FLAC file to the mlu temp dir and gives it some playback stats.
+        '''
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-playstats')
+        mypycommons.file.createDirectory(self.tempTestDir)
+
+        self.audioFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'track.flac')
+        shutil.copyfile(mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', 'test-1.flac'), self.audioFilepath)
+        with mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).createWriteBatch() as writeBatch:
+            writeBatch.setTag('playCount', '2')
+            writeBatch.setTag('dateAllPlays', '2020-01-01 10:00:00;2020-01-02 10:00:00')
+            writeBatch.setTag('dateLastPlayed', '2020-01-02 10:00:00')
+
+        self.journalFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'journal.jsonl')
+        self.playTimestamps = [1700000000 + (i * 600) for i in range(5)]
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_PlayStatsJournal_Flush(self):
+        '''
+        Tests that the plays of a file are applied with a single write, on top of its current stats.
+        '''
+        with mlu.library.playstats.PlayStatsJournal(self.journalFilepath) as journal:
+            for timestamp in self.playTimestamps:
+                journal.recordPlay(self.audioFilepath, timestamp)
+
+            self.assertEqual({os.path.abspath(self.audioFilepath): 5}, journal.getPendingPlayCounts())
+            summary = journal.flush()
+            self.assertEqual(1, summary.filesWritten)
+            self.assertEqual(5, summary.playsApplied)
+            self.assertEqual({}, journal.getPendingPlayCounts())
+
+        playDates = [mypycommons.time.formatTimestampForDisplay(timestamp) for timestamp in self.playTimestamps]
+        tags = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).getTags()
+        self.assertEqual('7', tags.playCount)
+        self.assertEqual(';'.join(['2020-01-01 10:00:00', '2020-01-02 10:00:00'] + playDates), tags.dateAllPlays)
+        self.assertEqual(playDates[-1], tags.dateLastPlayed)
+
+    def test_PlayStatsJournal_Replay(self):
+        '''
+        Tests that plays left in the journal are applied by the next process, and that plays already
+        written to the file (the process died before the journal was updated) are not counted twice.
+        '''
+        journal = mlu.library.playstats.PlayStatsJournal(self.journalFilepath)
+        for timestamp in self.playTimestamps[:3]:
+            journal.recordPlay(self.audioFilepath, timestamp)
+
+        # Die after the file is written, before the journal is rewritten
+        def crash():
+            raise RuntimeError("crash")
+        journal._rewriteJournal = crash
+        with self.assertRaises(RuntimeError):
+            journal.flush()
+        journal._journalFile.close()
+
+        with mlu.library.playstats.PlayStatsJournal(self.journalFilepath) as journal:
+            self.assertEqual({os.path.abspath(self.audioFilepath): 3}, journal.getPendingPlayCounts())
+            journal.recordPlay(self.audioFilepath, self.playTimestamps[3])
+            summary = journal.flush()
+            self.assertEqual(1, summary.playsApplied)
+            self.assertEqual(3, summary.playsSkipped)
+
+        tags = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).getTags()
+        self.assertEqual('6', tags.playCount)
+        self.assertEqual(6, len(tags.dateAllPlays.split(';')))
+        self.assertFalse(any(tagName.startswith('mlu_') for tagName in tags.OTHER_TAGS))
+
+    def test_PlayStatsJournal_RecordPlayDuringFlush(self):
+        '''
+        Tests that a play can be recorded while the files are being written by a flush, and that it
+        is kept for the next flush.
+        '''
+        with mlu.library.playstats.PlayStatsJournal(self.journalFilepath) as journal:
+            journal.recordPlay(self.audioFilepath, self.playTimestamps[0])
+
+            applyEvents = journal._applyEvents
+            def applyEventsWithPlay(audioFilepath, events):
+                recordThread = threading.Thread(target=journal.recordPlay, args=(audioFilepath, self.playTimestamps[1]))
+                recordThread.start()
+                recordThread.join(5)
+                self.assertFalse(recordThread.is_alive())
+                return applyEvents(audioFilepath, events)
+
+            journal._applyEvents = applyEventsWithPlay
+            summary = journal.flush()
+            self.assertEqual(1, summary.playsApplied)
+            self.assertEqual({os.path.abspath(self.audioFilepath): 1}, journal.getPendingPlayCounts())
+
+        self.assertEqual('4', mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).getTags().playCount)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests for mlu.library.query
+
+'''
+
+import unittest
+import sys
+import os
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.tags import values
+import mlu.library.query
+
+def createTags(**tagValues):
+    otherTags = tagValues.pop('OTHER_TAGS', {})
+    fieldValues = {fieldName: tagValues.get(fieldName, '') for fieldName in values.AUDIO_FILE_TAGS_FIELDS}
+    return values.AudioFileTags(OTHER_TAGS=otherTags, **fieldValues)
+
+class TestLibraryQueryModule(unittest.TestCase):
+    def setUp(self):
+        self.queryIndex = mlu.library.query.LibraryQueryIndex()
+        self.queryIndex.setTags('a.flac', createTags(albumArtist='Artist X', rating='8', playCount='0', genre='Rock', dateLastPlayed='2020-05-01 10:00:00'))
+        self.queryIndex.setTags('b.flac', createTags(albumArtist='Artist X', rating='10', playCount='3', genre='Rock Pop', OTHER_TAGS={'mood': 'Happy'}))
+        self.queryIndex.setTags('c.mp3', createTags(albumArtist='Artist X', rating='6', playCount='0', dateLastPlayed='2021-07-01 10:00:00'))
+        self.queryIndex.setTags('d.mp3', createTags(albumArtist='Artist Y', rating='9.0', OTHER_TAGS={'mood': 'sad'}))
+
+    def test_query(self):
+        '''
+        Tests each kind of comparison and the combinations of comparisons.
+        '''
+        queryIndex = self.queryIndex
+
+        self.assertEqual(['a.flac'], queryIndex.query('albumArtist = "Artist X" and rating >= 8 and playCount = 0'))
+        self.assertEqual(['c.mp3', 'd.mp3'], queryIndex.query('genre = ""'))
+        self.assertEqual(['a.flac', 'b.flac'], queryIndex.query('genre != ""'))
+        self.assertEqual(['b.flac', 'd.mp3'], queryIndex.query('rating > 8'))
+        self.assertEqual(['d.mp3'], queryIndex.query('rating = 9'))
+        self.assertEqual(['a.flac'], queryIndex.query("dateLastPlayed < '2021-01-01'"))
+        self.assertEqual(['a.flac', 'b.flac'], queryIndex.query('GENRE ~ rock'))
+        self.assertEqual(['b.flac'], queryIndex.query('OTHER_TAGS.MOOD = Happy'))
+        self.assertEqual(['a.flac', 'c.mp3', 'd.mp3'], queryIndex.query('not (OTHER_TAGS.mood ~ happy)'))
+        self.assertEqual(['b.flac', 'c.mp3'], queryIndex.query('(rating < 7 or playCount > 0) and albumArtist="Artist X"'))
+
+    def test_query_Update(self):
+        '''
+        Tests that the results follow changes and removals of files.
+        '''
+        queryIndex = self.queryIndex
+
+        queryIndex.setTags('a.flac', createTags(albumArtist='Artist X', rating='5', playCount='1', genre='Rock'))
+        queryIndex.removeAudioFile('b.flac')
+
+        self.assertEqual(['a.flac', 'c.mp3'], queryIndex.query('rating < 8'))
+        self.assertEqual([], queryIndex.query('playCount > 0 and rating > 5'))
+        self.assertEqual(['a.flac'], queryIndex.query('genre ~ rock'))
+        self.assertEqual(['d.mp3'], queryIndex.query('OTHER_TAGS.mood != ""'))
+        self.assertEqual(3, len(queryIndex))
+
+    def test_parseQuery_Invalid(self):
+        for expression in ['', 'rating >', 'rating 8', 'unknownField = 1', '(rating = 8', 'rating = 8 and', 'title = "unterminated']:
+            with self.assertRaises(ValueError):
+                mlu.library.query.parseQuery(expression)
+
+if __name__ == '__main__':
+    unittest.main()
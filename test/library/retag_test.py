@@ -0,0 +1,99 @@
+'''
+Tests for mlu.library.retag
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.retag
+import mlu.tags.io
+
+def stripAlbumArtist(tags):
+    tags.albumArtist = tags.albumArtist.strip()
+
+class TestLibraryRetagModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Sets up a test library in the mlu temp dir with copies of the test audio files: half of them
+        have an untrimmed album artist and an 'initialkey' custom tag.
+        '''
+        self.libraryDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-retag')
+        mypycommons.file.createDirectory(self.libraryDir)
+
+        self.changedFilepaths = []
+        self.unchangedFilepaths = []
+        for i in range(6):
+            for testFilename in ['test-1.flac', 'test-1.mp3']:
+                audioFilepath = mypycommons.file.joinPaths(self.libraryDir, '{}-{}'.format(i, testFilename))
+                shutil.copyfile(mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', testFilename), audioFilepath)
+
+                with mlu.tags.io.AudioFileMetadataHandler(audioFilepath).createWriteBatch() as writeBatch:
+                    writeBatch.setTag('key', '')
+                    if (i % 2):
+                        writeBatch.setTag('albumArtist', '  Album Artist ')
+                        writeBatch.setCustomTag('initialkey', 'Am')
+                        self.changedFilepaths.append(audioFilepath)
+                    else:
+                        writeBatch.setTag('albumArtist', 'Album Artist')
+                        self.unchangedFilepaths.append(audioFilepath)
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_Retag(self):
+        '''
+        Tests that a plan holds the diffs of the changed files only, and that committing it writes
+        only those files.
+        '''
+        for workers in [1, 2]:
+            plan = mlu.library.retag.planLibraryRetag(self.libraryDir, stripAlbumArtist, workers=workers, chunkSize=2)
+            self.assertEqual(12, plan.filesScanned)
+            self.assertCountEqual(self.changedFilepaths, [fileChange.audioFilepath for fileChange in plan.changes])
+            self.assertEqual({'albumArtist': 6}, plan.getFieldChangeCounts())
+            self.assertIn("'  Album Artist ' -> 'Album Artist'", plan.formatSummary())
+
+        unchangedFileStats = [os.stat(audioFilepath).st_mtime_ns for audioFilepath in self.unchangedFilepaths]
+        summary = mlu.library.retag.commitRetagPlan(plan, workers=2, chunkSize=2)
+        self.assertEqual(6, summary.filesWritten)
+        self.assertEqual({}, summary.errors)
+        self.assertEqual(unchangedFileStats, [os.stat(audioFilepath).st_mtime_ns for audioFilepath in self.unchangedFilepaths])
+
+        for audioFilepath in self.changedFilepaths:
+            self.assertEqual('Album Artist', mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags().albumArtist)
+
+        # Nothing is left to change
+        plan = mlu.library.retag.planLibraryRetag(self.libraryDir, stripAlbumArtist, workers=1)
+        self.assertEqual([], plan.changes)
+
+    def test_MoveCustomTagToFieldRule(self):
+        '''
+        Tests moving a custom tag into a standard field, and that a file changed after the plan was
+        made is not written.
+        '''
+        plan = mlu.library.retag.planLibraryRetag(self.libraryDir, mlu.library.retag.MoveCustomTagToFieldRule('initialkey', 'key'), workers=1)
+        self.assertEqual({'key': 6, 'OTHER_TAGS:initialkey': 6}, plan.getFieldChangeCounts())
+
+        mlu.tags.io.AudioFileMetadataHandler(self.changedFilepaths[0]).setCustomTag('initialkey', 'C')
+
+        summary = mlu.library.retag.commitRetagPlan(plan, workers=1)
+        self.assertEqual(5, summary.filesWritten)
+        self.assertEqual([self.changedFilepaths[0]], list(summary.errors))
+
+        for audioFilepath in self.changedFilepaths[1:]:
+            tags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+            self.assertEqual('Am', tags.key)
+            self.assertNotIn('initialkey', tags.OTHER_TAGS)
+
+if __name__ == '__main__':
+    unittest.main()
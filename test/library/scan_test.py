@@ -0,0 +1,107 @@
+'''
+Tests for mlu.library.scan
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.scan
+import mlu.tags.io
+
+def _squareChunkOrDie(numbers):
+    # Kills the worker process on a negative number, like a crash in a native library would
+    if (any(number < 0 for number in numbers)):
+        os._exit(1)
+
+    return [number * number for number in numbers]
+
+class TestLibraryScanModule(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        '''
+        Sets up a small test library in the mlu temp dir: the test audio files, copied into a
+        nested folder, plus a broken audio file and a file that is not audio.
+        '''
+        super(TestLibraryScanModule, self).setUpClass
+
+        testAudioFilesDir = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files')
+        self.libraryDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-library')
+        albumDir = mypycommons.file.joinPaths(self.libraryDir, 'artist', 'album')
+        mypycommons.file.createDirectory(albumDir)
+
+        self.goodAudioFilepaths = []
+        testAudioFilesSrc = mypycommons.file.getChildPathsRecursive(rootDirPath=testAudioFilesDir, pathType='file')
+        for testAudioFile in testAudioFilesSrc:
+            mypycommons.file.copyToDirectory(path=testAudioFile, destDir=albumDir)
+            self.goodAudioFilepaths.append(mypycommons.file.joinPaths(albumDir, os.path.basename(testAudioFile)))
+
+        self.brokenAudioFilepath = mypycommons.file.joinPaths(albumDir, 'broken.mp3')
+        with open(self.brokenAudioFilepath, 'wb') as brokenFile:
+            brokenFile.write(b'this is not an mp3 file')
+
+        with open(mypycommons.file.joinPaths(albumDir, 'cover.jpg'), 'wb') as otherFile:
+            otherFile.write(b'not audio')
+
+    @classmethod
+    def tearDownClass(self):
+        super(TestLibraryScanModule, self).tearDownClass
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_getAudioFilepaths(self):
+        '''
+        Tests that only the supported audio files are found in the library directory tree.
+        '''
+        audioFilepaths = list(mlu.library.scan.getAudioFilepaths(self.libraryDir))
+        expectedFilepaths = self.goodAudioFilepaths + [self.brokenAudioFilepath]
+
+        self.assertCountEqual(expectedFilepaths, audioFilepaths)
+
+    def test_scan(self):
+        '''
+        Tests that a scan using worker processes reads every file, and reports the broken file as
+        failed without aborting the scan.
+        '''
+        for workers in [1, 2]:
+            results = list(mlu.library.scan.scan(self.libraryDir, workers=workers, chunkSize=1))
+            resultsByFilepath = {result.audioFilepath: result for result in results}
+
+            self.assertEqual(len(self.goodAudioFilepaths) + 1, len(results))
+            self.assertFalse(resultsByFilepath[self.brokenAudioFilepath].succeeded())
+
+            for audioFilepath in self.goodAudioFilepaths:
+                result = resultsByFilepath[audioFilepath]
+                self.assertTrue(result.succeeded())
+                self.assertEqual(result.tags.title, mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags().title)
+                self.assertTrue(result.properties.duration > 0)
+
+    def test_runInChunks_WorkerDies(self):
+        '''
+        Tests that the chunks of a worker process that dies are failed, and the results of all the
+        other chunks are still yielded.
+        '''
+        numbers = list(range(20)) + [-1] + list(range(20, 40))
+        chunkResults = list(mlu.library.scan.runInChunks(
+            _squareChunkOrDie, numbers, workers=2, chunkSize=3,
+            chunkErrorFunc=lambda chunk, error: [(number, error) for number in chunk]
+        ))
+
+        results = [result for chunkResult in chunkResults for result in chunkResult]
+        self.assertEqual(len(numbers), len(results))
+
+        failedNumbers = {result[0] for result in results if (isinstance(result, tuple))}
+        self.assertIn(-1, failedNumbers)
+        squares = {result for result in results if (not isinstance(result, tuple))}
+        self.assertEqual({number * number for number in numbers if (number not in failedNumbers)}, squares)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+'''
+Tests for mlu.library.search
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+from mlu.tags import values
+import mlu.library.search
+
+def createTags(**tagValues):
+    fieldValues = {fieldName: tagValues.get(fieldName, '') for fieldName in values.AUDIO_FILE_TAGS_FIELDS}
+    return values.AudioFileTags(OTHER_TAGS={}, **fieldValues)
+
+class TestLibrarySearchModule(unittest.TestCase):
+    def setUp(self):
+        self.searchIndex = mlu.library.search.LibrarySearchIndex()
+        self.searchIndex.setTags('halo.flac', createTags(title='Halo', artist='Beyoncé', album='I Am... Sasha Fierce'))
+        self.searchIndex.setTags('hello.mp3', createTags(title='Hello', artist='Adele', album='25', lyrics='Hello from the other side'))
+        self.searchIndex.setTags('side.mp3', createTags(title='Other Side', artist='Red Hot Chili Peppers', album='Californication'))
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_search(self):
+        '''
+        Tests normalized, multi-token and prefix search, and the ranking of the results.
+        '''
+        searchIndex = self.searchIndex
+
+        self.assertEqual(['halo.flac'], [result.audioFilepath for result in searchIndex.search('BEYONCE')])
+        self.assertEqual(['halo.flac'], [result.audioFilepath for result in searchIndex.search('beyonce h')])
+        self.assertEqual(['hello.mp3'], [result.audioFilepath for result in searchIndex.search('hel')])
+        self.assertEqual([], searchIndex.search('hel '))
+        self.assertEqual([], searchIndex.search('hel', prefix=False))
+
+        # The title match ranks above the lyrics match
+        self.assertEqual(['side.mp3', 'hello.mp3'], [result.audioFilepath for result in searchIndex.search('other side')])
+
+    def test_search_Update(self):
+        '''
+        Tests that a retagged or removed file is found by its new tags only, and that a saved index
+        loads with the same results.
+        '''
+        searchIndex = self.searchIndex
+        searchIndex.setTags('hello.mp3', createTags(title='Skyfall', artist='Adele'))
+        searchIndex.removeAudioFile('side.mp3')
+
+        self.assertEqual([], searchIndex.search('other'))
+        self.assertEqual(['hello.mp3'], [result.audioFilepath for result in searchIndex.search('skyf')])
+
+        indexFilepath = mypycommons.file.joinPaths(MLUSettings.createDirectory(MLUSettings.tempDir), 'search.json')
+        searchIndex.save(indexFilepath)
+        loadedIndex = mlu.library.search.LibrarySearchIndex.load(indexFilepath)
+
+        self.assertEqual(2, len(loadedIndex))
+        for queryText in ['adele', 'sky', 'beyonce halo']:
+            self.assertEqual(
+                [(result.audioFilepath, result.score) for result in searchIndex.search(queryText)],
+                [(result.audioFilepath, result.score) for result in loadedIndex.search(queryText)]
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+Tests for mlu.library.watch
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.library.watch
+import mlu.tags.io
+
+class TestLibraryWatchModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies a test FLAC file to a library dir in the mlu temp dir.
+        '''
+        self.libraryDir = os.path.abspath(mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-watch-library'))
+        mypycommons.file.createDirectory(self.libraryDir)
+
+        self.testAudioFile = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', 'test-1.flac')
+        self.audioFilepath = mypycommons.file.joinPaths(self.libraryDir, 'track-1.flac')
+        shutil.copyfile(self.testAudioFile, self.audioFilepath)
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_LibraryWatcher_Inotify(self):
+        self._testWatcher(usePolling=False)
+
+    def test_LibraryWatcher_Polling(self):
+        self._testWatcher(usePolling=True)
+
+    def _testWatcher(self, usePolling):
+        '''
+        Tests that retagged, added and removed files are reported with their tag diffs.
+        '''
+        with mlu.library.watch.LibraryWatcher(self.libraryDir, usePolling=usePolling, debounceSeconds=0.2, pollIntervalSeconds=0.1) as watcher:
+            self.assertIsNotNone(watcher.getTags(self.audioFilepath))
+            self.assertEqual([], watcher.getChanges(timeout=0.3))
+
+            mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).setCustomTag('watchtest', 'changed')
+            events = watcher.getChanges(timeout=5)
+            self.assertEqual(1, len(events))
+            self.assertEqual(mlu.library.watch.CHANGE_TYPE_MODIFIED, events[0].changeType)
+            self.assertEqual({'OTHER_TAGS': {'watchtest': (None, 'changed')}}, events[0].tagsDiff)
+            self.assertEqual('changed', watcher.getTags(self.audioFilepath).OTHER_TAGS['watchtest'])
+
+            subDir = mypycommons.file.joinPaths(self.libraryDir, 'album')
+            os.mkdir(subDir)
+            addedFilepath = mypycommons.file.joinPaths(subDir, 'track-2.flac')
+            shutil.copyfile(self.testAudioFile, addedFilepath)
+            os.remove(self.audioFilepath)
+
+            events = watcher.getChanges(timeout=5)
+            eventTypes = {event.audioFilepath: event.changeType for event in events}
+            self.assertEqual({
+                addedFilepath: mlu.library.watch.CHANGE_TYPE_ADDED,
+                self.audioFilepath: mlu.library.watch.CHANGE_TYPE_REMOVED
+            }, eventTypes)
+            self.assertEqual([addedFilepath], watcher.getAudioFilepaths())
+
+if __name__ == '__main__':
+    unittest.main()
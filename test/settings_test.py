@@ -0,0 +1,79 @@
+'''
+Tests for mlu.settings
+
+'''
+
+import unittest
+import sys
+import os
+import subprocess
+import tempfile
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,".."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+
+class TestSettingsModule(unittest.TestCase):
+    def tearDown(self):
+        os.environ.pop('MLU_CACHE_DIR', None)
+        MLUSettings.reset()
+
+    def test_MLUSettings_Environment(self):
+        '''
+        Tests that the settings are resolved from the environment, and from configure().
+        '''
+        os.environ['MLU_CACHE_DIR'] = os.path.join('/', 'custom', 'cache')
+        MLUSettings.reset()
+        self.assertEqual(os.path.join('/', 'custom', 'cache'), MLUSettings.cacheDir)
+        self.assertEqual(os.path.join('/', 'custom', 'cache', 'temp'), MLUSettings.tempDir)
+
+        MLUSettings.configure(cacheDir=os.path.join('/', 'other'))
+        self.assertEqual(os.path.join('/', 'other', 'temp'), MLUSettings.tempDir)
+
+        with self.assertRaises(ValueError):
+            MLUSettings.configure(unknownSetting='value')
+
+    def test_MLUSettings_ConfigureTwice(self):
+        '''
+        Tests that a configure() call keeps the settings of an earlier one, and only resolves again
+        the settings that were derived from the changed ones.
+        '''
+        logDir = os.path.join('/', 'custom', 'logs')
+        cacheDir = os.path.join('/', 'custom', 'cache')
+        tempDir = os.path.join('/', 'custom', 'temp')
+
+        MLUSettings.configure(logDir=logDir)
+        MLUSettings.tempDir
+        MLUSettings.configure(cacheDir=cacheDir)
+        self.assertEqual(logDir, MLUSettings.logDir)
+        self.assertEqual(os.path.join(cacheDir, 'temp'), MLUSettings.tempDir)
+
+        MLUSettings.configure(tempDir=tempDir)
+        MLUSettings.configure(cacheDir=os.path.join('/', 'other'))
+        self.assertEqual(logDir, MLUSettings.logDir)
+        self.assertEqual(tempDir, MLUSettings.tempDir)
+
+    def test_MLUSettings_NoImportSideEffects(self):
+        '''
+        Tests that importing the settings and the tags I/O module creates no directories and does
+        not import the format modules.
+        '''
+        with tempfile.TemporaryDirectory() as tempDir:
+            cacheDir = os.path.join(tempDir, 'cache')
+            environment = dict(os.environ, MLU_CACHE_DIR=cacheDir, MLU_LOG_DIR=os.path.join(tempDir, 'logs'))
+            environment['PYTHONPATH'] = os.pathsep.join([projectRoot] + sys.path)
+
+            output = subprocess.check_output([
+                sys.executable, '-c',
+                "import sys, mlu.tags.io; from mlu.settings import MLUSettings; MLUSettings.tempDir; "
+                "print(any(name.startswith('mutagen') or name.startswith('mlu.tags.audiofmt') for name in sys.modules))"
+            ], env=environment)
+
+            self.assertEqual(b'False', output.strip())
+            self.assertEqual([], os.listdir(tempDir))
+
+if __name__ == '__main__':
+    unittest.main()
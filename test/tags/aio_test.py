@@ -0,0 +1,121 @@
+'''
+Tests for mlu.tags.aio
+
+'''
+
+import unittest
+import asyncio
+import threading
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.tags.aio
+import mlu.tags.io
+
+class TestTagsAioModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies a test FLAC file to the mlu temp dir.
+        '''
+        tempTestAudioFilesDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-aio-files')
+        mypycommons.file.createDirectory(tempTestAudioFilesDir)
+
+        testAudioFile = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', 'test-1.flac')
+        mypycommons.file.copyToDirectory(path=testAudioFile, destDir=tempTestAudioFilesDir)
+        self.audioFilepath = mypycommons.file.joinPaths(tempTestAudioFilesDir, 'test-1.flac')
+
+    def tearDown(self):
+        mlu.tags.aio.shutdownDefaultExecutor()
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_AsyncAudioFileMetadataHandler_ReadWrite(self):
+        '''
+        Tests that reads match the blocking handler and that concurrent writes to the same file,
+        through different handlers, are all applied.
+        '''
+        async def run():
+            handler = mlu.tags.aio.AsyncAudioFileMetadataHandler(self.audioFilepath)
+            tags = await handler.getTags()
+            properties = await handler.getProperties()
+
+            writeHandlers = [mlu.tags.aio.AsyncAudioFileMetadataHandler(self.audioFilepath) for i in range(5)]
+            await asyncio.gather(*[
+                writeHandler.setCustomTag("aiotest{}".format(i), str(i)) for i, writeHandler in enumerate(writeHandlers)
+            ])
+            written = await handler.commitWriteBatch(tagValues={'playCount': '7'})
+
+            return (tags, properties, written)
+
+        tags, properties, written = asyncio.run(run())
+        blockingHandler = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath)
+        newTags = blockingHandler.getTags()
+
+        self.assertEqual(blockingHandler.getProperties().duration, properties.duration)
+        self.assertEqual(tags.title, newTags.title)
+        self.assertTrue(written)
+        self.assertEqual('7', newTags.playCount)
+        for i in range(5):
+            self.assertEqual(str(i), newTags.OTHER_TAGS["aiotest{}".format(i)])
+
+    def test_AsyncAudioFileMetadataHandler_Cancel(self):
+        '''
+        Tests that a call that is cancelled while it waits for a worker thread never runs.
+        '''
+        executor = ThreadPoolExecutor(max_workers=1)
+        blockerRelease = threading.Event()
+
+        async def run():
+            # Keep the only worker thread busy, so the write has to wait in the queue
+            blocker = asyncio.get_running_loop().run_in_executor(executor, blockerRelease.wait)
+
+            handler = mlu.tags.aio.AsyncAudioFileMetadataHandler(self.audioFilepath, executor=executor)
+            writeTask = asyncio.ensure_future(handler.setCustomTag("aiocancelled", "written"))
+            await asyncio.sleep(0.05)
+            writeTask.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await writeTask
+
+            blockerRelease.set()
+            await blocker
+
+        asyncio.run(run())
+        executor.shutdown(wait=True)
+
+        newTags = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).getTags()
+        self.assertNotIn("aiocancelled", newTags.OTHER_TAGS)
+
+    def test_AsyncAudioFileMetadataHandler_MultipleLoops(self):
+        '''
+        Tests that a handler and the write locks of its file can be used from successive event
+        loops, with the locks contended in each.
+        '''
+        handler = mlu.tags.aio.AsyncAudioFileMetadataHandler(self.audioFilepath)
+        otherHandler = mlu.tags.aio.AsyncAudioFileMetadataHandler(self.audioFilepath)
+
+        async def run(runIndex):
+            await asyncio.gather(
+                handler.setCustomTag("aioloop{}".format(runIndex), "a"),
+                handler.getTags(),
+                otherHandler.setCustomTag("aioloopother{}".format(runIndex), "b")
+            )
+
+        for runIndex in range(2):
+            asyncio.run(run(runIndex))
+
+        newTags = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath).getTags()
+        for runIndex in range(2):
+            self.assertEqual("a", newTags.OTHER_TAGS["aioloop{}".format(runIndex)])
+            self.assertEqual("b", newTags.OTHER_TAGS["aioloopother{}".format(runIndex)])
+
+if __name__ == '__main__':
+    unittest.main()
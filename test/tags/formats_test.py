@@ -0,0 +1,73 @@
+'''
+Tests for mlu.tags.formats
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.tags.formats
+import mlu.tags.io
+from test.helpers import audiogen
+
+class TestTagsFormatsModule(unittest.TestCase):
+    def setUp(self):
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-formats-files')
+        mypycommons.file.createDirectory(self.tempTestDir)
+        self.testAudioFilesDir = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files')
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def _copyTestFile(self, testFilename, filename):
+        filepath = mypycommons.file.joinPaths(self.tempTestDir, filename)
+        shutil.copyfile(mypycommons.file.joinPaths(self.testAudioFilesDir, testFilename), filepath)
+        return filepath
+
+    def test_detectAudioFileType(self):
+        '''
+        Tests that formats are detected from the file content, whatever the file extension.
+        '''
+        self.assertEqual('flac', mlu.tags.formats.detectAudioFileType(self._copyTestFile('test-1.flac', 'upper.FLAC')))
+        self.assertEqual('mp3', mlu.tags.formats.detectAudioFileType(self._copyTestFile('test-1.mp3', 'mislabelled.flac')))
+
+        for audioFormat in audiogen.SYNTHETIC_AUDIO_FORMATS:
+            filepath = mypycommons.file.joinPaths(self.tempTestDir, "synthetic.{}".format(audioFormat))
+            audiogen.createSyntheticAudioFile(filepath, audioFormat, durationSeconds=1)
+            self.assertEqual(audioFormat, mlu.tags.formats.detectAudioFileType(filepath))
+
+        junkFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'junk.flac')
+        with open(junkFilepath, 'wb') as junkFile:
+            junkFile.write(b'not audio' * 100)
+        self.assertIsNone(mlu.tags.formats.detectAudioFileType(junkFilepath))
+
+    def test_AudioFileMetadataHandler_DetectedFormat(self):
+        '''
+        Tests that the handler reads files with an uppercase or wrong extension, and rejects files
+        that are not audio.
+        '''
+        handler = mlu.tags.io.AudioFileMetadataHandler(self._copyTestFile('test-1.flac', 'upper.FLAC'))
+        self.assertEqual('flac', handler._audioFileType)
+        self.assertTrue(handler.getTags().title)
+
+        handler = mlu.tags.io.AudioFileMetadataHandler(self._copyTestFile('test-1.mp3', 'mislabelled.m4a'))
+        self.assertEqual('mp3', handler._audioFileType)
+        self.assertTrue(handler.getTags().title)
+
+        junkFilepath = mypycommons.file.joinPaths(self.tempTestDir, 'junk.m4a')
+        with open(junkFilepath, 'wb') as junkFile:
+            junkFile.write(b'not audio' * 100)
+        self.assertRaises(Exception, mlu.tags.io.AudioFileMetadataHandler, junkFilepath)
+
+if __name__ == '__main__':
+    unittest.main()
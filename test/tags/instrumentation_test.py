@@ -0,0 +1,77 @@
+'''
+Tests for mlu.tags.instrumentation
+
+'''
+
+import unittest
+import sys
+import os
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.tags.instrumentation
+import mlu.tags.io
+
+class TestTagsInstrumentationModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies a test FLAC file to the mlu temp dir.
+        '''
+        tempTestAudioFilesDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-instrumentation-files')
+        mypycommons.file.createDirectory(tempTestAudioFilesDir)
+
+        testAudioFile = mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', 'test-1.flac')
+        mypycommons.file.copyToDirectory(path=testAudioFile, destDir=tempTestAudioFilesDir)
+        self.audioFilepath = mypycommons.file.joinPaths(tempTestAudioFilesDir, 'test-1.flac')
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_NullInstrumentation(self):
+        '''
+        Tests that the default instrumentation records nothing.
+        '''
+        handler = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath)
+        self.assertIs(mlu.tags.instrumentation.NULL_INSTRUMENTATION, handler._audioFmtHandler.instrumentation)
+        self.assertIs(mlu.tags.instrumentation.NULL_SPAN, handler._audioFmtHandler.instrumentation.span('parse', 'FLAC'))
+
+    def test_SpanHistogramAggregator(self):
+        '''
+        Tests that the phases of reads and writes are aggregated per format and span name.
+        '''
+        aggregator = mlu.tags.instrumentation.SpanHistogramAggregator()
+        handler = mlu.tags.io.AudioFileMetadataHandler(self.audioFilepath, instrumentation=aggregator)
+        handler.getTags().toDict()
+        handler.getProperties()
+        handler.setCustomTag('instrumentationtest', 'value')
+
+        flacSummary = aggregator.getSummary()['FLAC']
+        self.assertEqual(1, flacSummary[mlu.tags.instrumentation.SPAN_PARSE]['count'])
+        self.assertEqual(len(mlu.tags.values.AudioFileTags.FIELD_NAMES), flacSummary[mlu.tags.instrumentation.SPAN_DECODE_TAG_FIELD]['count'])
+        self.assertEqual(1, flacSummary[mlu.tags.instrumentation.SPAN_DECODE_PROPERTIES]['count'])
+        self.assertEqual(1, flacSummary[mlu.tags.instrumentation.SPAN_COMMIT_WRITE_BATCH]['count'])
+
+        saveStats = flacSummary[mlu.tags.instrumentation.SPAN_SAVE]
+        self.assertEqual(1, saveStats['count'])
+        self.assertEqual(1, sum(bucket['count'] for bucket in saveStats['histogram']))
+        if (mlu.tags.instrumentation.getThreadIoCounters() is not None):
+            self.assertGreater(flacSummary[mlu.tags.instrumentation.SPAN_PARSE]['threadBytesRead'], 0)
+            self.assertGreater(saveStats['threadBytesWritten'], 0)
+
+        with handler.getEmbeddedArtwork() as artworks:
+            mappedBytes = sum(len(embeddedArtwork.data) for embeddedArtwork in artworks if embeddedArtwork.offset is not None)
+            decodedBytes = sum(len(embeddedArtwork.data) for embeddedArtwork in artworks if embeddedArtwork.offset is None)
+        artworkStats = aggregator.getSummary()['FLAC'][mlu.tags.instrumentation.SPAN_READ_ARTWORK]
+        self.assertEqual(mappedBytes, artworkStats['bytesMapped'])
+        self.assertEqual(decodedBytes, artworkStats['bytesDecoded'])
+
+        self.assertIn('FLAC', aggregator.formatSummary())
+
+if __name__ == '__main__':
+    unittest.main()
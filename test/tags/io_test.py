@@ -5,8 +5,13 @@ Tests for mlu.tags.io, which also tests the mlu.tags.audiofmt modules.
 
 #from email.mime import audio
 import unittest
+import pickle
 import sys
 import os
+import io
+import shutil
+import mutagen.flac
+import mutagen.id3
 from com.nwrobel import mypycommons
 import com.nwrobel.mypycommons.file
 
@@ -18,10 +23,12 @@ sys.path.insert(0, projectRoot)
 from mlu.settings import MLUSettings
 import mlu.tags.io
 import mlu.tags.values
+import mlu.tags.writepolicy
 import mlu.tags.audiofmt.flac
 import mlu.tags.audiofmt.mp3
 import mlu.tags.audiofmt.m4a
 import test.helpers.common
+from test.helpers import audiogen
 
 class TestAudioFile:
     '''
@@ -175,6 +182,211 @@ class TestTagsIOModule(unittest.TestCase):
         #     self._checkAudioFileTagIOHandlerRead(handler, testAudioFile.tagValues)
         #     self._checkAudioFileTagIOHandlerWrite(handler)
 
+    def test_AudioFileMetadataHandler_Snapshot(self):
+        '''
+        Tests that the handler reuses a single parse of the audio file for reads and writes, and
+        that it parses the file again once the file has been changed by something else.
+        '''
+        for testAudioFile in (self.testData.testAudioFilesFLAC + self.testData.testAudioFilesMp3):
+            handler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath)
+            handler.getTags()
+            handler.getProperties()
+            snapshot = handler._audioFmtHandler._snapshot
+
+            self._checkAudioFileTagIOHandlerWrite(handler)
+            self.assertIs(snapshot, handler._audioFmtHandler._snapshot)
+
+            # Write through a second handler: the first one must notice the change on disk
+            otherHandler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath)
+            otherHandler.setCustomTag("snapshottest", "changed")
+
+            self.assertEqual("changed", handler.getTags().OTHER_TAGS["snapshottest"])
+            self.assertIsNot(snapshot, handler._audioFmtHandler._snapshot)
+
+    def test_AudioFileMetadataHandler_TagsOnly(self):
+        '''
+        Tests that reading only the tag block of an audio file gives the same tags as a full parse,
+        and that a full parse is done once the properties are needed.
+        '''
+        for testAudioFile in (self.testData.testAudioFilesFLAC + self.testData.testAudioFilesMp3):
+            tags = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath).getTags()
+
+            handler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath)
+            tagsOnlyTags = handler.getTags(tagsOnly=True)
+            self.assertTrue(handler._audioFmtHandler._snapshot.isTagsOnly)
+            self.assertTrue(tags.equals(tagsOnlyTags))
+
+            handler.getProperties()
+            self.assertFalse(handler._audioFmtHandler._snapshot.isTagsOnly)
+
+    def test_AudioFileMetadataHandler_LazyTags(self):
+        '''
+        Tests that tags are decoded on first access, and that tags read before a write keep the
+        values they had when they were read.
+        '''
+        for testAudioFile in (self.testData.testAudioFilesFLAC + self.testData.testAudioFilesMp3):
+            handler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath)
+            tags = handler.getTags()
+            self.assertFalse(tags.isDecoded('OTHER_TAGS'))
+
+            oldTitle = tags.title
+            oldTags = tags.toDict()
+            lazyTags = handler.getTags()
+
+            newTitle = test.helpers.common.getRandomString(length=20, allowSpecial=False)
+            handler.setCustomTag("lazytest", newTitle)
+            with handler.createWriteBatch() as writeBatch:
+                writeBatch.setTag('title', newTitle)
+
+            self.assertEqual(oldTitle, lazyTags.title)
+            self.assertEqual(oldTags, lazyTags.toDict())
+            self.assertEqual(newTitle, handler.getTags().title)
+
+            # Lazy tags are fully decoded when they are sent to another process
+            unpickledTags = pickle.loads(pickle.dumps(handler.getTags()))
+            self.assertEqual(newTitle, unpickledTags.OTHER_TAGS["lazytest"])
+
+            # Put back the title, which the read tests check
+            with handler.createWriteBatch() as writeBatch:
+                writeBatch.setTag('title', oldTitle)
+
+    def test_AudioFileMetadataHandler_EmbeddedArtwork(self):
+        '''
+        Tests that embedded pictures are read as views of the picture data in the file, the same
+        pictures as those decoded by mutagen.
+        '''
+        pictureData = os.urandom(100000)
+        artworkTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-artwork-files')
+        mypycommons.file.createDirectory(artworkTestDir)
+
+        flacFilepath = mypycommons.file.joinPaths(artworkTestDir, 'artwork.flac')
+        shutil.copyfile(self.testData.testAudioFilesFLAC[0].filepath, flacFilepath)
+        flacInterface = mutagen.flac.FLAC(flacFilepath)
+        flacPicture = mutagen.flac.Picture()
+        flacPicture.type = 3
+        flacPicture.mime = 'image/jpeg'
+        flacPicture.data = pictureData
+        flacInterface.add_picture(flacPicture)
+        flacInterface.save()
+
+        mp3Filepath = mypycommons.file.joinPaths(artworkTestDir, 'artwork.mp3')
+        shutil.copyfile(self.testData.testAudioFilesMp3[0].filepath, mp3Filepath)
+        mp3Tags = mutagen.id3.ID3(mp3Filepath)
+        mp3Tags.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='artworktest', data=pictureData))
+        mp3Tags.save()
+
+        expectedPictures = {
+            flacFilepath: mutagen.flac.FLAC(flacFilepath).pictures,
+            mp3Filepath: mutagen.id3.ID3(mp3Filepath).getall('APIC')
+        }
+
+        for audioFilepath, mutagenPictures in expectedPictures.items():
+            handler = mlu.tags.io.AudioFileMetadataHandler(audioFilepath)
+            with handler.getEmbeddedArtwork() as artworks:
+                self.assertEqual(len(mutagenPictures), len(artworks))
+                for artwork, mutagenPicture in zip(artworks, mutagenPictures):
+                    self.assertEqual(mutagenPicture.mime, artwork.mimeType)
+                    self.assertEqual(mutagenPicture.type, artwork.pictureType)
+                    self.assertEqual(mutagenPicture.data, artwork.getBytes())
+
+                with open(audioFilepath, 'rb') as audioFile:
+                    audioFile.seek(artworks[-1].offset)
+                    self.assertEqual(pictureData, audioFile.read(artworks[-1].length))
+
+                streamedData = io.BytesIO()
+                artworks[-1].writeTo(streamedData, chunkSize=4096)
+                self.assertEqual(pictureData, streamedData.getvalue())
+
+    def test_AudioFileMetadataHandler_WriteBatch(self):
+        '''
+        Tests that a write batch writes standard and custom tags together, and that committing
+        values that are already set does not write the file.
+        '''
+        for testAudioFile in (self.testData.testAudioFilesFLAC + self.testData.testAudioFilesMp3):
+            handler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath)
+            handler.setCustomTag("batchremoved", "remove me")
+
+            newTagValues = {
+                'title': test.helpers.common.getRandomString(length=20, allowSpecial=False),
+                'genre': test.helpers.common.getRandomString(length=20, allowSpecial=False),
+                'trackNumber': '3',
+                'totalTracks': '12',
+                'playCount': '10'
+            }
+            newCustomTagValues = {
+                "batchtest{}".format(i): test.helpers.common.getRandomString(length=20, allowSpecial=False) for i in range(5)
+            }
+
+            with handler.createWriteBatch() as writeBatch:
+                for tagName, value in newTagValues.items():
+                    writeBatch.setTag(tagName, value)
+                for tagName, value in newCustomTagValues.items():
+                    writeBatch.setCustomTag(tagName, value)
+                writeBatch.removeCustomTag("batchremoved")
+
+            # Read the file with a new handler so the values come from the file on disk
+            tags = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath).getTags()
+            for tagName, value in newTagValues.items():
+                self.assertEqual(value, getattr(tags, tagName))
+            for tagName, value in newCustomTagValues.items():
+                self.assertEqual(value, tags.OTHER_TAGS[tagName])
+            self.assertNotIn("batchremoved", tags.OTHER_TAGS)
+
+            writeBatch = handler.createWriteBatch()
+            writeBatch.setTags(tags)
+            self.assertFalse(writeBatch.commit())
+
+            self.assertRaises(ValueError, writeBatch.setTag, 'notATagField', 'value')
+
+    def test_AudioFileMetadataHandler_M4ANumberOfTotal(self):
+        '''
+        Tests that M4A track/disc numbers given as 'N/M' (or with whitespace) are written as their
+        number and total, and that a value that is not a number is rejected with a ValueError.
+        '''
+        audioFilepath = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-m4a-number-of-total.m4a')
+        audiogen.createSyntheticAudioFile(audioFilepath, 'm4a', durationSeconds=1)
+        handler = mlu.tags.io.AudioFileMetadataHandler(audioFilepath)
+
+        with handler.createWriteBatch() as writeBatch:
+            writeBatch.setTag('trackNumber', '3/12')
+            writeBatch.setTag('discNumber', ' 1')
+            writeBatch.setTag('totalDiscs', '2 ')
+
+        tags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+        self.assertEqual(('3', '12', '1', '2'), (tags.trackNumber, tags.totalTracks, tags.discNumber, tags.totalDiscs))
+
+        with handler.createWriteBatch() as writeBatch:
+            writeBatch.setTag('trackNumber', '4/13')
+            writeBatch.setTag('totalTracks', '14')
+
+        tags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+        self.assertEqual(('4', '14'), (tags.trackNumber, tags.totalTracks))
+
+        writeBatch = handler.createWriteBatch()
+        writeBatch.setTag('trackNumber', 'A1')
+        self.assertRaises(ValueError, writeBatch.commit)
+
+    def test_AudioFileMetadataHandler_WritePolicy(self):
+        '''
+        Tests that once the write policy has reserved padding in a file, later tag writes that fit
+        in it are patched in place and do not change the size of the file.
+        '''
+        for testAudioFile in (self.testData.testAudioFilesFLAC + self.testData.testAudioFilesMp3):
+            writeStats = mlu.tags.writepolicy.TagWriteStats()
+            writePolicy = mlu.tags.writepolicy.TagWritePolicy(reservedPadding=8192, minPadding=512, stats=writeStats)
+            handler = mlu.tags.io.AudioFileMetadataHandler(testAudioFile.filepath, writePolicy=writePolicy)
+
+            handler.setCustomTag("paddingtest", "first")
+            fileSize = os.path.getsize(testAudioFile.filepath)
+
+            for i in range(10):
+                handler.setCustomTag("paddingtest", "value {}".format("x" * (i * 50)))
+
+            self.assertEqual(fileSize, os.path.getsize(testAudioFile.filepath))
+            formatCounts = list(writeStats.getCounts().values())[0]
+            self.assertEqual(11, formatCounts['inPlace'] + formatCounts['fullRewrite'])
+            self.assertTrue(formatCounts['fullRewrite'] <= 1)
+
     def _checkAudioFileTagIOHandlerRead(self, audioFileMetadataHandler, expectedTagValues):
         '''
         Tests tag reading for any given test AudioFileTagIOHandler instance. Used as a 
@@ -189,7 +401,7 @@ class TestTagsIOModule(unittest.TestCase):
                 be expected to read out
         '''
         tags = audioFileMetadataHandler.getTags()
-        actualTagValues = tags.__dict__        
+        actualTagValues = tags.toDict()
 
         # Remove the otherTags value from expected tags (we will check this later)
         try:
@@ -0,0 +1,112 @@
+'''
+Tests for mlu.tags.journal
+
+'''
+
+import unittest
+import sys
+import os
+import shutil
+from com.nwrobel import mypycommons
+import com.nwrobel.mypycommons.file
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.settings import MLUSettings
+import mlu.tags.journal
+import mlu.tags.io
+
+class TestTagsJournalModule(unittest.TestCase):
+    def setUp(self):
+        '''
+        Copies test audio files to the mlu temp dir.
+        '''
+        self.tempTestDir = mypycommons.file.joinPaths(MLUSettings.tempDir, 'test-journal')
+        mypycommons.file.createDirectory(self.tempTestDir)
+
+        self.audioFilepaths = []
+        for testFilename in ['test-1.flac', 'test-1.mp3']:
+            audioFilepath = mypycommons.file.joinPaths(self.tempTestDir, testFilename)
+            shutil.copyfile(mypycommons.file.joinPaths(MLUSettings.testDataDir, 'test-audio-files', testFilename), audioFilepath)
+            self.audioFilepaths.append(audioFilepath)
+
+        self.journalDir = mypycommons.file.joinPaths(self.tempTestDir, 'journal')
+
+    def tearDown(self):
+        mypycommons.file.deletePath(MLUSettings.tempDir)
+
+    def test_TagWriteJournal_Write(self):
+        '''
+        Tests journaled writes, atomic and in place: the new values are written, and no journal entry
+        or copy of the audio file is left behind.
+        '''
+        for atomic in [True, False]:
+            tagWriteJournal = mlu.tags.journal.TagWriteJournal(self.journalDir, atomic=atomic)
+
+            for audioFilepath in self.audioFilepaths:
+                handler = mlu.tags.io.AudioFileMetadataHandler(audioFilepath, journal=tagWriteJournal)
+                tags = handler.getTags()
+                tags.rating = '8' if (atomic) else '6'
+                handler.setTags(tags)
+                handler.setCustomTag('mood', 'atomic' if (atomic) else 'inplace')
+
+                tags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+                self.assertEqual('8' if (atomic) else '6', tags.rating)
+                self.assertEqual('atomic' if (atomic) else 'inplace', tags.OTHER_TAGS['mood'])
+
+            self.assertEqual([], tagWriteJournal.getPendingEntries())
+            self.assertEqual(sorted(os.path.basename(audioFilepath) for audioFilepath in self.audioFilepaths), sorted(filename for filename in os.listdir(self.tempTestDir) if (filename != 'journal')))
+
+    def test_TagWriteJournal_Recover(self):
+        '''
+        Tests that an entry left by a process that died before writing the file is rolled forward,
+        and that one left after writing the file is rolled back.
+        '''
+        tagWriteJournal = mlu.tags.journal.TagWriteJournal(self.journalDir)
+
+        for audioFilepath in self.audioFilepaths:
+            currentTags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+            tagWriteJournal._saveEntry(self._createEntry(audioFilepath, currentTags.votes, currentTags.OTHER_TAGS.get('mood'), '5;6', 'happy'))
+
+        self.assertEqual(2, len(tagWriteJournal.getPendingEntries()))
+        summary = tagWriteJournal.recover()
+        self.assertEqual(2, summary.rolledForward)
+        self.assertEqual([], tagWriteJournal.getPendingEntries())
+        self._assertTagValues('5;6', 'happy')
+
+        for audioFilepath in self.audioFilepaths:
+            tagWriteJournal._saveEntry(self._createEntry(audioFilepath, '5;6', 'happy', '7', None))
+            handler = mlu.tags.io.AudioFileMetadataHandler(audioFilepath)
+            with handler.createWriteBatch() as writeBatch:
+                writeBatch.setTag('votes', '7')
+                writeBatch.removeCustomTag('mood')
+
+        summary = tagWriteJournal.recover(rollback=True)
+        self.assertEqual(2, summary.rolledBack)
+        self.assertEqual(0, summary.failed)
+        self.assertEqual([], tagWriteJournal.getPendingEntries())
+        self._assertTagValues('5;6', 'happy')
+
+    def _createEntry(self, audioFilepath, oldVotes, oldMood, newVotes, newMood):
+        return mlu.tags.journal.TagWriteJournalEntry(
+            entryId='entry-{}-{}'.format(os.path.basename(audioFilepath), newVotes),
+            audioFilepath=os.path.abspath(audioFilepath),
+            oldTagValues={'votes': oldVotes},
+            newTagValues={'votes': newVotes},
+            oldCustomTagValues={'mood': oldMood},
+            newCustomTagValues={'mood': newMood},
+            atomic=True,
+            created=0
+        )
+
+    def _assertTagValues(self, votes, mood):
+        for audioFilepath in self.audioFilepaths:
+            tags = mlu.tags.io.AudioFileMetadataHandler(audioFilepath).getTags()
+            self.assertEqual(votes, tags.votes)
+            self.assertEqual(mood, tags.OTHER_TAGS.get('mood'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+Tests for mlu.tags.values
+
+'''
+
+import unittest
+import pickle
+import sys
+import os
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+import mlu.tags.values
+
+def getTestTags(title, artist, otherTags=None):
+    tagValues = {fieldName: '' for fieldName in mlu.tags.values.AUDIO_FILE_TAGS_FIELDS}
+    tagValues['title'] = title
+    tagValues['artist'] = artist
+    tagValues['OTHER_TAGS'] = otherTags if (otherTags is not None) else {}
+
+    return mlu.tags.values.AudioFileTags(**tagValues)
+
+class TestTagsValuesModule(unittest.TestCase):
+    def test_AudioFileTags_EqualityAndHash(self):
+        '''
+        Tests that tags objects are compared and hashed by their values, and that they have no
+        __dict__.
+        '''
+        tags = getTestTags('title', 'artist', {'mood': 'happy'})
+        sameTags = getTestTags('title', 'artist', {'mood': 'happy'})
+        otherTags = getTestTags('title', 'artist', {'mood': 'sad'})
+
+        self.assertEqual(tags, sameTags)
+        self.assertNotEqual(tags, otherTags)
+        self.assertEqual(hash(tags), hash(sameTags))
+        self.assertEqual(2, len({tags, sameTags, otherTags}))
+        self.assertFalse(hasattr(tags, '__dict__'))
+
+        self.assertEqual(tags, pickle.loads(pickle.dumps(tags)))
+        self.assertEqual(tags, tags.copy())
+
+    def test_AudioFileTags_Lazy(self):
+        '''
+        Tests that the fields of a lazy tags object are only decoded when they are accessed.
+        '''
+        decodedFieldNames = []
+        def decodeField(fieldName):
+            decodedFieldNames.append(fieldName)
+            return {} if (fieldName == 'OTHER_TAGS') else fieldName.upper()
+
+        tags = mlu.tags.values.AudioFileTags.createLazy(mlu.tags.values.LazyFieldDecoder(decodeField))
+        self.assertEqual('TITLE', tags.title)
+        self.assertEqual('TITLE', tags.copy().title)
+        self.assertEqual(['title'], decodedFieldNames)
+        self.assertFalse(tags.isDecoded('artist'))
+
+        tags.detach()
+        self.assertEqual(len(mlu.tags.values.AudioFileTags.FIELD_NAMES), len(decodedFieldNames))
+        self.assertEqual('ARTIST', tags.artist)
+
+    def test_AudioFileTagsBatch(self):
+        '''
+        Tests that tags stored in a batch are returned unchanged, with repeated values pooled.
+        '''
+        tagsList = [
+            getTestTags('one', 'artist'),
+            getTestTags('two', 'artist', {'mood': 'happy'}),
+            getTestTags('three', 'other artist')
+        ]
+        batch = mlu.tags.values.AudioFileTagsBatch(tagsList)
+
+        self.assertEqual(3, len(batch))
+        self.assertEqual(tagsList, list(batch))
+        self.assertEqual('two', batch.getValue(1, 'title'))
+        self.assertEqual({'mood': 'happy'}, batch.getValue(1, 'OTHER_TAGS'))
+        self.assertEqual(['artist', 'other artist'], batch.getColumn('artist').pool)
+        self.assertEqual([0, 1], batch.findRows('artist', 'artist'))
+        self.assertEqual([], batch.findRows('artist', 'nobody'))
+
+if __name__ == '__main__':
+    unittest.main()
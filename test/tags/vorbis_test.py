@@ -0,0 +1,49 @@
+'''
+Tests for mlu.tags.audiofmt.vorbis
+
+'''
+
+import unittest
+import sys
+import os
+
+# Add project root to PYTHONPATH so MLU modules can be imported
+scriptPath = os.path.dirname(os.path.realpath(__file__))
+projectRoot = os.path.abspath(os.path.join(scriptPath ,"../.."))
+sys.path.insert(0, projectRoot)
+
+from mlu.tags import values
+import mlu.tags.audiofmt.vorbis
+
+class TestTagsVorbisModule(unittest.TestCase):
+    def test_decodeVorbisComment(self):
+        '''
+        Tests decoding a comment block: keys in any case, repeated keys, custom and ignored keys.
+        '''
+        vorbisComment = [
+            ('TITLE', 'Title'),
+            ('Artist', 'Artist 1'),
+            ('artist', 'Artist 2'),
+            ('PLAY_COUNT', '3'),
+            ('REPLAYGAIN_TRACK_GAIN', '-6.00 dB'),
+            ('Mood', 'happy'),
+            ('MOOD', 'calm')
+        ]
+
+        fieldValues = mlu.tags.audiofmt.vorbis.decodeVorbisComment(vorbisComment)
+
+        self.assertEqual(set(values.AUDIO_FILE_TAGS_FIELDS + ['OTHER_TAGS']), set(fieldValues))
+        self.assertEqual('Title', fieldValues['title'])
+        self.assertEqual('Artist 1;Artist 2', fieldValues['artist'])
+        self.assertEqual('3', fieldValues['playCount'])
+        self.assertEqual('', fieldValues['album'])
+        self.assertEqual({'mood': 'happy;calm'}, fieldValues['OTHER_TAGS'])
+
+    def test_decodeVorbisComment_Empty(self):
+        fieldValues = mlu.tags.audiofmt.vorbis.decodeVorbisComment([])
+
+        self.assertEqual('', fieldValues['title'])
+        self.assertEqual({}, fieldValues['OTHER_TAGS'])
+
+if __name__ == '__main__':
+    unittest.main()